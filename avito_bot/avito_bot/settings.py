@@ -137,6 +137,7 @@ For the full list of settings and their values, see
 https://docs.djangoproject.com/en/5.1/ref/settings/
 """
 
+import os
 from pathlib import Path
 
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
@@ -175,13 +176,16 @@ MIDDLEWARE = [
     'django.contrib.auth.middleware.AuthenticationMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
+    # Время обработки запросов для /metrics и профилирование медленных запросов (BOT_PROFILE=1)
+    'bot.middleware.MetricsMiddleware',
 ]
 
 ROOT_URLCONF = 'avito_bot.urls'
 
 TEMPLATES = [
     {
-        'BACKEND': 'django.template.backends.django.DjangoTemplates',
+        # DjangoTemplates с записью времени отрисовки шаблонов в метрики
+        'BACKEND': 'bot.template_backends.TimedDjangoTemplates',
         'DIRS': [],
         'APP_DIRS': True,
         'OPTIONS': {
@@ -205,6 +209,39 @@ DATABASES = {
     'default': {
         'ENGINE': 'django.db.backends.sqlite3',
         'NAME': BASE_DIR / 'db.sqlite3',
+        # Тестовая база — файл, а не общая память: в памяти одновременная запись из потоков
+        # падает с 'database table is locked' без ожидания busy_timeout
+        'TEST': {'NAME': BASE_DIR / 'test_db.sqlite3'},
+    }
+}
+
+# Режим SQLite для одновременной записи из нескольких процессов (веб, воркеры, мониторинг):
+# WAL — читатели не блокируют писателя, synchronous=NORMAL — fsync только при контрольной точке WAL,
+# busy_timeout — ожидание блокировки вместо немедленной ошибки 'database is locked',
+# IMMEDIATE — пишущая транзакция берёт блокировку сразу, без взаимоблокировки при её повышении.
+# Отключается BOT_SQLITE_TUNED=0. Очередь записи с одним писателем — см. bot/db_writer.py.
+if os.getenv('BOT_SQLITE_TUNED', '1') == '1':
+    DATABASES['default']['OPTIONS'] = {
+        'init_command': (
+            'PRAGMA journal_mode=WAL;'
+            'PRAGMA synchronous=NORMAL;'
+            'PRAGMA busy_timeout=5000;'
+            'PRAGMA mmap_size=268435456;'
+            'PRAGMA cache_size=-65536;'
+            'PRAGMA temp_store=MEMORY;'
+        ),
+        'transaction_mode': 'IMMEDIATE',
+    }
+
+
+# Cache
+# Файловый кэш общий для всех процессов на сервере: в нём хранится токен Avito API
+# (см. bot/tokens.py). Для нескольких серверов замените на Redis/Memcached.
+
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+        'LOCATION': BASE_DIR / 'cache',
     }
 }
 
@@ -275,6 +312,29 @@ ADMINS = [
 
 
 
+# Лог приложения (bot.log): JSON-строки. Запись идёт через очередь в фоновом потоке,
+# поэтому обработчики запросов не ждут диска. В файл пишут несколько процессов, поэтому
+# ротирует его внешний logrotate (см. bot.log_handlers), а не сами процессы. Где logrotate
+# нет (разработка под Windows), BOT_LOG_MAX_BYTES включает ротацию по размеру — только
+# для одного процесса. Уровни задаются для каждого модуля отдельно в разделе 'loggers'.
+# Пути для тестов переопределяет avito_bot.test_settings.
+BOT_LOG_FILE = Path(os.getenv('BOT_LOG_FILE', BASE_DIR / 'bot.log'))
+BOT_LOG_LEVEL = os.getenv('BOT_LOG_LEVEL', 'INFO')
+BOT_LOG_MAX_BYTES = int(os.getenv('BOT_LOG_MAX_BYTES', '0'))
+
+# Кэш HTTP-ответов (bot.http_cache)
+HTTP_CACHE_PATH = Path(os.getenv('AVITO_HTTP_CACHE_PATH', BASE_DIR / 'http_cache.sqlite3'))
+
+# Снимки метрик процессов (bot.metrics) и профили медленных запросов (bot.profiling).
+# Каталоги задаются от BASE_DIR: процессы, запущенные из другого каталога (cron, воркеры),
+# пишут туда же, откуда читает /metrics.
+METRICS_DIR = Path(os.getenv('BOT_METRICS_DIR', BASE_DIR / 'metrics'))
+PROFILE_DIR = Path(os.getenv('BOT_PROFILE_DIR', BASE_DIR / 'profiles'))
+
+# Архив старых объявлений и журнала (bot.archive): от BASE_DIR, чтобы archive и scan_archive,
+# запущенные из разных каталогов, работали с одним архивом
+ARCHIVE_DIR = Path(os.getenv('BOT_ARCHIVE_DIR', BASE_DIR / 'archive'))
+
 LOGGING = {
     'version': 1,
     'disable_existing_loggers': False,
@@ -304,6 +364,11 @@ LOGGING = {
             'level': 'ERROR',
             'class': 'django.utils.log.AdminEmailHandler',
         },
+        'bot_file': {
+            '()': 'bot.log_handlers.QueueingFileHandler',
+            'filename': BOT_LOG_FILE,
+            'max_bytes': BOT_LOG_MAX_BYTES,
+        },
     },
     'loggers': {
         'django': {
@@ -311,5 +376,18 @@ LOGGING = {
             'level': 'ERROR',
             'propagate': True,
         },
+        'bot': {
+            'handlers': ['bot_file'],
+            'level': BOT_LOG_LEVEL,
+            'propagate': False,
+        },
+        'bot.http_cache': {
+            'level': 'WARNING',
+        },
+        'urllib3': {
+            'handlers': ['bot_file'],
+            'level': 'WARNING',
+            'propagate': False,
+        },
     },
 }
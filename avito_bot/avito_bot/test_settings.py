@@ -0,0 +1,18 @@
+"""Настройки для тестов: рабочие настройки с временными путями для лога, кэша HTTP-ответов и метрик.
+
+manage.py test выбирает их сам; для других запускателей (pytest, python -m django test)
+задайте DJANGO_SETTINGS_MODULE=avito_bot.test_settings.
+"""
+import tempfile
+from pathlib import Path
+
+from .settings import *  # noqa: F401,F403
+from .settings import LOGGING
+
+BOT_LOG_FILE = Path(tempfile.gettempdir()) / 'avito_bot_test.log'
+LOGGING['handlers']['bot_file'].update(filename=BOT_LOG_FILE, max_bytes=0)
+
+# Загрузки, которые ещё выполняются после возврата из поиска, не должны попадать в рабочий кэш
+HTTP_CACHE_PATH = Path(tempfile.gettempdir()) / 'avito_bot_test_http_cache.sqlite3'
+
+METRICS_DIR = Path(tempfile.mkdtemp(prefix='avito_bot_test_metrics_'))
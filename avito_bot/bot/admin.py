@@ -1,9 +1,115 @@
 from django.contrib import admin
-from .models import Keyword, Message, LogEntry, AvitoAd
+from django.contrib.admin.views.main import PAGE_VAR
+from django.core.paginator import Paginator
+from django.db.models import Max, Min
+from django.utils.functional import cached_property
+from .models import Keyword, Message, LogEntry, AvitoAd, PriceRollup
+
+# Параметр URL с курсором постраничного просмотра: id последней строки предыдущей страницы
+CURSOR_VAR = 'after'
+# Начиная с этого числа строк точный COUNT(*) заменяется оценкой
+ESTIMATED_COUNT_THRESHOLD = 10000
+
+
+class EstimatedCountPaginator(Paginator):
+    """Пагинатор, который не считает большие таблицы целиком.
+
+    Для выборки без фильтров число строк оценивается по диапазону первичного ключа
+    (MIN/MAX по индексу). Для выборки с фильтрами подсчёт ограничивается
+    ESTIMATED_COUNT_THRESHOLD строками.
+    """
+
+    @cached_property
+    def count(self):
+        queryset = self.object_list
+        if not queryset.query.where:
+            bounds = queryset.model._default_manager.aggregate(low=Min('pk'), high=Max('pk'))
+            if bounds['high'] is None:
+                return 0
+            estimate = bounds['high'] - bounds['low'] + 1
+            if estimate > ESTIMATED_COUNT_THRESHOLD:
+                return estimate
+        return queryset.values('pk')[:ESTIMATED_COUNT_THRESHOLD + 1].count()
+
+
+class KeysetPaginationMixin:
+    """Постраничный просмотр списка по курсору (pk < after) вместо OFFSET.
+
+    Список всегда упорядочен по убыванию pk, поэтому следующая страница
+    читается по индексу первичного ключа с любой глубины без сканирования
+    пропущенных строк.
+    """
+
+    change_list_template = 'admin/bot/keyset_change_list.html'
+    ordering = ('-pk',)
+    sortable_by = ()
+    paginator = EstimatedCountPaginator
+    show_full_result_count = False
+
+    def changelist_view(self, request, extra_context=None):
+        cursor = request.GET.get(CURSOR_VAR)
+        if cursor is not None:
+            # ChangeList считает незнакомые параметры фильтрами, поэтому убираем курсор из GET
+            request.GET = request.GET.copy()
+            del request.GET[CURSOR_VAR]
+        request.keyset_cursor = int(cursor) if cursor and cursor.isdigit() else None
+
+        response = super().changelist_view(request, extra_context)
+
+        context = getattr(response, 'context_data', None) or {}
+        cl = context.get('cl')
+        if cl is not None:
+            results = list(cl.result_list)
+            cl.keyset_next_url = None
+            if len(results) >= cl.list_per_page:
+                cl.keyset_next_url = cl.get_query_string({CURSOR_VAR: results[-1].pk}, [PAGE_VAR])
+            cl.keyset_first_url = cl.get_query_string(remove=[PAGE_VAR]) if request.keyset_cursor else None
+        return response
+
+    def get_queryset(self, request):
+        queryset = super().get_queryset(request)
+        cursor = getattr(request, 'keyset_cursor', None)
+        if cursor is not None:
+            queryset = queryset.filter(pk__lt=cursor)
+        return queryset
+
+
+class PriceRangeFilter(admin.SimpleListFilter):
+    """Фильтр по диапазонам цены (использует индекс по price) вместо списка всех различных цен."""
+    title = 'цена'
+    parameter_name = 'price_range'
+
+    RANGES = {
+        'lt100k': (None, 100000),
+        '100k-1m': (100000, 1000000),
+        '1m-10m': (1000000, 10000000),
+        'gte10m': (10000000, None),
+    }
+
+    def lookups(self, request, model_admin):
+        return [
+            ('lt100k', 'до 100 тыс.'),
+            ('100k-1m', '100 тыс. – 1 млн'),
+            ('1m-10m', '1 – 10 млн'),
+            ('gte10m', 'от 10 млн'),
+        ]
+
+    def queryset(self, request, queryset):
+        if self.value() not in self.RANGES:
+            return queryset
+        low, high = self.RANGES[self.value()]
+        if low is not None:
+            queryset = queryset.filter(price__gte=low)
+        if high is not None:
+            queryset = queryset.filter(price__lt=high)
+        return queryset
+
 
 @admin.register(Keyword)
 class KeywordAdmin(admin.ModelAdmin):
-    list_display = ('word', 'created_at')
+    list_display = ('word', 'is_active', 'crawl_interval', 'new_ads_rate', 'next_run_at', 'created_at')
+    list_filter = ('is_active',)
+    list_editable = ('is_active',)
     search_fields = ('word',)
 
 @admin.register(Message)
@@ -12,12 +118,29 @@ class MessageAdmin(admin.ModelAdmin):
     search_fields = ('content',)
 
 @admin.register(LogEntry)
-class LogEntryAdmin(admin.ModelAdmin):
-    list_display = ('keyword', 'message', 'response', 'created_at')
-    search_fields = ('keyword__word', 'message__content', 'response')
+class LogEntryAdmin(KeysetPaginationMixin, admin.ModelAdmin):
+    list_display = ('keyword', 'message', 'status', 'response', 'created_at')
+    list_select_related = ('keyword', 'message')
+    # Точное совпадение по ключевому слову вместо icontains по TextField
+    search_fields = ('=keyword__word', '=item_id')
+    date_hierarchy = 'created_at'
+    list_filter = ('status', 'created_at')
+    raw_id_fields = ('keyword', 'message')
 
 @admin.register(AvitoAd)
-class AvitoAdAdmin(admin.ModelAdmin):
-    list_display = ('title', 'keyword', 'price', 'created_at')
-    search_fields = ('title', 'description', 'keyword__word')
-    list_filter = ('created_at', 'price')
+class AvitoAdAdmin(KeysetPaginationMixin, admin.ModelAdmin):
+    list_display = ('title', 'keyword', 'price', 'price_period', 'cluster_id', 'created_at')
+    list_select_related = ('keyword',)
+    search_fields = ('=item_id', '=keyword__word', '=cluster_id', '=seller_id')
+    date_hierarchy = 'created_at'
+    list_filter = ('created_at', PriceRangeFilter)
+    raw_id_fields = ('keyword',)
+    exclude = ('minhash',)
+
+@admin.register(PriceRollup)
+class PriceRollupAdmin(admin.ModelAdmin):
+    list_display = ('keyword', 'day', 'region', 'price_period', 'count', 'median_price', 'p90_price')
+    list_select_related = ('keyword',)
+    list_filter = ('price_period', 'day')
+    date_hierarchy = 'day'
+    raw_id_fields = ('keyword',)
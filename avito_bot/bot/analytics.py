@@ -0,0 +1,203 @@
+"""Нормализация цен и сводки цен по ключевым словам (PriceRollup).
+
+Цены приходят текстом: '1 200 000 ₽', '85 000 ₽ в месяц', '1,5 млн ₽',
+'2 500 ₽ за сутки', 'Не указано'. normalize_prices() разбирает сразу
+весь пакет: тексты склеиваются в одну строку, и первое число каждого
+текста находит один проход регулярного выражения, без цикла по строкам
+в Python; множители единиц (тыс., млн, млрд) и период (сутки и год
+приводятся к месяцу) применяются векторно в NumPy.
+
+Сводки (число, минимум, медиана, p90, среднее) хранятся по ключевому
+слову, дню, региону (первый сегмент пути URL) и периоду цены. После
+сохранения объявлений пересчитываются только затронутые группы
+(ключевое слово, день, регион, период) — и те, куда объявление попало,
+и те, откуда оно ушло при обновлении; выбросы отсекаются по межквартильному размаху.
+Представление аналитики читает только PriceRollup, поэтому его стоимость
+не зависит от числа объявлений.
+"""
+import logging
+import re
+from collections import defaultdict
+from datetime import datetime, time as dt_time, timedelta
+from decimal import Decimal
+from functools import lru_cache
+from urllib.parse import urlsplit
+
+import numpy as np
+from django.db.models import Q
+from django.db.models.functions import TruncDate
+from django.utils import timezone
+
+from .models import AvitoAd, PriceRollup
+
+logger = logging.getLogger(__name__)
+
+# Разделитель текстов цен при разборе пакета одной строкой
+TEXT_SEPARATOR = '\x00'
+# Первое число каждого текста в склеенной строке (или пустая группа, если числа нет):
+# число с разделителями разрядов — '1 200 000', '1,5' (\s покрывает и неразрывные пробелы)
+FIRST_NUMBER_RE = re.compile(r'(?:^|(?<=\x00))[^\d\x00]*(\d[\d\s]*(?:[.,]\d+)?)?[^\x00]*')
+WHITESPACE_RE = re.compile(r'\s+')
+
+UNIT_MULTIPLIERS = [('млрд', 1e9), ('млн', 1e6), ('тыс', 1e3)]
+PERIOD_MONTH = 'month'
+PERIOD_SQM = 'sqm'
+# Коэффициенты приведения к цене за месяц
+PERIOD_TO_MONTH = [('сутки', 30.0), ('день', 30.0), ('недел', 30.0 / 7), ('год', 1 / 12), ('мес', 1.0)]
+# Границы отсечения выбросов: [Q1 - k·IQR, Q3 + k·IQR]
+OUTLIER_IQR_FACTOR = 3.0
+# Сколько групп сводок выбирать и удалять одним запросом
+ROLLUP_QUERY_BATCH = 100
+
+
+def normalize_prices(texts):
+    """Разбирает тексты цен. Возвращает (values, periods): float64 с NaN, где цены нет, и массив периодов."""
+    texts = np.array([(text or '').replace(TEXT_SEPARATOR, ' ') for text in texts], dtype=str)
+    if not texts.size:
+        return np.array([], dtype=float), np.array([], dtype='<U8')
+    lower = np.char.lower(texts)
+
+    found = FIRST_NUMBER_RE.findall(TEXT_SEPARATOR.join(lower.tolist()))
+    numbers = np.array(WHITESPACE_RE.sub('', TEXT_SEPARATOR.join(found)).replace(',', '.').split(TEXT_SEPARATOR))
+    values = np.where(numbers == '', 'nan', numbers).astype(float)
+
+    multiplier = np.ones(values.shape)
+    for unit, factor in UNIT_MULTIPLIERS:
+        multiplier = np.where((np.char.find(lower, unit) >= 0) & (multiplier == 1), factor, multiplier)
+    values = values * multiplier
+
+    periods = np.full(values.shape, '', dtype='<U8')
+    per_period = (np.char.find(lower, ' в ') >= 0) | (np.char.find(lower, ' за ') >= 0)
+    for word, factor in PERIOD_TO_MONTH:
+        mask = per_period & (np.char.find(lower, word) >= 0) & (periods == '')
+        values = np.where(mask, values * factor, values)
+        periods[mask] = PERIOD_MONTH
+    sqm = (np.char.find(lower, 'м²') >= 0) & (np.char.find(lower, 'за м') >= 0)
+    periods[sqm] = PERIOD_SQM
+    return np.round(values, 2), periods
+
+
+def clip_outliers(values):
+    """Ограничивает значения границами [Q1 - k·IQR, Q3 + k·IQR]."""
+    if values.size < 4:
+        return values
+    q1, q3 = np.percentile(values, [25, 75])
+    spread = (q3 - q1) * OUTLIER_IQR_FACTOR
+    return np.clip(values, q1 - spread, q3 + spread)
+
+
+def summarize(values):
+    """Число, минимум, медиана, p90 и среднее (после отсечения выбросов) для массива цен."""
+    values = values[~np.isnan(values)]
+    if not values.size:
+        return None
+    clipped = clip_outliers(values)
+    median, p90 = np.percentile(clipped, [50, 90])
+    return {
+        'count': int(values.size),
+        'min_price': _decimal(values.min()),
+        'median_price': _decimal(median),
+        'p90_price': _decimal(p90),
+        'mean_price': _decimal(clipped.mean()),
+    }
+
+
+def _decimal(value):
+    return Decimal(str(round(float(value), 2)))
+
+
+# Один и тот же URL разбирается при сохранении дважды: для группы новой строки и при пересчёте сводки
+@lru_cache(maxsize=65536)
+def region_from_url(url):
+    """Регион объявления — первый сегмент пути URL ('/moskva/...' -> 'moskva')."""
+    path = urlsplit(url or '').path.strip('/')
+    return path.split('/', 1)[0] if path else ''
+
+
+def _day_bounds(day):
+    start = timezone.make_aware(datetime.combine(day, dt_time.min), timezone.get_current_timezone())
+    return start, start + timedelta(days=1)
+
+
+def rollup_group(keyword_id, day, url, price_period):
+    """Группа сводки, в которую попадает объявление: (keyword_id, день, регион, период)."""
+    return keyword_id, day, region_from_url(url), price_period
+
+
+def _group_ads(keyword_id, day, region, price_period):
+    start, end = _day_bounds(day)
+    condition = Q(keyword_id=keyword_id, created_at__gte=start, created_at__lt=end, price_period=price_period)
+    if region:
+        # Регион — первый сегмент пути URL; условие по url только сужает выборку, группа проверяется в Python
+        condition &= Q(url__contains=f'/{region}')
+    return condition
+
+
+def update_rollups(groups):
+    """Пересчитывает сводки групп (keyword_id, день, регион, период). Возвращает число записанных строк PriceRollup.
+
+    Выбираются только объявления этих групп; группа, в которой не осталось цен, удаляется.
+    """
+    groups = sorted(set(groups))
+    written = 0
+    for start in range(0, len(groups), ROLLUP_QUERY_BATCH):
+        batch = groups[start:start + ROLLUP_QUERY_BATCH]
+        wanted = set(batch)
+        condition = Q()
+        for group in batch:
+            condition |= _group_ads(*group)
+        prices = defaultdict(list)
+        rows = (
+            AvitoAd.objects.filter(condition, price__isnull=False)
+            .annotate(day=TruncDate('created_at'))
+            .values_list('keyword_id', 'day', 'url', 'price_period', 'price')
+        )
+        for keyword_id, day, url, period, price in rows.iterator():
+            group = rollup_group(keyword_id, day, url, period)
+            if group in wanted:
+                prices[group].append(price)
+
+        rollups = []
+        for (keyword_id, day, region, period), values in prices.items():
+            summary = summarize(np.array(values, dtype=float))
+            if summary:
+                rollups.append(PriceRollup(keyword_id=keyword_id, day=day, region=region, price_period=period,
+                                           **summary))
+        stale = Q()
+        for keyword_id, day, region, period in batch:
+            stale |= Q(keyword_id=keyword_id, day=day, region=region, price_period=period)
+        PriceRollup.objects.filter(stale).delete()
+        PriceRollup.objects.bulk_create(rollups, batch_size=500)
+        written += len(rollups)
+    return written
+
+
+def saved_groups(keyword_ids, item_ids):
+    """Группы сводок уже сохранённых объявлений: (keyword_id, item_id) -> группа."""
+    rows = (
+        AvitoAd.objects.filter(keyword_id__in=keyword_ids, item_id__in=item_ids)
+        .annotate(day=TruncDate('created_at'))
+        .values_list('keyword_id', 'item_id', 'day', 'url', 'price_period')
+    )
+    return {
+        (keyword_id, item_id): rollup_group(keyword_id, day, url, period)
+        for keyword_id, item_id, day, url, period in rows
+    }
+
+
+def rebuild_rollups(keyword_ids=None):
+    """Пересчитывает все сводки по объявлениям, которые есть в базе. Возвращает число строк PriceRollup."""
+    ads = AvitoAd.objects.filter(price__isnull=False).annotate(day=TruncDate('created_at'))
+    rollups = PriceRollup.objects.all()
+    if keyword_ids:
+        ads = ads.filter(keyword_id__in=keyword_ids)
+        rollups = rollups.filter(keyword_id__in=keyword_ids)
+    groups = {
+        rollup_group(keyword_id, day, url, period)
+        for keyword_id, day, url, period in ads.values_list('keyword_id', 'day', 'url', 'price_period').iterator()
+    }
+    # Сводки групп, в которых объявлений больше нет, тоже удаляются
+    rollups.delete()
+    written = update_rollups(groups)
+    logger.info(f"Сводки цен пересчитаны: групп {len(groups)}, строк {written}")
+    return written
@@ -0,0 +1,186 @@
+"""Архивирование старых объявлений и записей журнала рассылки в сжатые файлы.
+
+Строки AvitoAd и LogEntry старше заданного возраста переносятся в файлы
+JSON Lines, сжатые gzip, с разбиением по месяцу и ключевому слову:
+
+    <settings.ARCHIVE_DIR>/<таблица>/month=YYYY-MM/keyword=<id>/part-<время>-<pid>.jsonl.gz
+
+Каталог задаётся BOT_ARCHIVE_DIR, по умолчанию archive/ рядом с manage.py.
+
+Каждая порция (ARCHIVE_CHUNK_SIZE строк) дописывается в файл отдельным
+gzip-членом и сбрасывается на диск, и только после этого её строки удаляются
+из базы короткой транзакцией. Если процесс упадёт посередине, строки
+недописанной порции останутся в базе и попадут в архив при следующем запуске;
+обрывок в конце файла читается до места обрыва, поэтому такие строки могут
+встретиться при чтении дважды (у каждой строки есть id).
+
+В архив попадают все столбцы таблицы, кроме производных (подпись MinHash
+пересчитывается из текста); у объявлений — ещё и id заданий, которые их нашли.
+
+scan_archive() читает архив потоково, отбрасывая разделы по имени каталога,
+без загрузки обратно в SQLite.
+"""
+import gzip
+import json
+import logging
+import os
+import time
+from datetime import date, datetime, timedelta
+from decimal import Decimal
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models.functions import TruncMonth
+from django.utils import timezone
+
+from .models import AvitoAd, JobAd, Keyword, LogEntry
+
+logger = logging.getLogger(__name__)
+
+ARCHIVE_DIR = settings.ARCHIVE_DIR
+ARCHIVE_AFTER_DAYS = int(os.getenv('BOT_ARCHIVE_AFTER_DAYS', '180'))
+ARCHIVE_CHUNK_SIZE = 1000
+# Пауза между порциями, чтобы другие процессы успевали писать в базу
+ARCHIVE_CHUNK_PAUSE = 0.05
+
+
+def archive_fields(model, skip=()):
+    """Столбцы модели для архива: все хранимые поля (внешние ключи — как <поле>_id), кроме skip."""
+    return [field.attname for field in model._meta.concrete_fields if field.name not in skip]
+
+
+def _job_ids(pks):
+    """id заданий по объявлениям: связи JobAd удаляются вместе с объявлением, поэтому сохраняются в строке."""
+    job_ids = {}
+    for ad_id, job_id in JobAd.objects.filter(ad_id__in=pks).order_by('pk').values_list('ad_id', 'job_id'):
+        job_ids.setdefault(ad_id, []).append(job_id)
+    return {'job_ids': job_ids}
+
+
+ARCHIVE_TABLES = {
+    'ads': {
+        'model': AvitoAd,
+        'fields': archive_fields(AvitoAd, skip={'minhash'}),
+        'exclude': {},
+        'related': _job_ids,
+    },
+    'logs': {
+        'model': LogEntry,
+        'fields': archive_fields(LogEntry),
+        # Незавершённые отправки остаются в базе: по ним ещё работает ключ идемпотентности
+        'exclude': {'status__in': [LogEntry.STATUS_PENDING, LogEntry.STATUS_SENDING]},
+    },
+}
+
+
+def _json_default(value):
+    if isinstance(value, Decimal):
+        return str(value)
+    if isinstance(value, (datetime, date)):
+        return value.isoformat()
+    raise TypeError(f"Не удаётся сохранить в архив значение типа {type(value).__name__}")
+
+
+def _month_bounds(month):
+    start = month.replace(day=1, hour=0, minute=0, second=0, microsecond=0)
+    end = (start + timedelta(days=32)).replace(day=1)
+    return start, end
+
+
+def partition_dir(table, month, keyword_id, root=None):
+    return (root or ARCHIVE_DIR) / table / f"month={month:%Y-%m}" / f"keyword={keyword_id}"
+
+
+def _append_chunk(path, rows):
+    """Дописывает порцию строк в файл отдельным gzip-членом и сбрасывает его на диск."""
+    payload = ''.join(json.dumps(row, ensure_ascii=False, default=_json_default) + '\n' for row in rows)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    with open(path, 'ab') as f:
+        f.write(gzip.compress(payload.encode('utf-8')))
+        f.flush()
+        os.fsync(f.fileno())
+
+
+def archive_table(table, older_than_days=ARCHIVE_AFTER_DAYS, chunk_size=ARCHIVE_CHUNK_SIZE, root=None,
+                  dry_run=False):
+    """Переносит строки таблицы старше older_than_days дней в архив. Возвращает число перенесённых строк."""
+    config = ARCHIVE_TABLES[table]
+    model = config['model']
+    cutoff = timezone.now() - timedelta(days=older_than_days)
+    old_rows = model.objects.filter(created_at__lt=cutoff).exclude(**config['exclude'])
+
+    partitions = list(
+        old_rows.annotate(month=TruncMonth('created_at'))
+        .values_list('month', 'keyword_id').distinct().order_by('month', 'keyword_id')
+    )
+    if dry_run:
+        count = old_rows.count()
+        logger.info(f"Архивирование {table}: {count} строк в {len(partitions)} разделах (пробный запуск)")
+        return count
+
+    words = dict(Keyword.objects.filter(pk__in={keyword_id for _, keyword_id in partitions})
+                 .values_list('pk', 'word'))
+    part_name = f"part-{int(time.time())}-{os.getpid()}.jsonl.gz"
+    moved = 0
+    for month, keyword_id in partitions:
+        start, end = _month_bounds(month)
+        path = partition_dir(table, month, keyword_id, root) / part_name
+        rows = old_rows.filter(keyword_id=keyword_id, created_at__gte=start, created_at__lt=end).order_by('pk')
+        last_pk = 0
+        while True:
+            chunk = list(rows.filter(pk__gt=last_pk).values(*config['fields'])[:chunk_size])
+            if not chunk:
+                break
+            related = config['related']([row['id'] for row in chunk]) if 'related' in config else {}
+            for row in chunk:
+                row['keyword'] = words.get(keyword_id, '')
+                for name, values in related.items():
+                    row[name] = values.get(row['id'], [])
+            _append_chunk(path, chunk)
+            last_pk = chunk[-1]['id']
+            with transaction.atomic():
+                model.objects.filter(pk__in=[row['id'] for row in chunk]).delete()
+            moved += len(chunk)
+            time.sleep(ARCHIVE_CHUNK_PAUSE)
+        logger.info(f"Архивирование {table}: раздел {month:%Y-%m}/{keyword_id} перенесён в {path}")
+    logger.info(f"Архивирование {table}: перенесено строк {moved}")
+    return moved
+
+
+def _read_part(path):
+    """Строки одного файла архива; оборванный последний gzip-член читается до места обрыва."""
+    try:
+        with gzip.open(path, 'rt', encoding='utf-8') as f:
+            for line in f:
+                if line.endswith('\n'):
+                    yield json.loads(line)
+    except (EOFError, gzip.BadGzipFile, OSError) as e:
+        logger.warning(f"Файл архива {path} прочитан не полностью: {e}")
+
+
+def scan_archive(table, since=None, until=None, keyword_ids=None, root=None):
+    """Потоково перебирает строки архива таблицы.
+
+    since/until (date или datetime) и keyword_ids отбирают разделы по имени каталога,
+    поэтому ненужные файлы даже не открываются; внутри раздела строки фильтруются по created_at.
+    """
+    table_dir = (root or ARCHIVE_DIR) / table
+    since_month = f"{since:%Y-%m}" if since else None
+    until_month = f"{until:%Y-%m}" if until else None
+    keyword_ids = {str(keyword_id) for keyword_id in keyword_ids} if keyword_ids else None
+
+    for month_dir in sorted(table_dir.glob('month=*')):
+        month = month_dir.name.split('=', 1)[1]
+        if (since_month and month < since_month) or (until_month and month > until_month):
+            continue
+        for keyword_dir in sorted(month_dir.glob('keyword=*')):
+            if keyword_ids is not None and keyword_dir.name.split('=', 1)[1] not in keyword_ids:
+                continue
+            for path in sorted(keyword_dir.glob('*.jsonl.gz')):
+                for row in _read_part(path):
+                    created_at = row['created_at']
+                    if since and created_at < since.isoformat():
+                        continue
+                    if until and created_at >= until.isoformat():
+                        continue
+                    yield row
@@ -0,0 +1,126 @@
+"""Объявления своего аккаунта через Avito API.
+
+Использует токен client_credentials из bot.tokens (права items:info, seller:read)
+и метод GET /core/v1/items с максимальным размером страницы. Страницы
+загружаются параллельно с опережением, как и в scrape_avito_listings, а
+результат имеет ту же структуру: title, price, url, item_id, keyword.
+
+Ограничение: /core/v1/items возвращает только объявления аккаунта, которому
+выдан токен, а метода поиска по всем объявлениям Avito в публичном API нет.
+Поэтому это не замена парсингу выдачи: источник 'api' ищет ключевые слова
+только среди своих объявлений, сопоставляя их с заголовком на нашей стороне.
+"""
+import logging
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+from .http_client import get_client
+from .tokens import token_manager
+from . import utils
+
+logger = logging.getLogger(__name__)
+
+# Максимальный размер страницы, который принимает /core/v1/items
+ITEMS_PER_PAGE = 100
+ITEMS_PATH = '/core/v1/items'
+
+
+class AvitoApiError(Exception):
+    """Ошибка обращения к Avito API."""
+
+
+def format_price(value):
+    """Форматирует числовую цену из API так же, как она выглядит на сайте: '1 200 000 ₽'."""
+    if value in (None, '', 0):
+        return 'Не указано'
+    return f"{int(value):,} ₽".replace(',', ' ')
+
+
+def fetch_items_page(session, token, page, per_page):
+    """Загружает одну страницу списка объявлений. Возвращает список resources."""
+    response = session.get(
+        f"{utils.AVITO_API_BASE_URL}{ITEMS_PATH}",
+        params={'page': page, 'per_page': per_page},
+        headers={'Authorization': f'Bearer {token}'},
+        timeout=60,
+    )
+    logger.info(f"API: страница {page}, статус-код {response.status_code}")
+    response.raise_for_status()
+    return response.json().get('resources', [])
+
+
+def _to_ad(item, keyword):
+    return {
+        'title': item.get('title') or 'Без названия',
+        'price': format_price(item.get('price')),
+        'url': item.get('url') or '#',
+        'item_id': str(item['id']) if item.get('id') is not None else None,
+        'keyword': keyword,
+    }
+
+
+def _match_keyword(title, keyword_list):
+    """Первое ключевое слово, все слова которого встречаются в заголовке, или None."""
+    title = title.lower()
+    for keyword in keyword_list:
+        if all(word in title for word in keyword.lower().split()):
+            return keyword
+    return None
+
+
+def fetch_api_listings(keyword_list, max_pages=20, max_ads=10, on_page=None, per_page=ITEMS_PER_PAGE):
+    """Возвращает объявления своего аккаунта из API, подходящие под ключевые слова.
+
+    Страницы загружаются параллельно (не более MAX_CONCURRENCY_PER_HOST запросов),
+    обрабатываются строго по порядку; загрузка прекращается на первой неполной
+    странице или после набора max_ads. on_page вызывается как on_page(keyword, page, ads).
+    """
+    token = token_manager.get_token()
+    if not token:
+        raise AvitoApiError("Нет действительного access_token для Avito API")
+
+    session = get_client('avito_api')
+    window = utils.MAX_CONCURRENCY_PER_HOST
+    all_ads = []
+    executor = ThreadPoolExecutor(max_workers=window)
+    pending = deque()
+    next_page = 1
+
+    def submit_more():
+        nonlocal next_page
+        while len(pending) < window and next_page <= max_pages:
+            pending.append((next_page, executor.submit(fetch_items_page, session, token, next_page, per_page)))
+            next_page += 1
+
+    try:
+        submit_more()
+        while pending:
+            page, future = pending.popleft()
+            try:
+                items = future.result()
+            except Exception as e:
+                raise AvitoApiError(f"Ошибка загрузки страницы {page}: {e}") from e
+
+            ads = []
+            for item in items:
+                keyword = _match_keyword(item.get('title') or '', keyword_list)
+                if keyword is not None:
+                    ads.append(_to_ad(item, keyword))
+            if on_page:
+                on_page('+'.join(keyword_list), page, ads)
+            all_ads.extend(ads)
+
+            if len(all_ads) >= max_ads:
+                logger.info("Достигнуто максимальное количество объявлений")
+                break
+            if len(items) < per_page:
+                logger.info("Больше страниц нет.")
+                break
+            submit_more()
+    finally:
+        for _, future in pending:
+            future.cancel()
+        executor.shutdown(wait=False, cancel_futures=True)
+
+    logger.info(f"Всего найдено объявлений через API: {len(all_ads)}")
+    return all_ads[:max_ads]
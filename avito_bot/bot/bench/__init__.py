@@ -0,0 +1,4 @@
+"""Воспроизводимые бенчмарки бота на сохранённых страницах и локальном фейковом сервере Avito.
+
+Запуск: python manage.py bench (см. bot/management/commands/bench.py).
+"""
@@ -0,0 +1,467 @@
+"""Набор бенчмарков: каждый возвращает словарь метрик, пригодный для JSON.
+
+Бенчмарки, которые пишут в БД, выполняются в транзакции с откатом;
+сетевые обращаются только к FakeAvitoServer, кэш ответов и токенов
+на время замера подменяется, поэтому рабочие данные не затрагиваются.
+"""
+import json
+import random
+import statistics
+import threading
+import time
+import tracemalloc
+from contextlib import ExitStack, contextmanager
+from pathlib import Path
+from unittest import mock
+
+from django.db import OperationalError, connection, transaction
+from django.test import Client, override_settings
+from django.urls import reverse
+
+from .. import dedup, enrich, pacing, utils
+from ..db_writer import WriteQueue
+from ..extractors import DEFAULT_EXTRACTOR, EXTRACTORS
+from ..http_cache import ResponseCache
+from ..ingest import ingest_ads
+from ..models import AvitoAd, Keyword, SeenItem
+from ..planner import QueryPlanner
+from ..tokens import token_manager
+from .fake_server import TESTDATA_DIR, FakeAvitoServer
+
+THRESHOLDS_PATH = Path(__file__).resolve().parent / 'thresholds.json'
+
+LOCMEM_CACHES = {'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}}
+
+
+def _no_delay(*args, **kwargs):
+    pass
+
+
+@contextmanager
+def against_server(server):
+    """Направляет запросы к Avito на фейковый сервер, без темпа запросов, кэша ответов и общего кэша токенов."""
+    with ExitStack() as stack:
+        stack.enter_context(mock.patch.object(utils, 'AVITO_BASE_URL', server.url))
+        stack.enter_context(mock.patch.object(utils, 'AVITO_API_BASE_URL', server.url))
+        stack.enter_context(mock.patch.object(pacing, 'PACING_ENABLED', False))
+        stack.enter_context(mock.patch.object(utils, 'response_cache', ResponseCache(ttl=0)))
+        stack.enter_context(override_settings(CACHES=LOCMEM_CACHES))
+        yield
+
+
+@contextmanager
+def rolled_back():
+    """Транзакция, которая всегда откатывается."""
+    with transaction.atomic():
+        yield
+        transaction.set_rollback(True)
+
+
+def _percentile(values, percent):
+    values = sorted(values)
+    return values[min(int(len(values) * percent / 100), len(values) - 1)]
+
+
+def bench_extractor(extract, pages, repeat):
+    """Возвращает скорость разбора (страниц в секунду) и пиковое потребление памяти."""
+    # Прогрев: первый вызов не учитываем
+    extract(pages[0], 'https://www.avito.ru', 1)
+
+    started = time.perf_counter()
+    ads = 0
+    for _ in range(repeat):
+        for html in pages:
+            ads += len(extract(html, 'https://www.avito.ru', 1)[0])
+    elapsed = time.perf_counter() - started
+
+    # tracemalloc видит только выделения памяти Python: память самой libxml2 в пик не попадает
+    tracemalloc.start()
+    for html in pages:
+        extract(html, 'https://www.avito.ru', 1)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    total_pages = repeat * len(pages)
+    return {
+        'pages': total_pages,
+        'ads': ads,
+        'seconds': round(elapsed, 4),
+        'pages_per_sec': round(total_pages / elapsed, 2),
+        'ms_per_page': round(elapsed / total_pages * 1000, 3),
+        'peak_memory_kb': round(peak / 1024, 1),
+    }
+
+
+def bench_parse(server, repeat=20):
+    """Время разбора одной страницы выдачи движком по умолчанию."""
+    pages = [path.read_text(encoding='utf-8') for path in sorted(TESTDATA_DIR.glob('search_page*.html'))]
+    return dict(bench_extractor(EXTRACTORS[DEFAULT_EXTRACTOR], pages, repeat), engine=DEFAULT_EXTRACTOR)
+
+
+def bench_scrape(server, queries=4, max_pages=5):
+    """Сквозная пропускная способность scrape_avito_listings против фейкового сервера.
+
+    requests больше pages, если были повторы после ошибок или опережающие загрузки за последней страницей.
+    """
+    requests_before, errors_before = server.requests, server.errors
+    keywords = [f'офис {i}' for i in range(queries)]
+    pages = 0
+
+    def on_page(query, page, ads):
+        nonlocal pages
+        pages += 1
+
+    with against_server(server):
+        started = time.perf_counter()
+        ads = utils.scrape_avito_listings(keywords, max_pages=max_pages, max_ads=10 ** 6, split_keywords=True,
+                                          on_page=on_page)
+        elapsed = time.perf_counter() - started
+    return {
+        'queries': queries,
+        'pages': pages,
+        'requests': server.requests - requests_before,
+        'errors': server.errors - errors_before,
+        'ads': len(ads),
+        'seconds': round(elapsed, 4),
+        'pages_per_sec': round(pages / elapsed, 2),
+        'ads_per_sec': round(len(ads) / elapsed, 2),
+    }
+
+
+def bench_insert(server, rows=5000):
+    """Скорость сохранения объявлений в AvitoAd (ingest_ads, upsert пакетами)."""
+    ads = [
+        {'title': f'Офис {i}', 'price': f'{1000 + i} ₽', 'url': f'https://www.avito.ru/moskva/ofis_{3000000000 + i}',
+         'item_id': str(3000000000 + i), 'keyword': f'бенчмарк {i % 8}'}
+        for i in range(rows)
+    ]
+    with rolled_back():
+        started = time.perf_counter()
+        ingest_ads(ads)
+        elapsed = time.perf_counter() - started
+    return {
+        'rows': rows,
+        'seconds': round(elapsed, 4),
+        'rows_per_sec': round(rows / elapsed, 2),
+    }
+
+
+def bench_token(server, calls=1000):
+    """Получение токена: холодное обновление через API и чтение уже закэшированного."""
+    with against_server(server):
+        started = time.perf_counter()
+        entry = token_manager.refresh()
+        refresh_ms = (time.perf_counter() - started) * 1000
+
+        started = time.perf_counter()
+        for _ in range(calls):
+            token_manager.get_cached()
+        cached_us = (time.perf_counter() - started) / calls * 10 ** 6
+    return {
+        'ok': bool(entry),
+        'refresh_ms': round(refresh_ms, 3),
+        'cached_us': round(cached_us, 3),
+    }
+
+
+def bench_index_view(server, requests=50):
+    """Задержка views.index: GET формы и POST, ставящий поиск в очередь."""
+    client = Client()
+    url = reverse('index')
+    timings = {'get': [], 'post': []}
+    with ExitStack() as stack:
+        stack.enter_context(override_settings(ALLOWED_HOSTS=['testserver']))
+        stack.enter_context(mock.patch.object(token_manager, 'start_background_refresh', _no_delay))
+        stack.enter_context(rolled_back())
+        for _ in range(requests):
+            started = time.perf_counter()
+            client.get(url)
+            timings['get'].append((time.perf_counter() - started) * 1000)
+
+            started = time.perf_counter()
+            client.post(url, {'keywords': ['Офис'], 'parse_method': 'scrape', 'content': ''})
+            timings['post'].append((time.perf_counter() - started) * 1000)
+
+    result = {'requests': requests}
+    for method, values in timings.items():
+        result[f'{method}_p50_ms'] = round(statistics.median(values), 3)
+        result[f'{method}_p95_ms'] = round(_percentile(values, 95), 3)
+    return result
+
+
+def bench_planner(server, users=8, max_pages=3):
+    """Пересекающиеся поиски users пользователей через общий планировщик.
+
+    requests_ratio — во сколько раз больше запросов к Avito, чем у одного обхода
+    объединения всех ключевых слов; 1.0 означает, что загрузки полностью общие.
+    """
+    vocabulary = ['Офис', 'Офисные помещения', 'Аренда офиса', 'Склад']
+    searches = [[vocabulary[i % len(vocabulary)], vocabulary[(i + 1) % len(vocabulary)].lower()]
+                for i in range(users)]
+    with against_server(server):
+        single = QueryPlanner(reuse_seconds=0)
+        before = server.requests
+        single.search(vocabulary, max_pages=max_pages, max_ads=10 ** 6)
+        single_requests = server.requests - before
+        single.shutdown()
+
+        shared = QueryPlanner()
+        workers = [threading.Thread(target=shared.search, args=(keywords,),
+                                    kwargs={'max_pages': max_pages, 'max_ads': 10 ** 6})
+                   for keywords in searches]
+        before = server.requests
+        started = time.perf_counter()
+        for thread in workers:
+            thread.start()
+        for thread in workers:
+            thread.join()
+        elapsed = time.perf_counter() - started
+        shared_requests = server.requests - before
+        shared.shutdown()
+    return {
+        'users': users,
+        'single_crawl_requests': single_requests,
+        'requests': shared_requests,
+        'requests_ratio': round(shared_requests / single_requests, 3),
+        'seconds': round(elapsed, 4),
+    }
+
+
+def bench_pacing(server, requests=300, threads=4, rate_limit=10):
+    """Адаптивный темп против сервера, принимающего rate_limit запросов в секунду.
+
+    utilization — доля предела, которую удалось выбрать (steady_utilization — во второй
+    половине прогона, после разгона), throttled_share — доля ответов 429. Проверяется
+    сам регулятор, поэтому потолок частоты поднят выше предела сервера, а начальная
+    частота — половина предела: с умолчаниями (не больше запроса в секунду) предел не выбрать.
+    """
+    responses = []
+    with FakeAvitoServer(latency=server.latency, rate_limit=rate_limit) as throttled, ExitStack() as stack:
+        stack.enter_context(against_server(throttled))
+        stack.enter_context(mock.patch.object(pacing, 'PACING_ENABLED', True))
+        stack.enter_context(mock.patch.object(pacing, 'PACING_MAX_RATE', rate_limit * 2))
+        stack.enter_context(mock.patch.object(pacing, 'PACING_INITIAL_RATE', rate_limit / 2))
+        url = f'{throttled.url}/rossiya/nedvizhimost?q=bench'
+        pacer = pacing.get_pacer(url)
+        session = utils.get_session_with_retries()
+
+        def worker(count):
+            for _ in range(count):
+                pacing.pace(url)
+                status = session.get(url, timeout=10).status_code
+                responses.append((time.perf_counter(), status))
+
+        workers = [threading.Thread(target=worker, args=(requests // threads,)) for _ in range(threads)]
+        started = time.perf_counter()
+        for thread in workers:
+            thread.start()
+        for thread in workers:
+            thread.join()
+        elapsed = time.perf_counter() - started
+    responses.sort()
+    statuses = [status for _, status in responses]
+    accepted = statuses.count(200)
+    second_half = responses[len(responses) // 2:]
+    steady_seconds = second_half[-1][0] - responses[len(responses) // 2 - 1][0]
+    return {
+        'requests': len(statuses),
+        'rate_limit': rate_limit,
+        'accepted_per_sec': round(accepted / elapsed, 2),
+        'utilization': round(accepted / elapsed / rate_limit, 3),
+        'steady_utilization': round([status for _, status in second_half].count(200) / steady_seconds / rate_limit, 3),
+        'throttled_share': round(statuses.count(429) / len(statuses), 3),
+        'final_allowed_rate': round(pacer.rate, 2),
+        'seconds': round(elapsed, 4),
+    }
+
+
+def bench_enrich(server, items=200, workers=4):
+    """Обогащение items новых объявлений страницами объявлений с фейкового сервера.
+
+    Каждое объявление сохранено по двум ключевым словам, а страница должна
+    загружаться один раз: requests_per_item — запросов к Avito на item_id.
+    """
+    with against_server(server), rolled_back():
+        keywords = [Keyword.objects.get_or_create(word=word)[0] for word in ('Офис', 'Аренда офиса')]
+        AvitoAd.objects.bulk_create([
+            AvitoAd(keyword=keyword, item_id=str(3100000000 + number), title=f'Офис {number}', description='',
+                    url=f'{server.url}/moskva/kommercheskaya_nedvizhimost/ofis_{3100000000 + number}')
+            for number in range(items) for keyword in keywords
+        ])
+        before = server.requests
+        started = time.perf_counter()
+        processed = enrich.enrich_pending(limit=items, workers=workers)
+        elapsed = time.perf_counter() - started
+        requests = server.requests - before
+        missing = AvitoAd.objects.filter(item_id__startswith='31', seller_id__isnull=True).count()
+    return {
+        'items': processed,
+        'rows': items * len(keywords),
+        'workers': workers,
+        'items_per_sec': round(processed / elapsed, 1),
+        'requests_per_item': round(requests / max(processed, 1), 3),
+        'missing_fields': missing,
+        'seconds': round(elapsed, 4),
+    }
+
+
+def _concurrent_writes(threads, ops, rows, run):
+    """threads потоков по ops операций; каждая вставляет rows строк SeenItem. Возвращает (секунды, ошибки)."""
+    errors = []
+
+    def worker(number):
+        try:
+            for op in range(ops):
+                items = [SeenItem(query=f'bench {number}', location='rossiya', item_id=f'{op}-{row}')
+                         for row in range(rows)]
+                try:
+                    run(SeenItem.objects.bulk_create, items)
+                except OperationalError as e:
+                    errors.append(str(e))
+        finally:
+            connection.close()
+
+    workers = [threading.Thread(target=worker, args=(number,)) for number in range(threads)]
+    started = time.perf_counter()
+    for thread in workers:
+        thread.start()
+    for thread in workers:
+        thread.join()
+    return time.perf_counter() - started, len(errors)
+
+
+def bench_writes(server, threads=8, ops=50, rows=10):
+    """Пропускная способность одновременной записи из многих потоков: каждый своей транзакцией и через очередь."""
+    total = threads * ops
+
+    def direct(func, *args):
+        with transaction.atomic():
+            return func(*args)
+
+    SeenItem.objects.filter(query__startswith='bench ').delete()
+    direct_seconds, direct_errors = _concurrent_writes(threads, ops, rows, direct)
+    SeenItem.objects.filter(query__startswith='bench ').delete()
+
+    writer = WriteQueue()
+    queued_seconds, queued_errors = _concurrent_writes(threads, ops, rows, writer.run)
+    SeenItem.objects.filter(query__startswith='bench ').delete()
+
+    return {
+        'threads': threads,
+        'operations': total,
+        'rows_per_operation': rows,
+        'direct_ops_per_sec': round(total / direct_seconds, 2),
+        'direct_errors': direct_errors,
+        'queued_ops_per_sec': round(total / queued_seconds, 2),
+        'queued_errors': queued_errors,
+        'queued_transactions': writer.batches,
+    }
+
+
+def _near_duplicates(groups, copies, unique, seed=7):
+    """Синтетические объявления: groups групп по copies слегка переписанных копий и unique одиночных.
+
+    Возвращает список пар (заголовок, описание) и номер группы каждого объявления.
+    """
+    rng = random.Random(seed)
+    syllables = ['ма', 'ко', 'ри', 'та', 'лен', 'ов', 'ска', 'про', 'дом', 'ст', 'ни', 'ве', 'ра', 'пол', 'ки']
+    vocabulary = [''.join(rng.choice(syllables) for _ in range(rng.randint(2, 4))) for _ in range(3000)]
+    texts, labels = [], []
+    for group in range(groups + unique):
+        words = [rng.choice(vocabulary) for _ in range(40)]
+        for copy in range(copies if group < groups else 1):
+            variant = list(words)
+            if copy:
+                # Небольшая правка: заменены два слова и удалено одно
+                for _ in range(2):
+                    variant[rng.randrange(len(variant))] = rng.choice(vocabulary)
+                del variant[rng.randrange(len(variant))]
+            texts.append((' '.join(variant[:6]), ' '.join(variant[6:])))
+            labels.append(group)
+    return texts, labels
+
+
+def _pairs(sizes):
+    return sum(size * (size - 1) // 2 for size in sizes)
+
+
+def bench_dedup(server, groups=200, copies=5, unique=2000, batch=500, lookups=200):
+    """Точность и полнота кластеризации почти одинаковых объявлений, скорость индексации и поиска."""
+    texts, labels = _near_duplicates(groups, copies, unique)
+    with rolled_back():
+        keyword = Keyword.objects.create(word='бенчмарк дубликатов')
+        AvitoAd.objects.bulk_create([
+            AvitoAd(keyword=keyword, item_id=str(4000000000 + i), title=title, description=description,
+                    url=f'https://www.avito.ru/moskva/ofis_{4000000000 + i}')
+            for i, (title, description) in enumerate(texts)
+        ], batch_size=batch)
+        ads = list(AvitoAd.objects.filter(keyword=keyword).order_by('pk').only('pk', 'title', 'description'))
+
+        started = time.perf_counter()
+        for start in range(0, len(ads), batch):
+            dedup.assign_clusters(ads[start:start + batch])
+        elapsed = time.perf_counter() - started
+
+        timings = []
+        for title, description in random.Random(1).sample(texts, min(lookups, len(texts))):
+            lookup_started = time.perf_counter()
+            dedup.find_similar(title, description)
+            timings.append((time.perf_counter() - lookup_started) * 1000)
+
+        clusters = dict(AvitoAd.objects.filter(keyword=keyword).order_by('pk').values_list('pk', 'cluster_id'))
+
+    by_cluster, by_group, by_both = {}, {}, {}
+    for ad, label in zip(ads, labels):
+        cluster_id = clusters[ad.pk]
+        by_cluster[cluster_id] = by_cluster.get(cluster_id, 0) + 1
+        by_group[label] = by_group.get(label, 0) + 1
+        by_both[(cluster_id, label)] = by_both.get((cluster_id, label), 0) + 1
+    predicted, actual, correct = _pairs(by_cluster.values()), _pairs(by_group.values()), _pairs(by_both.values())
+    return {
+        'ads': len(ads),
+        'clusters': len(by_cluster),
+        'precision': round(correct / predicted, 4) if predicted else 1.0,
+        'recall': round(correct / actual, 4) if actual else 1.0,
+        'ads_per_sec': round(len(ads) / elapsed, 2),
+        'lookup_p50_ms': round(statistics.median(timings), 3),
+        'lookup_p99_ms': round(_percentile(timings, 99), 3),
+    }
+
+
+BENCHMARKS = {
+    'parse': bench_parse,
+    'scrape': bench_scrape,
+    'insert': bench_insert,
+    'token': bench_token,
+    'index_view': bench_index_view,
+    'writes': bench_writes,
+    'dedup': bench_dedup,
+    'planner': bench_planner,
+    'pacing': bench_pacing,
+    'enrich': bench_enrich,
+}
+
+
+def load_thresholds(path=THRESHOLDS_PATH):
+    with open(path, encoding='utf-8') as f:
+        return json.load(f)
+
+
+def check_thresholds(results, thresholds):
+    """Сравнивает результаты с порогами {бенчмарк: {метрика: {"min"|"max": значение}}}.
+
+    Возвращает список описаний нарушений; пустой список — регрессий нет.
+    """
+    failures = []
+    for name, metrics in thresholds.items():
+        if name not in results:
+            continue
+        for metric, bounds in metrics.items():
+            value = results[name].get(metric)
+            if value is None:
+                continue
+            if 'min' in bounds and value < bounds['min']:
+                failures.append(f"{name}.{metric} = {value} < {bounds['min']}")
+            if 'max' in bounds and value > bounds['max']:
+                failures.append(f"{name}.{metric} = {value} > {bounds['max']}")
+    return failures
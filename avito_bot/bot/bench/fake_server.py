@@ -0,0 +1,210 @@
+"""Локальный HTTP-сервер, имитирующий Avito, для бенчмарков и тестов.
+
+Отдаёт страницы выдачи (на основе testdata/search_page.html, с уникальными
+id объявлений на каждой странице и пагинацией на FakeAvitoServer.pages
+страниц), страницы объявлений (testdata/item_page.html) и ответ /token
+Avito API. Задержка ответа, доля ответов 503, предел частоты запросов
+(сверх него — 429 с Retry-After) и число первых страниц, на которые
+отвечает капча, настраиваются.
+"""
+import random
+import re
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+from urllib.parse import parse_qs, urlsplit
+
+TESTDATA_DIR = Path(__file__).resolve().parents[1] / 'testdata'
+
+ITEM_ID_RE = re.compile(r'\b3\d{9}\b')
+ITEM_PATH_RE = re.compile(r'_(\d+)$')
+# Сдвиг id объявлений между страницами выдачи
+PAGE_ID_STEP = 1000000
+# Страница блокировки, которую Avito отдаёт с кодом 200
+CAPTCHA_PAGE = ('<html><head><title>Доступ ограничен: проблема с IP</title></head>'
+                '<body><div class="firewall-container"><h2>Доступ ограничен</h2></div></body></html>')
+
+
+def _split_pagination(html):
+    """Делит страницу на части до и после блока пагинации."""
+    marker = html.index('data-marker="pagination"')
+    start = html.rindex('<div', 0, marker)
+    end = html.index('</div>', html.index('</nav>', marker)) + len('</div>')
+    return html[:start], html[end:]
+
+
+class FakeAvitoHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    # Заголовки и тело уходят отдельными записями; без TCP_NODELAY ответ ждёт отложенного ACK клиента
+    disable_nagle_algorithm = True
+
+    def _send(self, status, body, content_type='text/html; charset=utf-8'):
+        body = body.encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _delay_or_fail(self):
+        """Имитирует задержку сети; возвращает True, если запрос должен завершиться ошибкой."""
+        server = self.server.fake
+        server.count_request()
+        if server.latency:
+            time.sleep(server.latency)
+        if server.should_throttle():
+            self.send_response(429)
+            self.send_header('Retry-After', str(server.retry_after))
+            self.send_header('Content-Length', '0')
+            self.end_headers()
+            return True
+        if server.should_fail():
+            self._send(503, 'Service Unavailable', 'text/plain')
+            return True
+        return False
+
+    def do_POST(self):
+        length = int(self.headers.get('Content-Length', 0))
+        self.rfile.read(length)
+        with self.server.fake.serving():
+            self._post()
+
+    def _post(self):
+        if self._delay_or_fail():
+            return
+        if urlsplit(self.path).path == '/token':
+            self._send(200, (TESTDATA_DIR / 'api' / 'token.json').read_text(encoding='utf-8'), 'application/json')
+        else:
+            self._send(404, 'Not Found', 'text/plain')
+
+    def do_GET(self):
+        with self.server.fake.serving():
+            self._get()
+
+    def _get(self):
+        if self._delay_or_fail():
+            return
+        if self.server.fake.should_show_captcha():
+            self._send(200, CAPTCHA_PAGE)
+            return
+        url = urlsplit(self.path)
+        item = ITEM_PATH_RE.search(url.path)
+        if item:
+            self._send(200, self.server.fake.render_item(item.group(1)))
+            return
+        page = parse_qs(url.query).get('p', ['1'])[0]
+        self._send(200, self.server.fake.render_search(url.path, url.query, int(page) if page.isdigit() else 1))
+
+    def log_message(self, format, *args):
+        pass
+
+
+class FakeAvitoServer:
+    """Фейковый Avito на 127.0.0.1 в фоновом потоке. Используется как контекстный менеджер.
+
+    latency — задержка каждого ответа в секундах, error_rate — доля ответов 503,
+    pages — сколько страниц выдачи «есть» по любому запросу, rate_limit — сколько
+    запросов в секунду сервер принимает (None — без предела), остальным отвечает
+    429 с Retry-After: retry_after. captchas — на сколько первых GET-запросов
+    ответить страницей с капчей. max_in_flight — наибольшее число запросов,
+    которые обрабатывались одновременно.
+    """
+
+    def __init__(self, latency=0.0, error_rate=0.0, pages=5, seed=0, rate_limit=None, retry_after=1, captchas=0):
+        self.latency = latency
+        self.error_rate = error_rate
+        self.pages = pages
+        self.rate_limit = rate_limit
+        self.retry_after = retry_after
+        self.captchas = captchas
+        self.requests = 0
+        self.errors = 0
+        self.throttled = 0
+        self.in_flight = 0
+        self.max_in_flight = 0
+        self._accepted = deque()
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+        self._head, self._tail = _split_pagination((TESTDATA_DIR / 'search_page.html').read_text(encoding='utf-8'))
+        self._item = (TESTDATA_DIR / 'item_page.html').read_text(encoding='utf-8')
+        self._httpd = None
+
+    @property
+    def url(self):
+        return f'http://127.0.0.1:{self._httpd.server_port}'
+
+    @contextmanager
+    def serving(self):
+        with self._lock:
+            self.in_flight += 1
+            self.max_in_flight = max(self.max_in_flight, self.in_flight)
+        try:
+            yield
+        finally:
+            with self._lock:
+                self.in_flight -= 1
+
+    def count_request(self):
+        with self._lock:
+            self.requests += 1
+
+    def should_throttle(self):
+        """Скользящее окно в секунду: запрос сверх rate_limit получает 429."""
+        if self.rate_limit is None:
+            return False
+        now = time.monotonic()
+        with self._lock:
+            while self._accepted and now - self._accepted[0] >= 1:
+                self._accepted.popleft()
+            if len(self._accepted) >= self.rate_limit:
+                self.throttled += 1
+                return True
+            self._accepted.append(now)
+            return False
+
+    def should_show_captcha(self):
+        with self._lock:
+            if self.captchas <= 0:
+                return False
+            self.captchas -= 1
+            return True
+
+    def should_fail(self):
+        with self._lock:
+            failed = self._random.random() < self.error_rate
+            self.errors += failed
+            return failed
+
+    def render_search(self, path, query, page):
+        offset = (page - 1) * PAGE_ID_STEP
+        head = ITEM_ID_RE.sub(lambda m: str(int(m.group(0)) + offset), self._head)
+        query = re.sub(r'(^|&)p=\d+', '', query).lstrip('&')
+        links = ''.join(
+            f'<li><a href="{path}?{query}&amp;p={number}" data-marker="pagination-button/page({number})">{number}</a></li>'
+            for number in range(1, self.pages + 1)
+        )
+        pagination = f'<div data-marker="pagination"><nav aria-label="Пагинация"><ul>{links}</ul></nav></div>'
+        return head + pagination + self._tail
+
+    def render_item(self, item_id):
+        return self._item.replace('3000340563', item_id)
+
+    def start(self):
+        self._httpd = ThreadingHTTPServer(('127.0.0.1', 0), FakeAvitoHandler)
+        self._httpd.daemon_threads = True
+        self._httpd.fake = self
+        threading.Thread(target=self._httpd.serve_forever, name='fake-avito', daemon=True).start()
+        return self
+
+    def stop(self):
+        self._httpd.shutdown()
+        self._httpd.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc_info):
+        self.stop()
@@ -0,0 +1,113 @@
+"""Очередь записи в SQLite с одним потоком-писателем.
+
+SQLite допускает только одну пишущую транзакцию одновременно, и каждая
+фиксация транзакции — это отдельный fsync. Когда пишут сразу несколько
+потоков (воркеры поиска, мониторинг, рассылка), они ждут друг друга на
+блокировке базы. При BOT_SQLITE_WRITE_QUEUE=1 запись передаётся одному
+потоку-писателю, который объединяет в одну транзакцию все операции,
+накопившиеся в очереди, пока фиксировалась предыдущая (не больше
+WRITE_QUEUE_BATCH; WRITE_QUEUE_LINGER — сколько дополнительно ждать новых).
+Каждая операция выполняется в своей точке сохранения, поэтому ошибка одной
+не откатывает остальные. Вызывающий поток ждёт результата своей операции.
+"""
+import logging
+import os
+import queue
+import threading
+import time
+from concurrent.futures import Future
+
+from django.db import close_old_connections, connection, transaction
+
+logger = logging.getLogger(__name__)
+
+WRITE_QUEUE_ENABLED = os.getenv('BOT_SQLITE_WRITE_QUEUE', '0') == '1'
+# Сколько операций объединять в одну транзакцию и сколько ждать следующих, секунды
+WRITE_QUEUE_BATCH = int(os.getenv('BOT_SQLITE_WRITE_QUEUE_BATCH', '100'))
+WRITE_QUEUE_LINGER = float(os.getenv('BOT_SQLITE_WRITE_QUEUE_LINGER', '0'))
+
+
+class WriteQueue:
+    """Очередь операций записи, выполняемых одним фоновым потоком группами в одной транзакции."""
+
+    def __init__(self, batch_size=WRITE_QUEUE_BATCH, linger=WRITE_QUEUE_LINGER):
+        self.batch_size = batch_size
+        self.linger = linger
+        self.batches = 0
+        self.operations = 0
+        self._queue = queue.Queue()
+        self._lock = threading.Lock()
+        self._thread = None
+
+    def _ensure_thread(self):
+        with self._lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, name='sqlite-writer', daemon=True)
+                self._thread.start()
+
+    def submit(self, func, *args, **kwargs):
+        """Ставит func(*args, **kwargs) в очередь записи. Возвращает Future с её результатом."""
+        future = Future()
+        self._ensure_thread()
+        self._queue.put((future, func, args, kwargs))
+        return future
+
+    def run(self, func, *args, **kwargs):
+        """Выполняет func через очередь и ждёт результата (исключение пробрасывается вызывающему)."""
+        if threading.current_thread() is self._thread:
+            # Вложенная запись из самого писателя выполняется сразу, иначе поток ждал бы сам себя
+            return func(*args, **kwargs)
+        return self.submit(func, *args, **kwargs).result()
+
+    def _collect(self):
+        batch = [self._queue.get()]
+        deadline = time.monotonic() + self.linger
+        while len(batch) < self.batch_size:
+            timeout = deadline - time.monotonic()
+            try:
+                batch.append(self._queue.get(timeout=timeout) if timeout > 0 else self._queue.get_nowait())
+            except queue.Empty:
+                break
+        return batch
+
+    def _run(self):
+        while True:
+            batch = self._collect()
+            close_old_connections()
+            results = []
+            try:
+                with transaction.atomic():
+                    for future, func, args, kwargs in batch:
+                        if not future.set_running_or_notify_cancel():
+                            continue
+                        try:
+                            with transaction.atomic():
+                                results.append((future, func(*args, **kwargs), None))
+                        except Exception as e:
+                            results.append((future, None, e))
+            except Exception as e:
+                # Не удалось зафиксировать транзакцию: ошибка достаётся всем операциям группы
+                logger.error(f"Ошибка записи группы из {len(batch)} операций: {e}")
+                results = [(future, None, e) for future, *_ in batch if future.running()]
+                connection.close()
+            for future, result, error in results:
+                if error is not None:
+                    future.set_exception(error)
+                else:
+                    future.set_result(result)
+            self.batches += 1
+            self.operations += len(batch)
+
+
+write_queue = WriteQueue()
+
+
+def write(func, *args, **kwargs):
+    """Выполняет операцию записи: через общую очередь, если она включена, иначе сразу в текущем потоке.
+
+    Внутри открытой транзакции запись всегда выполняется сразу: у писателя своё соединение,
+    и его изменения не откатились бы вместе с транзакцией вызывающего.
+    """
+    if WRITE_QUEUE_ENABLED and not connection.in_atomic_block:
+        return write_queue.run(func, *args, **kwargs)
+    return func(*args, **kwargs)
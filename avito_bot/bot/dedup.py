@@ -0,0 +1,268 @@
+"""Поиск почти одинаковых объявлений: MinHash-подписи и LSH-индекс в БД.
+
+Одно и то же объявление приходит по разным ключевым словам ('Офис',
+'Офисные помещения', 'Аренда офиса') и перевыкладывается с небольшими
+правками текста. Для заголовка с описанием строится множество символьных
+шинглов, по нему — подпись из NUM_PERM минимальных хэшей (NumPy), а
+подпись режется на LSH_BANDS полос по LSH_ROWS значений. Объявления с
+совпадающим хэшем хотя бы одной полосы — кандидаты; кандидат с оценкой
+сходства Жаккара не ниже DEDUP_THRESHOLD даёт объявлению свой cluster_id.
+Объявление без похожих открывает новый кластер с cluster_id = pk.
+
+Кластеры считаются не при сохранении выдачи, а стадией обогащения (bot.enrich):
+после каждого прохода assign_pending() распределяет объявления, которые
+уже получили описание со страницы (и объявления, которые не обогащаются:
+без item_id или с исчерпанными попытками загрузки). Так сохранение не тратит время на подписи, а сравнение идёт
+по полному тексту.
+
+Индекс хранится в AdBucket по одной строке на пару (хэш полосы, кластер),
+поэтому поиск — не больше LSH_BANDS обращений к покрывающему индексу,
+и его стоимость не зависит от числа объявлений и копий в кластере.
+"""
+import logging
+import os
+import re
+from collections import defaultdict
+
+import numpy as np
+from django.db import connection, transaction
+from django.db.models import Q
+
+from .db_writer import write
+from .models import AdBucket, AvitoAd
+
+logger = logging.getLogger(__name__)
+
+DEDUP_ENABLED = os.getenv('AVITO_DEDUP', '1') == '1'
+# Минимальная оценка сходства Жаккара, при которой объявления считаются копиями
+DEDUP_THRESHOLD = float(os.getenv('AVITO_DEDUP_THRESHOLD', '0.7'))
+
+SHINGLE_SIZE = 5
+NUM_PERM = 64
+LSH_BANDS = 16
+LSH_ROWS = NUM_PERM // LSH_BANDS
+# Сколько объявлений без кластера распределяется за один вызов assign_pending
+DEDUP_BATCH_SIZE = int(os.getenv('AVITO_DEDUP_BATCH_SIZE', '1000'))
+# Сколько хэшей полос передавать в одном запросе key IN (...)
+LOOKUP_CHUNK = 500
+
+# Хэш-функции вида «умножение со сдвигом»: h(x) = ((a·x + b) mod 2^64) >> 32 с нечётным a.
+# Обходятся без деления по модулю; зерно фиксировано, иначе подписи из разных процессов были бы несравнимы
+_rng = np.random.default_rng(20240607)
+PERM_A = _rng.integers(0, 1 << 63, size=NUM_PERM, dtype=np.uint64) * np.uint64(2) + np.uint64(1)
+PERM_B = _rng.integers(0, 1 << 63, size=NUM_PERM, dtype=np.uint64)
+EMPTY_SIGNATURE = np.full(NUM_PERM, np.iinfo(np.uint32).max, dtype=np.uint32)
+# Веса полиномиального хэша шингла по кодам символов: base^j, арифметика по модулю 2^64
+SHINGLE_WEIGHTS = np.array([1_000_003 ** j % (1 << 64) for j in range(SHINGLE_SIZE)], dtype=np.uint64)
+# Перемешивание значений полосы в band_keys (константы FNV-1a, 64 бита)
+BAND_OFFSET = np.uint64(0xcbf29ce484222325)
+BAND_PRIME = np.uint64(0x100000001b3)
+
+NON_WORD_RE = re.compile(r'[\W_]+')
+
+
+def normalize_text(text):
+    """Нижний регистр, ё → е, знаки препинания и пробелы схлопываются в один пробел."""
+    return NON_WORD_RE.sub(' ', (text or '').lower().replace('ё', 'е')).strip()
+
+
+def shingle_hashes(text, size=SHINGLE_SIZE):
+    """64-битные хэши символьных шинглов длины size (короткий текст — один шингл).
+
+    Хэши всех окон считаются сдвинутыми срезами массива кодов символов, без цикла по шинглам.
+    """
+    text = normalize_text(text)
+    if not text:
+        return np.array([], dtype=np.uint64)
+    codes = np.frombuffer(text.encode('utf-32-le'), dtype=np.uint32).astype(np.uint64)
+    if codes.size < size:
+        codes = np.pad(codes, (0, size - codes.size))
+    count = codes.size - size + 1
+    hashes = codes[:count] * SHINGLE_WEIGHTS[0]
+    for offset in range(1, size):
+        hashes += codes[offset:offset + count] * SHINGLE_WEIGHTS[offset]
+    # Повторы шинглов не убираются: на минимум в minhash() они не влияют
+    return hashes
+
+
+def minhash(hashes):
+    """MinHash-подпись по хэшам шинглов: массив NUM_PERM значений uint32."""
+    if not hashes.size:
+        return EMPTY_SIGNATURE.copy()
+    permuted = np.outer(hashes, PERM_A)  # умножение uint64 идёт по модулю 2^64
+    permuted += PERM_B
+    permuted >>= np.uint64(32)
+    return permuted.min(axis=0).astype(np.uint32)
+
+
+def ad_signature(title, description=''):
+    return minhash(shingle_hashes(f'{title} {description}'))
+
+
+def similarity(first, second):
+    """Оценка сходства Жаккара по двум подписям — доля совпавших минимумов."""
+    return float(np.count_nonzero(first == second)) / NUM_PERM
+
+
+def band_keys(matrix):
+    """Хэши LSH_BANDS полос для матрицы подписей: список списков int64 по строкам.
+
+    Номер полосы входит в хэш, поэтому для всех полос хватает одного столбца key.
+    """
+    values = np.asarray(matrix, dtype=np.uint64).reshape(-1, LSH_BANDS, LSH_ROWS)
+    keys = np.broadcast_to(BAND_OFFSET ^ np.arange(LSH_BANDS, dtype=np.uint64), values.shape[:2]).copy()
+    for row in range(LSH_ROWS):
+        keys ^= values[:, :, row]
+        keys *= BAND_PRIME
+    return keys.view(np.int64).tolist()
+
+
+def to_bytes(signature):
+    return signature.astype('<u4').tobytes()
+
+
+def from_bytes(data):
+    return np.frombuffer(bytes(data), dtype='<u4')
+
+
+def _candidates(keys):
+    """Корзины по хэшам полос вместе с подписями их объявлений.
+
+    Возвращает (buckets, signatures): key -> [(cluster_id, ad_id)] и ad_id -> подпись.
+    Один запрос на LOOKUP_CHUNK хэшей: строки корзин читаются из покрывающего
+    индекса, подписи — по первичному ключу объявления.
+    """
+    keys = list(keys)
+    buckets = defaultdict(list)
+    signatures = {}
+    bucket_table = connection.ops.quote_name(AdBucket._meta.db_table)
+    ad_table = connection.ops.quote_name(AvitoAd._meta.db_table)
+    with connection.cursor() as cursor:
+        for start in range(0, len(keys), LOOKUP_CHUNK):
+            chunk = keys[start:start + LOOKUP_CHUNK]
+            cursor.execute(
+                f"SELECT b.key, b.cluster_id, b.ad_id, a.minhash FROM {bucket_table} b "
+                f"JOIN {ad_table} a ON a.id = b.ad_id WHERE b.key IN ({', '.join(['%s'] * len(chunk))})",
+                chunk,
+            )
+            for key, cluster_id, ad_id, data in cursor.fetchall():
+                buckets[key].append((cluster_id, ad_id))
+                if data is not None and ad_id not in signatures:
+                    signatures[ad_id] = from_bytes(data)
+    return buckets, signatures
+
+
+def _best_match(signature, keys, buckets, signatures, threshold):
+    """Лучший кандидат (cluster_id, сходство) среди корзин подписи или (None, 0.0)."""
+    best_cluster, best_score = None, 0.0
+    checked = set()
+    for key in keys:
+        for cluster_id, ad_id in buckets.get(key, ()):
+            if ad_id in checked or ad_id not in signatures:
+                continue
+            checked.add(ad_id)
+            score = similarity(signature, signatures[ad_id])
+            if score >= threshold and score > best_score:
+                best_cluster, best_score = cluster_id, score
+    return best_cluster, best_score
+
+
+def find_similar(title, description='', threshold=None):
+    """Ищет кластер, похожий на текст. Возвращает (cluster_id, сходство) или (None, 0.0)."""
+    threshold = DEDUP_THRESHOLD if threshold is None else threshold
+    signature = ad_signature(title, description)
+    keys = band_keys(signature)[0]
+    buckets, signatures = _candidates(keys)
+    return _best_match(signature, keys, buckets, signatures, threshold)
+
+
+def assign_clusters(ads, threshold=None):
+    """Считает подписи сохранённых объявлений и присваивает им cluster_id.
+
+    Объявления сравниваются с индексом и друг с другом (в порядке pk), новые
+    хэши полос добавляются в AdBucket. Возвращает число объявлений, попавших
+    в уже существующие кластеры.
+    """
+    threshold = DEDUP_THRESHOLD if threshold is None else threshold
+    ads = sorted(ads, key=lambda ad: ad.pk)
+    if not ads:
+        return 0
+    matrix = np.array([ad_signature(ad.title, ad.description) for ad in ads])
+    prepared = list(zip(ads, matrix, band_keys(matrix)))
+
+    buckets, known = _candidates({key for _, _, keys in prepared for key in keys})
+
+    # Кластеры, уже записанные в корзину: в AdBucket одна строка на пару (хэш полосы, кластер)
+    bucket_clusters = defaultdict(set)
+    for key, rows in buckets.items():
+        bucket_clusters[key].update(cluster_id for cluster_id, _ in rows)
+
+    updates = []
+    new_buckets = []
+    duplicates = 0
+    for ad, signature, keys in prepared:
+        pk = ad.pk
+        cluster_id, _ = _best_match(signature, keys, buckets, known, threshold)
+        if cluster_id is None:
+            cluster_id = pk
+        else:
+            duplicates += 1
+        ad.cluster_id = cluster_id
+        ad.minhash = to_bytes(signature)
+        known[pk] = signature
+        updates.append((cluster_id, ad.minhash, pk))
+        for key in keys:
+            clusters = bucket_clusters[key]
+            if cluster_id in clusters:
+                continue
+            clusters.add(cluster_id)
+            buckets[key].append((cluster_id, pk))
+            new_buckets.append((key, cluster_id, pk))
+
+    # executemany вместо bulk_update/bulk_create: на тысячах строк построение CASE WHEN
+    # и объектов модели в ORM обходится дороже самой записи
+    bucket_table = connection.ops.quote_name(AdBucket._meta.db_table)
+    ad_table = connection.ops.quote_name(AvitoAd._meta.db_table)
+    with transaction.atomic(), connection.cursor() as cursor:
+        cursor.executemany(f"UPDATE {ad_table} SET cluster_id = %s, minhash = %s WHERE id = %s", updates)
+        cursor.executemany(f"INSERT INTO {bucket_table} (key, cluster_id, ad_id) VALUES (%s, %s, %s)", new_buckets)
+    return duplicates
+
+
+def assign_pending(limit=DEDUP_BATCH_SIZE):
+    """Распределяет по кластерам до limit объявлений без кластера в порядке pk.
+
+    Берутся только объявления, готовые к сравнению: обогащённые или те, что обогащаться не будут —
+    без item_id или после последней неудачной попытки (enrich_retry_at пуст). Возвращает (объявлений, копий).
+    """
+    ready = Q(enriched_at__isnull=False) | Q(item_id__isnull=True) | Q(enrich_attempts__gt=0, enrich_retry_at__isnull=True)
+    ads = list(
+        AvitoAd.objects.filter(ready, cluster_id__isnull=True)
+        .order_by('pk').only('pk', 'title', 'description')[:limit]
+    )
+    if not ads:
+        return 0, 0
+    duplicates = write(assign_clusters, ads)
+    return len(ads), duplicates
+
+
+def rebuild_index(chunk_size=1000):
+    """Строит индекс заново по всем объявлениям в порядке pk. Возвращает (объявлений, копий)."""
+    with transaction.atomic():
+        AdBucket.objects.all().delete()
+        AvitoAd.objects.update(cluster_id=None, minhash=None)
+
+    processed = duplicates = 0
+    last_pk = 0
+    while True:
+        chunk = list(
+            AvitoAd.objects.filter(pk__gt=last_pk).order_by('pk')
+            .only('pk', 'title', 'description')[:chunk_size]
+        )
+        if not chunk:
+            break
+        duplicates += assign_clusters(chunk)
+        processed += len(chunk)
+        last_pk = chunk[-1].pk
+    logger.info(f"Индекс похожих объявлений перестроен: объявлений {processed}, копий {duplicates}")
+    return processed, duplicates
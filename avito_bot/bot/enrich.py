@@ -0,0 +1,188 @@
+"""Обогащение объявлений данными со страницы объявления.
+
+Карточка в выдаче даёт только заголовок, цену и URL, поэтому описание,
+продавец, адрес и дата публикации загружаются отдельно, со страницы
+объявления. Стадия работает отдельно от обхода выдачи (команда enrich_ads)
+и не замедляет поиск: она берёт только объявления, которые ещё не
+обогащались (enriched_at пуст), загружает страницы не больше чем
+ENRICH_WORKERS потоками, в общем темпе запросов к хосту (bot.pacing), и
+записывает поля пакетом через bulk_update.
+
+Одно объявление, найденное по нескольким ключевым словам, хранится в
+нескольких строках AvitoAd, а загружается один раз: страница кэшируется
+в кэше ответов (bot.http_cache) по item_id, а не по URL. Объявление,
+снятое с публикации (404/410), помечается обогащённым без новых полей.
+После прочих ошибок загрузка повторяется не раньше чем через
+ENRICH_RETRY_DELAY секунд, с удвоением паузы после каждой неудачи; после
+ENRICH_MAX_ATTEMPTS неудач объявление больше не загружается и не занимает
+место в пакете следующих проходов.
+
+После каждого прохода обогащённые объявления распределяются по кластерам
+похожих (bot.dedup.assign_pending) — уже с описанием со страницы.
+"""
+import logging
+import os
+import threading
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from datetime import timedelta
+
+import requests
+from django.db.models import Q
+from django.utils import timezone
+
+from . import dedup, metrics
+from .db_writer import write
+from .extractors import extract_item
+from .models import AvitoAd
+from .utils import MAX_CONCURRENCY_PER_HOST, fetch_page, get_session_with_retries
+
+logger = logging.getLogger(__name__)
+
+# Сколько страниц объявлений загружается одновременно
+ENRICH_WORKERS = int(os.getenv('AVITO_ENRICH_WORKERS', str(MAX_CONCURRENCY_PER_HOST)))
+# Сколько объявлений (различных item_id) обрабатывается за один проход
+ENRICH_BATCH_SIZE = int(os.getenv('AVITO_ENRICH_BATCH_SIZE', '100'))
+# Пауза между проходами, когда обогащать нечего, секунды
+ENRICH_INTERVAL = float(os.getenv('AVITO_ENRICH_INTERVAL', '30'))
+# Сколько раз пытаться загрузить страницу объявления и пауза перед первым повтором, секунды
+ENRICH_MAX_ATTEMPTS = int(os.getenv('AVITO_ENRICH_MAX_ATTEMPTS', '5'))
+ENRICH_RETRY_DELAY = float(os.getenv('AVITO_ENRICH_RETRY_DELAY', '300'))
+
+DETAIL_FIELDS = ['description', 'seller_id', 'seller_name', 'address', 'published_at']
+# Ответы, после которых страницу объявления не имеет смысла запрашивать снова
+GONE_STATUSES = {404, 410}
+
+HEADERS = {
+    'User-Agent': 'Mozilla/5.0'
+}
+
+
+def detail_cache_key(item_id):
+    """Ключ кэша ответов для страницы объявления: не зависит от URL и ключевого слова."""
+    return f'item:{item_id}'
+
+
+def pending_items(limit=ENRICH_BATCH_SIZE):
+    """Ещё не обогащённые объявления: item_id -> строки AvitoAd с этим item_id, не больше limit item_id.
+
+    Объявления, чей повтор ещё не наступил или попытки исчерпаны, пропускаются.
+    """
+    pending = AvitoAd.objects.filter(
+        Q(enrich_retry_at__isnull=True) | Q(enrich_retry_at__lte=timezone.now()),
+        enriched_at__isnull=True, item_id__isnull=False, enrich_attempts__lt=ENRICH_MAX_ATTEMPTS,
+    )
+    item_ids = set()
+    for item_id in pending.order_by('pk').values_list('item_id', flat=True).iterator():
+        item_ids.add(item_id)
+        if len(item_ids) >= limit:
+            break
+    groups = defaultdict(list)
+    fields = ('pk', 'item_id', 'url', 'description', 'enrich_attempts')
+    for ad in pending.filter(item_id__in=item_ids).order_by('pk').only(*fields):
+        groups[ad.item_id].append(ad)
+    return groups
+
+
+def fetch_details(session, item_id, url, stop_event):
+    """Загружает и разбирает страницу объявления. None — если загрузка остановлена."""
+    html = fetch_page(session, url, HEADERS, stop_event, cache_key=detail_cache_key(item_id))
+    if html is None:
+        return None
+    with metrics.timer('bot_parse_seconds', {'engine': 'item'}):
+        details = extract_item(html)
+    published_at = details['published_at']
+    if published_at is not None and timezone.is_naive(published_at):
+        details['published_at'] = timezone.make_aware(published_at)
+    return details
+
+
+def _apply(ad, details, now):
+    for field in DETAIL_FIELDS:
+        value = details.get(field)
+        # Описание из выдачи не затираем пустым, если на странице его не нашлось
+        if value is not None:
+            setattr(ad, field, value)
+    ad.enriched_at = now
+
+
+def _fail(ad, now):
+    """Откладывает следующую попытку загрузки; после последней попытки повтора нет."""
+    ad.enrich_attempts += 1
+    if ad.enrich_attempts >= ENRICH_MAX_ATTEMPTS:
+        ad.enrich_retry_at = None
+    else:
+        ad.enrich_retry_at = now + timedelta(seconds=ENRICH_RETRY_DELAY * 2 ** (ad.enrich_attempts - 1))
+
+
+def enrich_pending(limit=ENRICH_BATCH_SIZE, workers=ENRICH_WORKERS, stop_event=None):
+    """Обогащает до limit ещё не обогащённых объявлений. Возвращает число обработанных item_id."""
+    groups = pending_items(limit)
+    if not groups:
+        return 0
+    stop_event = stop_event or threading.Event()
+    session = get_session_with_retries()
+    now = timezone.now()
+    updated = []
+    failed = []
+    processed = 0
+    with ThreadPoolExecutor(max_workers=workers, thread_name_prefix='enrich') as executor:
+        futures = {
+            executor.submit(fetch_details, session, item_id, ads[0].url, stop_event): item_id
+            for item_id, ads in groups.items()
+        }
+        for future in as_completed(futures):
+            item_id = futures[future]
+            try:
+                details = future.result()
+            except requests.exceptions.HTTPError as e:
+                status = e.response.status_code if e.response is not None else None
+                if status not in GONE_STATUSES:
+                    logger.error(f"Ошибка загрузки объявления {item_id}: {e}")
+                    metrics.inc('bot_enrich_items_total', {'outcome': 'error'})
+                    failed.extend(groups[item_id])
+                    continue
+                logger.info(f"Объявление {item_id} снято с публикации ({status})")
+                metrics.inc('bot_enrich_items_total', {'outcome': 'gone'})
+                details = {}
+            except requests.exceptions.RequestException as e:
+                logger.error(f"Ошибка загрузки объявления {item_id}: {e}")
+                metrics.inc('bot_enrich_items_total', {'outcome': 'error'})
+                failed.extend(groups[item_id])
+                continue
+            else:
+                if details is None:
+                    continue
+                metrics.inc('bot_enrich_items_total', {'outcome': 'enriched'})
+            for ad in groups[item_id]:
+                _apply(ad, details, now)
+                updated.append(ad)
+            processed += 1
+
+    for ad in failed:
+        _fail(ad, now)
+    exhausted = sorted({ad.item_id for ad in failed if ad.enrich_retry_at is None})
+    if exhausted:
+        logger.warning(f"Объявления не загружены за {ENRICH_MAX_ATTEMPTS} попыток и больше не загружаются: "
+                       f"{', '.join(exhausted)}")
+    if updated or failed:
+        with metrics.timer('bot_persist_seconds'):
+            write(AvitoAd.objects.bulk_update, updated, DETAIL_FIELDS + ['enriched_at'], batch_size=500)
+            write(AvitoAd.objects.bulk_update, failed, ['enrich_attempts', 'enrich_retry_at'], batch_size=500)
+    logger.info(f"Обогащено объявлений: {processed} из {len(groups)}, строк: {len(updated)}")
+    return processed
+
+
+def enrich_loop(stop_event, once=False, limit=ENRICH_BATCH_SIZE, workers=ENRICH_WORKERS):
+    """Обогащает новые объявления, пока не установлен stop_event.
+
+    При once=True обрабатывает все ожидающие объявления и завершается.
+    """
+    while not stop_event.is_set():
+        processed = enrich_pending(limit, workers, stop_event)
+        clustered = dedup.assign_pending()[0] if dedup.DEDUP_ENABLED else 0
+        if processed or clustered:
+            continue
+        if once:
+            return
+        stop_event.wait(ENRICH_INTERVAL)
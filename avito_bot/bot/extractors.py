@@ -0,0 +1,169 @@
+"""Извлечение объявлений из HTML страницы выдачи Avito.
+
+Движки регистрируются в EXTRACTORS. По умолчанию используется 'lxml' —
+заранее скомпилированные XPath-выражения, которые проходят дерево один раз
+на объявление. 'bs4' — прежняя реализация на BeautifulSoup, она же запасной
+вариант, если основной движок не справился со страницей.
+Движок по умолчанию задаётся переменной окружения AVITO_EXTRACTOR.
+
+Страницу отдельного объявления разбирает extract_item (только lxml).
+"""
+import logging
+import os
+import re
+from datetime import datetime
+
+import lxml.html
+from bs4 import BeautifulSoup
+from lxml import etree
+
+from . import metrics
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_EXTRACTOR = os.getenv('AVITO_EXTRACTOR', 'lxml')
+FALLBACK_EXTRACTOR = 'bs4'
+
+# Идентификатор объявления в конце URL: /moskva/kommercheskaya_nedvizhimost/ofis_45_m_1234567890
+ITEM_ID_RE = re.compile(r'_(\d+)(?:[/?#]|$)')
+# Идентификатор продавца в ссылке на профиль: /user/<id>/profile или /brands/<id>
+SELLER_ID_RE = re.compile(r'/(?:user|brands)/([^/?#]+)')
+
+
+def item_id_from_url(url):
+    """Возвращает идентификатор объявления из его URL или None."""
+    match = ITEM_ID_RE.search(url or '')
+    return match.group(1) if match else None
+
+
+def _make_ad(title, price, href, item_id, base_url):
+    url = base_url + href if href else '#'
+    return {
+        'title': title or 'Без названия',
+        'price': price or 'Не указано',
+        'url': url,
+        'item_id': item_id or item_id_from_url(href),
+    }
+
+
+def _has_next_page(hrefs, page):
+    """Есть ли в пагинации ссылка на следующую страницу."""
+    marker = f"p={page + 1}"
+    return any(re.search(rf'[?&]{marker}(?:&|$)', href) for href in hrefs)
+
+
+# Компилируем выражения один раз при импорте модуля
+_XP_ITEMS = etree.XPath('//div[@data-marker="item"]')
+_XP_TITLE = etree.XPath('(.//h3)[1]')
+_XP_PRICE = etree.XPath('(.//span[@itemprop="price"])[1]')
+_XP_URL = etree.XPath('(.//a[@itemprop="url"])[1]/@href')
+_XP_PAGINATION_HREFS = etree.XPath('(//div[@data-marker="pagination"])[1]//a/@href')
+
+
+def _lxml_text(nodes):
+    """Текст первого узла с обрезанными пробелами, как get_text(strip=True) в BeautifulSoup."""
+    if not nodes:
+        return None
+    return ''.join(part.strip() for part in nodes[0].itertext())
+
+
+def extract_lxml(html, base_url, page):
+    """Извлечение объявлений через скомпилированные XPath-выражения lxml."""
+    tree = lxml.html.document_fromstring(html)
+    ads = []
+    for listing in _XP_ITEMS(tree):
+        hrefs = _XP_URL(listing)
+        ads.append(_make_ad(
+            _lxml_text(_XP_TITLE(listing)),
+            _lxml_text(_XP_PRICE(listing)),
+            hrefs[0] if hrefs else None,
+            listing.get('data-item-id'),
+            base_url,
+        ))
+    return ads, _has_next_page(_XP_PAGINATION_HREFS(tree), page)
+
+
+_XP_DESCRIPTION = etree.XPath('(//*[@data-marker="item-view/item-description"])[1]')
+_XP_ADDRESS = etree.XPath('(//*[@data-marker="item-view/item-address"])[1]')
+_XP_SELLER_NAME = etree.XPath('(//*[@data-marker="seller-info/name"])[1]')
+_XP_SELLER_HREF = etree.XPath('(//*[@data-marker="seller-info/name"]//a/@href | //a[@data-marker="seller-link/link"]/@href)[1]')
+_XP_PUBLISHED = etree.XPath('(//*[@itemprop="datePublished"]/@content)[1]')
+
+
+def _parse_datetime(value):
+    try:
+        return datetime.fromisoformat(value.strip()) if value else None
+    except ValueError:
+        return None
+
+
+def extract_item(html):
+    """Разбирает страницу объявления.
+
+    Возвращает словарь с ключами description, seller_id, seller_name, address
+    и published_at; не найденные на странице поля — None.
+    """
+    tree = lxml.html.document_fromstring(html)
+    description = None
+    nodes = _XP_DESCRIPTION(tree)
+    if nodes:
+        # Абзацы описания — отдельными строками
+        paragraphs = nodes[0].findall('.//p') or [nodes[0]]
+        description = '\n'.join(text for text in (p.text_content().strip() for p in paragraphs) if text) or None
+    address = None
+    nodes = _XP_ADDRESS(tree)
+    if nodes:
+        # Первый span — сам адрес, следующие — станции метро и районы
+        spans = nodes[0].findall('span')
+        address = (spans[0] if spans else nodes[0]).text_content().strip() or None
+    hrefs = _XP_SELLER_HREF(tree)
+    seller = SELLER_ID_RE.search(hrefs[0]) if hrefs else None
+    published = _XP_PUBLISHED(tree)
+    return {
+        'description': description,
+        'seller_id': seller.group(1)[:64] if seller else None,
+        'seller_name': (_lxml_text(_XP_SELLER_NAME(tree)) or '')[:255] or None,
+        'address': address[:255] if address else None,
+        'published_at': _parse_datetime(published[0]) if published else None,
+    }
+
+
+def extract_bs4(html, base_url, page):
+    """Извлечение объявлений через BeautifulSoup (прежняя реализация)."""
+    soup = BeautifulSoup(html, 'lxml')
+    ads = []
+    for listing in soup.find_all('div', {'data-marker': 'item'}):
+        title_tag = listing.find('h3')
+        price_tag = listing.find('span', {'itemprop': 'price'})
+        url_tag = listing.find('a', {'itemprop': 'url'})
+        ads.append(_make_ad(
+            title_tag.get_text(strip=True) if title_tag else None,
+            price_tag.get_text(strip=True) if price_tag else None,
+            url_tag['href'] if url_tag else None,
+            listing.get('data-item-id'),
+            base_url,
+        ))
+
+    pagination = soup.find('div', {'data-marker': 'pagination'})
+    hrefs = [a.get('href', '') for a in pagination.find_all('a')] if pagination else []
+    return ads, _has_next_page(hrefs, page)
+
+
+EXTRACTORS = {
+    'lxml': extract_lxml,
+    'bs4': extract_bs4,
+}
+
+
+def extract_listings(html, base_url, page, engine=None):
+    """Разбирает страницу выдачи. Возвращает список объявлений и признак наличия следующей страницы."""
+    engine = engine or DEFAULT_EXTRACTOR
+    try:
+        with metrics.timer('bot_parse_seconds', {'engine': engine}):
+            return EXTRACTORS[engine](html, base_url, page)
+    except Exception as e:
+        if engine == FALLBACK_EXTRACTOR:
+            raise
+        logger.error(f"Движок {engine} не смог разобрать страницу {page}: {e}. Используем {FALLBACK_EXTRACTOR}")
+        with metrics.timer('bot_parse_seconds', {'engine': FALLBACK_EXTRACTOR}):
+            return EXTRACTORS[FALLBACK_EXTRACTOR](html, base_url, page)
@@ -16,13 +16,15 @@ class MessageForm(forms.Form):
     )
 
     PARSE_METHOD_CHOICES = [
-        ('api', 'Использовать API'),
-        ('scrape', 'Использовать Scraping'),
+        ('scrape', 'Поиск по Avito (Scraping)'),
+        # API отдаёт только объявления своего аккаунта, поиска по всем объявлениям в нём нет
+        ('api', 'Только мои объявления (API)'),
     ]
 
     parse_method = forms.ChoiceField(
         choices=PARSE_METHOD_CHOICES,
         widget=forms.RadioSelect(attrs={'class': 'form-check-input'}),
         required=True,
+        initial='scrape',
         label='Метод получения данных:'
     )
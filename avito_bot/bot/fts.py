@@ -0,0 +1,85 @@
+"""Полнотекстовые индексы FTS5 для AvitoAd и LogEntry и поддерживающие их триггеры.
+
+Индексы внешние по отношению к таблицам (content=...): текст хранится только
+в самих таблицах, а индекс обновляют триггеры на вставку, удаление и
+изменение индексируемых столбцов. Индексы создаёт миграция 0007_fulltext_search.
+
+Многие изменения схемы (AddField со значением по умолчанию, RemoveField,
+AlterField) SQLite выполняет пересозданием таблицы, и вместе со старой
+таблицей удаляются её триггеры — индекс перестаёт обновляться. Поэтому
+миграция, пересоздающая bot_avitoad или bot_logentry, вызывает
+restore_triggers() после такой операции, а также перед ней (с noop в прямом
+направлении): откат тоже пересоздаёт таблицу. Индекс при этом перестраивается,
+чтобы в него попали строки, изменённые, пока триггеров не было.
+
+Поиск по индексам — bot.search.
+"""
+TOKENIZER = "unicode61 remove_diacritics 2"
+
+AD_INDEX = 'bot_avitoad_fts'
+LOG_INDEX = 'bot_logentry_fts'
+
+# Индекс -> (таблица, индексируемые столбцы)
+INDEXES = {
+    AD_INDEX: ('bot_avitoad', ['title', 'description']),
+    LOG_INDEX: ('bot_logentry', ['response']),
+}
+
+TRIGGER_SUFFIXES = ('ai', 'ad', 'au')
+
+
+def _create_triggers(schema_editor, index):
+    table, columns = INDEXES[index]
+    column_list = ', '.join(columns)
+    new_values = ', '.join(f"new.{column}" for column in columns)
+    old_values = ', '.join(f"old.{column}" for column in columns)
+    schema_editor.execute(
+        f"CREATE TRIGGER {index}_ai AFTER INSERT ON {table} BEGIN "
+        f"INSERT INTO {index}(rowid, {column_list}) VALUES (new.id, {new_values}); END"
+    )
+    schema_editor.execute(
+        f"CREATE TRIGGER {index}_ad AFTER DELETE ON {table} BEGIN "
+        f"INSERT INTO {index}({index}, rowid, {column_list}) VALUES ('delete', old.id, {old_values}); END"
+    )
+    schema_editor.execute(
+        f"CREATE TRIGGER {index}_au AFTER UPDATE OF {column_list} ON {table} BEGIN "
+        f"INSERT INTO {index}({index}, rowid, {column_list}) VALUES ('delete', old.id, {old_values}); "
+        f"INSERT INTO {index}(rowid, {column_list}) VALUES (new.id, {new_values}); END"
+    )
+
+
+def _drop_triggers(schema_editor, index):
+    for suffix in TRIGGER_SUFFIXES:
+        schema_editor.execute(f"DROP TRIGGER IF EXISTS {index}_{suffix}")
+
+
+def create_indexes(schema_editor, indexes=tuple(INDEXES)):
+    """Создаёт индексы с триггерами и заполняет их уже существующими строками."""
+    if schema_editor.connection.vendor != 'sqlite':
+        return
+    for index in indexes:
+        table, columns = INDEXES[index]
+        schema_editor.execute(
+            f"CREATE VIRTUAL TABLE {index} USING fts5({', '.join(columns)}, content='{table}', content_rowid='id', "
+            f"tokenize='{TOKENIZER}', prefix='2 3 4')"
+        )
+        _create_triggers(schema_editor, index)
+        schema_editor.execute(f"INSERT INTO {index}({index}) VALUES ('rebuild')")
+
+
+def drop_indexes(schema_editor, indexes=tuple(INDEXES)):
+    if schema_editor.connection.vendor != 'sqlite':
+        return
+    for index in indexes:
+        _drop_triggers(schema_editor, index)
+        schema_editor.execute(f"DROP TABLE IF EXISTS {index}")
+
+
+def restore_triggers(schema_editor, indexes=tuple(INDEXES)):
+    """Пересоздаёт триггеры индексов после пересоздания их таблиц и перестраивает индексы."""
+    if schema_editor.connection.vendor != 'sqlite':
+        return
+    for index in indexes:
+        _drop_triggers(schema_editor, index)
+        _create_triggers(schema_editor, index)
+        schema_editor.execute(f"INSERT INTO {index}({index}) VALUES ('rebuild')")
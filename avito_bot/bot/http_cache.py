@@ -0,0 +1,183 @@
+"""Дисковый кэш HTTP-ответов для страниц поиска.
+
+Ответы хранятся сжатыми (zlib) в отдельной базе SQLite. Ключ — хеш
+нормализованного URL и заголовков запроса. Записи старше TTL не выдаются,
+а при превышении лимита размера удаляются давно не использованные записи (LRU).
+Общий размер записей ведут триггеры в таблице responses_size, поэтому запись
+в кэш не пересчитывает SUM(size) по всей таблице, а счётчик верен и тогда,
+когда кэшем пользуются несколько процессов.
+Настройки задаются переменными окружения:
+AVITO_HTTP_CACHE_PATH (settings.HTTP_CACHE_PATH), AVITO_HTTP_CACHE_TTL (0 — кэш выключен), AVITO_HTTP_CACHE_MAX_BYTES.
+"""
+import hashlib
+import logging
+import os
+import sqlite3
+import threading
+import time
+import zlib
+from urllib.parse import parse_qsl, urlencode, urlsplit, urlunsplit
+
+from django.conf import settings
+
+logger = logging.getLogger(__name__)
+
+HTTP_CACHE_PATH = str(settings.HTTP_CACHE_PATH)
+HTTP_CACHE_TTL = int(os.getenv('AVITO_HTTP_CACHE_TTL', '600'))
+HTTP_CACHE_MAX_BYTES = int(os.getenv('AVITO_HTTP_CACHE_MAX_BYTES', str(200 * 1024 * 1024)))
+
+
+def normalize_url(url):
+    """Приводит URL к каноническому виду: регистр схемы и хоста, порядок параметров, без фрагмента."""
+    parts = urlsplit(url)
+    query = urlencode(sorted(parse_qsl(parts.query, keep_blank_values=True)))
+    return urlunsplit((parts.scheme.lower(), parts.netloc.lower(), parts.path or '/', query, ''))
+
+
+def make_cache_key(url, headers=None):
+    """Ключ кэша: хеш нормализованного URL и заголовков запроса."""
+    header_part = '\n'.join(f"{name.lower()}:{value}" for name, value in sorted((headers or {}).items()))
+    return hashlib.sha256(f"{normalize_url(url)}\n{header_part}".encode('utf-8')).hexdigest()
+
+
+class ResponseCache:
+    """Кэш текстов ответов в SQLite со сроком жизни и вытеснением по LRU."""
+
+    def __init__(self, path=HTTP_CACHE_PATH, ttl=HTTP_CACHE_TTL, max_bytes=HTTP_CACHE_MAX_BYTES):
+        self.path = path
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self._local = threading.local()
+        self._stats_lock = threading.Lock()
+
+    @property
+    def enabled(self):
+        return self.ttl > 0
+
+    def _connection(self):
+        """Своё соединение на каждый поток; схема создаётся при первом подключении."""
+        connection = getattr(self._local, 'connection', None)
+        if connection is None:
+            connection = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+            connection.execute('PRAGMA journal_mode=WAL')
+            # Схема и счётчик размера создаются в одной транзакции, чтобы процессы не мешали друг другу
+            connection.execute('BEGIN IMMEDIATE')
+            connection.execute(
+                'CREATE TABLE IF NOT EXISTS responses ('
+                'key TEXT PRIMARY KEY, url TEXT NOT NULL, body BLOB NOT NULL, size INTEGER NOT NULL, '
+                'created_at REAL NOT NULL, accessed_at REAL NOT NULL)'
+            )
+            connection.execute('CREATE INDEX IF NOT EXISTS responses_accessed_at ON responses (accessed_at)')
+            connection.execute('CREATE TABLE IF NOT EXISTS responses_size (id INTEGER PRIMARY KEY, total INTEGER NOT NULL)')
+            # Для кэша, созданного до появления счётчика, он начинается с текущего размера
+            connection.execute(
+                'INSERT OR IGNORE INTO responses_size (id, total) SELECT 1, COALESCE(SUM(size), 0) FROM responses'
+            )
+            connection.execute(
+                'CREATE TRIGGER IF NOT EXISTS responses_size_ai AFTER INSERT ON responses BEGIN '
+                'UPDATE responses_size SET total = total + new.size WHERE id = 1; END'
+            )
+            connection.execute(
+                'CREATE TRIGGER IF NOT EXISTS responses_size_ad AFTER DELETE ON responses BEGIN '
+                'UPDATE responses_size SET total = total - old.size WHERE id = 1; END'
+            )
+            connection.execute(
+                'CREATE TRIGGER IF NOT EXISTS responses_size_au AFTER UPDATE OF size ON responses BEGIN '
+                'UPDATE responses_size SET total = total - old.size + new.size WHERE id = 1; END'
+            )
+            connection.execute('COMMIT')
+            self._local.connection = connection
+        return connection
+
+    def _count(self, hit):
+        with self._stats_lock:
+            if hit:
+                self.hits += 1
+            else:
+                self.misses += 1
+
+    def get(self, url, headers=None, key=None):
+        """Возвращает сохранённый текст ответа или None, если записи нет или она устарела."""
+        if not self.enabled:
+            return None
+        key = key or make_cache_key(url, headers)
+        now = time.time()
+        try:
+            connection = self._connection()
+            row = connection.execute(
+                'SELECT body FROM responses WHERE key = ? AND created_at > ?', (key, now - self.ttl)
+            ).fetchone()
+            if row is None:
+                self._count(hit=False)
+                return None
+            connection.execute('UPDATE responses SET accessed_at = ? WHERE key = ?', (now, key))
+        except sqlite3.Error as e:
+            logger.error(f"Ошибка чтения кэша HTTP-ответов: {e}")
+            self._count(hit=False)
+            return None
+        self._count(hit=True)
+        logger.info(f"Ответ взят из кэша: {url}")
+        return zlib.decompress(row[0]).decode('utf-8')
+
+    def set(self, url, text, headers=None, key=None):
+        """Сохраняет текст ответа и при необходимости вытесняет старые записи."""
+        if not self.enabled:
+            return
+        key = key or make_cache_key(url, headers)
+        body = zlib.compress(text.encode('utf-8'))
+        now = time.time()
+        try:
+            connection = self._connection()
+            # Не INSERT OR REPLACE: удаление при замене не вызывает триггеры счётчика размера
+            connection.execute(
+                'INSERT INTO responses (key, url, body, size, created_at, accessed_at) '
+                'VALUES (?, ?, ?, ?, ?, ?) ON CONFLICT (key) DO UPDATE SET url = excluded.url, '
+                'body = excluded.body, size = excluded.size, created_at = excluded.created_at, '
+                'accessed_at = excluded.accessed_at',
+                (key, url, body, len(body), now, now),
+            )
+            self._evict(connection, now)
+        except sqlite3.Error as e:
+            logger.error(f"Ошибка записи в кэш HTTP-ответов: {e}")
+
+    def _total(self, connection):
+        return connection.execute('SELECT total FROM responses_size WHERE id = 1').fetchone()[0]
+
+    def _evict(self, connection, now):
+        """Если кэш больше лимита, удаляет устаревшие записи, затем самые давно использованные.
+
+        Устаревшие записи не выдаются get, поэтому до превышения лимита их можно не удалять.
+        """
+        if self._total(connection) <= self.max_bytes:
+            return
+        connection.execute('DELETE FROM responses WHERE created_at <= ?', (now - self.ttl,))
+        total = self._total(connection)
+        if total <= self.max_bytes:
+            return
+        freed = 0
+        victims = []
+        for key, size in connection.execute('SELECT key, size FROM responses ORDER BY accessed_at'):
+            victims.append((key,))
+            freed += size
+            if total - freed <= self.max_bytes:
+                break
+        connection.executemany('DELETE FROM responses WHERE key = ?', victims)
+        logger.info(f"Из кэша HTTP-ответов вытеснено записей: {len(victims)}")
+
+    def stats(self):
+        """Счётчики попаданий и промахов, число записей и занятый объём."""
+        entries, size = 0, 0
+        if self.enabled:
+            try:
+                connection = self._connection()
+                entries = connection.execute('SELECT COUNT(*) FROM responses').fetchone()[0]
+                size = self._total(connection)
+            except sqlite3.Error as e:
+                logger.error(f"Ошибка чтения кэша HTTP-ответов: {e}")
+        with self._stats_lock:
+            return {'hits': self.hits, 'misses': self.misses, 'entries': entries, 'bytes': size}
+
+
+response_cache = ResponseCache()
@@ -0,0 +1,133 @@
+"""Общие HTTP-клиенты с пулами соединений.
+
+Вместо новой requests.Session на каждый вызов процесс держит долгоживущие
+клиенты, зарегистрированные по имени. Соединения (и TLS-сессии) переиспользуются
+между запросами и поисками. Размер пула на хост задаётся AVITO_HTTP_POOL_MAXSIZE.
+"""
+import os
+import threading
+import time
+from urllib.parse import urlsplit
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+from . import metrics, pacing
+
+# Сколько пулов (хостов) держать открытыми и сколько соединений в пуле одного хоста
+HTTP_POOL_CONNECTIONS = int(os.getenv('AVITO_HTTP_POOL_CONNECTIONS', '10'))
+HTTP_POOL_MAXSIZE = int(os.getenv('AVITO_HTTP_POOL_MAXSIZE', '10'))
+
+_clients = {}
+_clients_lock = threading.Lock()
+
+
+class PacedRetry(Retry):
+    """Retry, который не повторяет 429 сам.
+
+    Иначе urllib3 выдерживает Retry-After внутри одного запроса, а остальные потоки продолжают
+    слать запросы. Ответ 429 возвращается вызывающему, темп хоста (bot.pacing) блокирует
+    запросы к хосту на время Retry-After для всех потоков, и уже потом запрос повторяется.
+    """
+    RETRY_AFTER_STATUS_CODES = frozenset({413, 503})
+
+
+def build_retry(retry_post=True):
+    """Политика повторных попыток для всех клиентов.
+
+    При retry_post=False POST после отправки не повторяется: ни по 5xx, ни по обрыву чтения.
+    """
+    methods = ["HEAD", "GET", "OPTIONS"] + (["POST"] if retry_post else [])
+    return PacedRetry(
+        total=3,  # Общее количество попыток
+        backoff_factor=2,  # Интервал между попытками: 2, 4, 8 секунд
+        status_forcelist=[500, 502, 503, 504],  # Коды ошибок, при которых выполняется повторная попытка
+        allowed_methods=methods
+    )
+
+
+class InstrumentedSession(requests.Session):
+    """Session, записывающая в метрики число запросов, повторов и время ответа по хосту.
+
+    Результат каждого запроса сообщается темпу хоста (bot.pacing).
+    """
+
+    def send(self, request, **kwargs):
+        host = urlsplit(request.url).netloc
+        started = time.perf_counter()
+        try:
+            response = super().send(request, **kwargs)
+        except requests.exceptions.RequestException:
+            elapsed = time.perf_counter() - started
+            metrics.inc('bot_http_requests_total', {'host': host, 'status': 'error'})
+            metrics.observe('bot_http_request_seconds', elapsed, {'host': host})
+            pacing.record_response(request.url, None, elapsed)
+            raise
+        elapsed = time.perf_counter() - started
+        metrics.inc('bot_http_requests_total', {'host': host, 'status': str(response.status_code)})
+        metrics.observe('bot_http_request_seconds', elapsed, {'host': host})
+        status = response.status_code
+        retries = getattr(response.raw, 'retries', None)
+        if retries is not None and retries.history:
+            metrics.inc('bot_http_retries_total', {'host': host}, len(retries.history))
+            # Успех после повторов — всё равно сигнал перегрузки: темп учитывает последний неудачный ответ
+            status = retries.history[-1].status or status
+        pacing.record_response(request.url, status, elapsed, pacing.parse_retry_after(response.headers.get('Retry-After')),
+                               captcha=pacing.is_captcha(response))
+        return response
+
+
+def _create_session(retry_post=True):
+    session = InstrumentedSession()
+    adapter = HTTPAdapter(
+        pool_connections=HTTP_POOL_CONNECTIONS,
+        pool_maxsize=HTTP_POOL_MAXSIZE,
+        max_retries=build_retry(retry_post),
+    )
+    session.mount('https://', adapter)
+    session.mount('http://', adapter)
+    return session
+
+
+def get_client(name='default', retry_post=True):
+    """Возвращает общий для процесса клиент с указанным именем, создавая его при первом обращении.
+
+    retry_post=False — клиент для неидемпотентных POST (отправка сообщений), который их
+    не повторяет; параметр учитывается только при создании клиента.
+    """
+    with _clients_lock:
+        session = _clients.get(name)
+        if session is None:
+            session = _create_session(retry_post)
+            _clients[name] = session
+        return session
+
+
+def _pool_stats(pool):
+    # num_connections — сколько соединений пул открыл за всё время, num_requests — сколько запросов выполнил
+    idle_slots = pool.pool.qsize() if pool.pool is not None else 0
+    return {
+        'opened': pool.num_connections,
+        'requests': pool.num_requests,
+        'reused': max(pool.num_requests - pool.num_connections, 0),
+        'in_use': pool.pool.maxsize - idle_slots if pool.pool is not None else 0,
+        'maxsize': pool.pool.maxsize if pool.pool is not None else 0,
+    }
+
+
+def pool_stats():
+    """Статистика пулов соединений всех клиентов: {имя клиента: {хост: счётчики}}."""
+    with _clients_lock:
+        clients = list(_clients.items())
+    stats = {}
+    for name, session in clients:
+        client_stats = {}
+        for adapter in set(session.adapters.values()):
+            pools = adapter.poolmanager.pools
+            for key in list(pools.keys()):
+                pool = pools.get(key)
+                if pool is not None:
+                    client_stats[f"{pool.scheme}://{pool.host}:{pool.port}"] = _pool_stats(pool)
+        stats[name] = client_stats
+    return stats
@@ -0,0 +1,136 @@
+"""Сохранение результатов парсинга в AvitoAd пакетами.
+
+Словари объявлений из scrape_avito_listings приводятся к строкам модели
+(цена — в Decimal с учётом единиц и периода, идентификатор объявления —
+из item_id или URL) и записываются через bulk_create с обновлением при
+конфликте по (keyword, item_id). Все пакеты одного вызова пишутся в одной
+транзакции вместе с пересчётом затронутых сводок цен (PriceRollup).
+Кластеры почти одинаковых объявлений (bot.dedup) здесь не считаются:
+их распределяет стадия обогащения, когда у объявления есть описание.
+"""
+import logging
+import os
+import re
+from decimal import Decimal, InvalidOperation
+
+import numpy as np
+from django.db import transaction
+from django.utils import timezone
+
+from . import metrics
+from .analytics import normalize_prices, rollup_group, saved_groups, update_rollups
+from .db_writer import write
+from .extractors import item_id_from_url
+from .models import AvitoAd, JobAd, Keyword
+
+logger = logging.getLogger(__name__)
+
+INGEST_BATCH_SIZE = int(os.getenv('AVITO_INGEST_BATCH_SIZE', '500'))
+
+# Число с разделителями разрядов: '1 200 000', '85 000,50' (\s покрывает и неразрывные пробелы)
+PRICE_RE = re.compile(r'\d[\d\s]*(?:[.,]\d+)?')
+
+# Задание в обновляемые поля не входит: одно объявление могут найти несколько заданий (JobAd)
+UPSERT_FIELDS = ['title', 'url', 'price', 'price_period']
+
+
+def parse_price(text):
+    """Преобразует строку цены вида '1 200 000 ₽' в Decimal; возвращает None, если цены нет."""
+    match = PRICE_RE.search(text or '')
+    if not match:
+        return None
+    number = re.sub(r'\s', '', match.group()).replace(',', '.')
+    try:
+        return Decimal(number)
+    except InvalidOperation:
+        return None
+
+
+def resolve_keywords(words):
+    """Возвращает словарь слово -> Keyword, создавая недостающие ключевые слова одним запросом.
+
+    Слово могут одновременно создавать несколько поисков: вставка пропускает уже
+    существующие (word уникален), и все созданные слова перечитываются из базы.
+    """
+    words = {word[:100] for word in words}
+    keywords = {keyword.word: keyword for keyword in Keyword.objects.filter(word__in=words)}
+    missing = words - keywords.keys()
+    if missing:
+        Keyword.objects.bulk_create([Keyword(word=word) for word in missing], ignore_conflicts=True)
+        keywords.update((keyword.word, keyword) for keyword in Keyword.objects.filter(word__in=missing))
+    return keywords
+
+
+def normalize_ad(ad, keyword, price=None, price_period=''):
+    """Превращает словарь объявления в несохранённый объект AvitoAd.
+
+    price и price_period — уже нормализованная цена (см. bot.analytics.normalize_prices);
+    если цена не передана, она разбирается из текста parse_price.
+    """
+    if price is None:
+        price = parse_price(ad.get('price'))
+    return AvitoAd(
+        keyword=keyword,
+        item_id=ad.get('item_id') or item_id_from_url(ad.get('url')),
+        title=(ad.get('title') or '')[:255],
+        description=ad.get('description', ''),
+        url=ad.get('url', ''),
+        price=price,
+        price_period=price_period,
+    )
+
+
+def ingest_ads(ads, job=None, batch_size=INGEST_BATCH_SIZE):
+    """Сохраняет объявления в AvitoAd пакетами по batch_size в одной транзакции.
+
+    Объявление, уже сохранённое по тому же ключевому слову, обновляется. Если передано
+    задание job, объявления связываются с ним (JobAd); связи с другими заданиями остаются.
+    Возвращает число записанных строк.
+    """
+    if not ads:
+        return 0
+    keywords = resolve_keywords(ad['keyword'] for ad in ads)
+    prices, periods = normalize_prices([ad.get('price') for ad in ads])
+
+    # В одном INSERT строка с одним и тем же ключом может встретиться только один раз
+    rows = {}
+    for ad, price, period in zip(ads, prices, periods):
+        price = None if np.isnan(price) else Decimal(str(price))
+        row = normalize_ad(ad, keywords[ad['keyword'][:100]], price=price, price_period=str(period))
+        key = (row.keyword.pk, row.item_id) if row.item_id else (row.keyword.pk, id(row))
+        rows[key] = row
+
+    def save():
+        with transaction.atomic():
+            # Группы сводок, в которых объявления были до обновления: цена могла перейти в другую
+            before = saved_groups(
+                {row.keyword.pk for row in rows.values()},
+                [row.item_id for row in rows.values() if row.item_id],
+            )
+            AvitoAd.objects.bulk_create(
+                list(rows.values()),
+                batch_size=batch_size,
+                update_conflicts=True,
+                unique_fields=['keyword', 'item_id'],
+                update_fields=UPSERT_FIELDS,
+            )
+            if job is not None:
+                JobAd.objects.bulk_create(
+                    [JobAd(job=job, ad_id=row.pk) for row in rows.values() if row.pk],
+                    batch_size=batch_size,
+                    ignore_conflicts=True,
+                )
+            # Сводки цен пересчитываются только для затронутых групп; день обновлённого объявления —
+            # день его первого сохранения (created_at в базе не меняется)
+            groups = set(before.values())
+            for row in rows.values():
+                saved = before.get((row.keyword.pk, row.item_id))
+                day = saved[1] if saved else timezone.localdate(row.created_at)
+                groups.add(rollup_group(row.keyword.pk, day, row.url, row.price_period))
+            update_rollups(groups)
+
+    with metrics.timer('bot_persist_seconds'):
+        write(save)
+    metrics.inc('bot_persist_rows_total', value=len(rows))
+    logger.info(f"Сохранено объявлений: {len(rows)}")
+    return len(rows)
@@ -0,0 +1,160 @@
+"""Фоновые поисковые задания.
+
+Обработчик формы только ставит SearchJob в очередь, а поиск выполняют воркеры
+(python manage.py run_search_workers). Очередь хранится в БД: воркер захватывает
+задание на время аренды (lease) и продлевает её по мере обработки страниц.
+Если воркер упал, после истечения аренды задание заберёт другой воркер.
+"""
+import logging
+import threading
+import time
+import uuid
+from datetime import timedelta
+
+from django.db import close_old_connections
+from django.db.models import F, Q
+from django.utils import timezone
+
+from . import metrics
+from .avito_api import fetch_api_listings
+from .ingest import ingest_ads
+from .messenger import dispatch_message
+from .models import SearchJob
+from .planner import search_listings
+from .profiling import profiled
+
+logger = logging.getLogger(__name__)
+
+# Длительность аренды задания; продлевается после каждой страницы
+LEASE_SECONDS = 120
+# Сколько раз задание может быть взято в работу, прежде чем оно будет помечено как ошибочное
+MAX_ATTEMPTS = 3
+# Пауза между опросами очереди, когда заданий нет
+POLL_INTERVAL = 1.0
+
+# Способы получения объявлений по значению MessageForm.parse_method; парсинг сайта идёт через
+# общий планировщик, поэтому пересекающиеся задания не обходят одну и ту же выдачу повторно.
+# 'api' — не поиск по Avito, а только объявления своего аккаунта (см. bot.avito_api)
+FETCHERS = {
+    'api': fetch_api_listings,
+    'scrape': search_listings,
+}
+
+
+def enqueue_search(keywords, parse_method='scrape', max_ads=10, message=None):
+    """Ставит поиск в очередь и сразу возвращает созданное задание.
+
+    Если передано message, после поиска оно будет разослано продавцам найденных объявлений.
+    """
+    job = SearchJob.objects.create(keywords=list(keywords), parse_method=parse_method, max_ads=max_ads,
+                                   message=message)
+    logger.info(f"Поисковое задание #{job.pk} поставлено в очередь: {job.keywords}")
+    return job
+
+
+def claim_job(owner, lease_seconds=LEASE_SECONDS):
+    """Захватывает первое доступное задание: ожидающее или с истёкшей арендой."""
+    now = timezone.now()
+    candidates = (
+        SearchJob.objects
+        .filter(Q(status=SearchJob.STATUS_PENDING) |
+                Q(status=SearchJob.STATUS_RUNNING, lease_expires_at__lt=now))
+        .order_by('created_at')
+        .values_list('pk', 'status', 'lease_owner')[:10]
+    )
+    for pk, status, lease_owner in candidates:
+        # Условное обновление: задание получит только тот воркер, чей UPDATE сработал первым
+        claimed = SearchJob.objects.filter(pk=pk, status=status, lease_owner=lease_owner).update(
+            status=SearchJob.STATUS_RUNNING,
+            lease_owner=owner,
+            lease_expires_at=now + timedelta(seconds=lease_seconds),
+            attempts=F('attempts') + 1,
+            started_at=now,
+        )
+        if claimed:
+            return SearchJob.objects.get(pk=pk)
+    return None
+
+
+def run_job(job, owner):
+    """Выполняет поиск по заданию, сохраняя объявления в AvitoAd постранично."""
+    saved = 0
+
+    def on_page(query, page, ads):
+        nonlocal saved
+        ads = ads[:max(job.max_ads - saved, 0)]
+        ingest_ads(ads, job=job)
+        saved += len(ads)
+        # Обновляем прогресс и продлеваем аренду; если аренду перехватили — прекращаем работу
+        updated = SearchJob.objects.filter(pk=job.pk, lease_owner=owner).update(
+            pages_done=F('pages_done') + 1,
+            ads_found=saved,
+            lease_expires_at=timezone.now() + timedelta(seconds=LEASE_SECONDS),
+        )
+        if not updated:
+            raise RuntimeError(f"Аренда задания #{job.pk} потеряна")
+
+    # Повторная попытка начинается с чистого листа; уже сохранённые объявления обновятся при upsert
+    SearchJob.objects.filter(pk=job.pk).update(pages_done=0, ads_found=0, error='')
+
+    fetch = FETCHERS.get(job.parse_method, search_listings)
+    fetch(job.keywords, max_ads=job.max_ads, on_page=on_page)
+
+
+def process_job(job, owner):
+    """Выполняет задание и фиксирует его итоговый статус."""
+    logger.info(f"Воркер {owner} взял задание #{job.pk}")
+    started = time.perf_counter()
+    try:
+        with profiled(f"job {job.pk} {job.parse_method}"):
+            run_job(job, owner)
+    except Exception as e:
+        metrics.observe('bot_job_seconds', time.perf_counter() - started,
+                        {'parse_method': job.parse_method, 'status': 'failed'})
+        logger.error(f"Ошибка при выполнении задания #{job.pk}: {e}")
+        status = SearchJob.STATUS_FAILED if job.attempts >= MAX_ATTEMPTS else SearchJob.STATUS_PENDING
+        SearchJob.objects.filter(pk=job.pk, lease_owner=owner).update(
+            status=status, error=str(e), lease_owner='', lease_expires_at=None,
+            finished_at=timezone.now() if status == SearchJob.STATUS_FAILED else None,
+        )
+        return
+    metrics.observe('bot_job_seconds', time.perf_counter() - started,
+                    {'parse_method': job.parse_method, 'status': 'done'})
+    SearchJob.objects.filter(pk=job.pk, lease_owner=owner).update(
+        status=SearchJob.STATUS_DONE, lease_owner='', lease_expires_at=None, finished_at=timezone.now(),
+    )
+    logger.info(f"Задание #{job.pk} выполнено")
+
+    if job.message_id:
+        try:
+            dispatch_message(job.message, job.ads.all())
+        except Exception as e:
+            logger.error(f"Ошибка рассылки сообщения по заданию #{job.pk}: {e}")
+
+
+def worker_loop(stop_event, poll_interval=POLL_INTERVAL):
+    """Цикл воркера: забирает задания из очереди, пока не установлен stop_event."""
+    owner = f"{threading.current_thread().name}-{uuid.uuid4().hex[:8]}"
+    while not stop_event.is_set():
+        close_old_connections()
+        try:
+            job = claim_job(owner)
+        except Exception as e:
+            logger.error(f"Воркер {owner} не смог получить задание: {e}")
+            job = None
+        if job is None:
+            stop_event.wait(poll_interval)
+            continue
+        process_job(job, owner)
+    close_old_connections()
+
+
+def start_workers(count):
+    """Запускает count потоков-воркеров. Возвращает событие остановки и список потоков."""
+    stop_event = threading.Event()
+    threads = []
+    for i in range(count):
+        thread = threading.Thread(target=worker_loop, args=(stop_event,), name=f"search-worker-{i + 1}", daemon=True)
+        thread.start()
+        threads.append(thread)
+    return stop_event, threads
@@ -0,0 +1,27 @@
+"""Межпроцессные блокировки на строках Lease в БД.
+
+Блокировка захватывается одним условным UPDATE (свободна или срок истёк),
+как аренда заданий в bot.jobs, поэтому захватить её может только один
+процесс при любом бэкенде кэша. Держатель, не освободивший блокировку
+(например, упавший процесс), теряет её по истечении срока.
+"""
+from datetime import timedelta
+
+from django.db.models import Q
+from django.utils import timezone
+
+from .models import Lease
+
+
+def acquire(name, owner, seconds):
+    """Захватывает блокировку name для owner на seconds секунд. Возвращает True при успехе."""
+    now = timezone.now()
+    Lease.objects.get_or_create(name=name)
+    return Lease.objects.filter(Q(owner='') | Q(expires_at__lt=now), name=name).update(
+        owner=owner, expires_at=now + timedelta(seconds=seconds),
+    ) == 1
+
+
+def release(name, owner):
+    """Освобождает блокировку, если она всё ещё принадлежит owner."""
+    Lease.objects.filter(name=name, owner=owner).update(owner='', expires_at=None)
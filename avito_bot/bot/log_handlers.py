@@ -0,0 +1,87 @@
+"""Обработчики логов приложения.
+
+Записи пишутся в файл не в потоке запроса: QueueingFileHandler кладёт
+их в очередь, а фоновый QueueListener форматирует их в JSON-строки и пишет
+в файл. Подключается через settings.LOGGING.
+
+В bot.log пишут несколько процессов (веб-сервер, воркеры заданий, мониторинг),
+поэтому сами процессы файл не ротируют: RotatingFileHandler в каждом процессе
+переименовывал бы файл независимо от других, теряя и перемешивая записи.
+Ротацию выполняет внешний logrotate, переименовывая bot.log в bot.log.1 и т. д.
+(эти имена читает bot.logreader), а WatchedFileHandler замечает, что файл
+заменён, и открывает новый. Пример /etc/logrotate.d/avito_bot:
+
+    /srv/avito_bot/bot.log {
+        size 10M
+        rotate 5
+        missingok
+        notifempty
+    }
+
+Где logrotate нет (например, при разработке под Windows), max_bytes > 0
+(BOT_LOG_MAX_BYTES) включает ротацию по размеру RotatingFileHandler с теми же
+именами файлов. Она корректна, только пока в лог пишет один процесс.
+"""
+import atexit
+import json
+import logging
+import queue
+from logging.handlers import QueueHandler, QueueListener, RotatingFileHandler, WatchedFileHandler
+
+TIME_FORMAT = '%Y-%m-%d %H:%M:%S'
+# Сколько старых файлов хранить при ротации по размеру
+BACKUP_COUNT = 5
+
+
+class JsonFormatter(logging.Formatter):
+    """Одна запись — одна JSON-строка: время, уровень, логгер, сообщение и трассировка."""
+
+    def format(self, record):
+        data = {
+            'time': self.formatTime(record, TIME_FORMAT),
+            'level': record.levelname,
+            'logger': record.name,
+            'message': record.getMessage(),
+        }
+        if record.exc_info:
+            data['exc'] = self.formatException(record.exc_info)
+        elif record.exc_text:
+            # Трассировка, уже отформатированная в QueueingFileHandler.prepare
+            data['exc'] = record.exc_text
+        return json.dumps(data, ensure_ascii=False)
+
+
+class QueueingFileHandler(QueueHandler):
+    """Неблокирующий обработчик: очередь в памяти и фоновая запись в файл.
+
+    Файл ротируется извне, а при max_bytes > 0 — самим обработчиком по размеру.
+    """
+
+    def __init__(self, filename, max_bytes=0):
+        super().__init__(queue.SimpleQueue())
+        if max_bytes:
+            self.file_handler = RotatingFileHandler(filename, maxBytes=max_bytes, backupCount=BACKUP_COUNT,
+                                                    encoding='utf-8', delay=True)
+        else:
+            self.file_handler = WatchedFileHandler(filename, encoding='utf-8', delay=True)
+        self.file_handler.setFormatter(JsonFormatter())
+        self.listener = QueueListener(self.queue, self.file_handler, respect_handler_level=True)
+        self.listener.start()
+        atexit.register(self.close)
+
+    def close(self):
+        """Дописывает записи из очереди и закрывает файл; повторный вызов ничего не делает."""
+        if self.listener._thread is not None:
+            self.listener.stop()
+            self.file_handler.close()
+        super().close()
+
+    def prepare(self, record):
+        # Форматирование выполняется в фоновом потоке; здесь только фиксируем текст сообщения
+        record.message = record.getMessage()
+        record.msg = record.message
+        record.args = None
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        return record
@@ -0,0 +1,195 @@
+"""Чтение bot.log с конца файла без загрузки его целиком.
+
+Файл читается блоками от конца к началу. Понимает JSON-строки
+(см. bot.log_handlers.JsonFormatter) и прежний текстовый формат, в котором
+строки без временной метки (трассировки исключений) присоединяются к предыдущей записи.
+Дочитав текущий файл до начала, чтение продолжается в ротированных копиях
+bot.log.1, bot.log.2, ... Курсор для перехода к более старым записям —
+строка 'inode:смещение': ротация переименовывает файлы, но не меняет их inode,
+поэтому курсор указывает на то же место и после ротации. Поиск по времени «до»
+выполняется двоичным поиском по смещениям, поэтому весь файл не просматривается.
+"""
+import json
+import os
+import re
+from datetime import datetime
+
+LOG_FILE = 'bot.log'
+BLOCK_SIZE = 64 * 1024
+TIME_FORMAT = '%Y-%m-%d %H:%M:%S'
+
+# Начало записи: '2024-09-18 09:00:10 - INFO - сообщение'
+RECORD_RE = re.compile(r'^(\d{4}-\d{2}-\d{2} \d{2}:\d{2}:\d{2}) - ([A-Z]+) - ')
+
+
+def parse_record_head(line):
+    """Возвращает (время, уровень, текст) для первой строки записи или None для строки-продолжения."""
+    if line.startswith('{'):
+        try:
+            data = json.loads(line)
+            record_time = datetime.strptime(data['time'], TIME_FORMAT)
+        except (ValueError, KeyError, TypeError):
+            return None
+        text = f"{data['time']} - {data.get('level', '')} - {data.get('logger', '')} - {data.get('message', '')}"
+        if data.get('exc'):
+            text += '\n' + data['exc']
+        return record_time, data.get('level', ''), text
+    match = RECORD_RE.match(line)
+    if not match:
+        return None
+    return datetime.strptime(match.group(1), TIME_FORMAT), match.group(2), line
+
+
+def iter_lines_backwards(f, end, block_size=BLOCK_SIZE):
+    """Возвращает пары (смещение начала строки, строка) от позиции end к началу файла."""
+    position = end
+    tail = b''
+    while position > 0:
+        read_size = min(block_size, position)
+        position -= read_size
+        f.seek(position)
+        chunk = f.read(read_size) + tail
+        lines = chunk.split(b'\n')
+        # Первая строка блока может быть неполной — дочитаем её со следующим блоком
+        tail = lines.pop(0)
+        offset = position + len(tail) + 1
+        parsed = []
+        for line in lines:
+            parsed.append((offset, line))
+            offset += len(line) + 1
+        for offset, line in reversed(parsed):
+            yield offset, line.decode('utf-8', errors='replace')
+    if tail:
+        yield 0, tail.decode('utf-8', errors='replace')
+
+
+def iter_records_backwards(f, end):
+    """Возвращает записи (смещение, время, уровень, текст) от позиции end к началу файла."""
+    continuation = []
+    for offset, line in iter_lines_backwards(f, end):
+        if not line and not continuation:
+            continue
+        head = parse_record_head(line)
+        if head is None:
+            continuation.append(line)
+            continue
+        text = '\n'.join([head[2]] + list(reversed(continuation)))
+        continuation = []
+        yield offset, head[0], head[1], text
+
+
+def _record_time_at(f, offset, size):
+    """Время первой полной записи, начинающейся не раньше offset."""
+    f.seek(offset)
+    if offset:
+        f.readline()
+    while f.tell() < size:
+        head = parse_record_head(f.readline().decode('utf-8', errors='replace'))
+        if head is not None:
+            return head[0]
+    return None
+
+
+def offset_before_time(f, until, size):
+    """Двоичным поиском находит смещение, до которого все записи не новее until."""
+    low, high = 0, size
+    while high - low > BLOCK_SIZE:
+        middle = (low + high) // 2
+        record_time = _record_time_at(f, middle, size)
+        if record_time is None or record_time > until:
+            high = middle
+        else:
+            low = middle
+    # Внутри последнего блока уточняем границу построчно
+    f.seek(low)
+    if low:
+        f.readline()
+    while f.tell() < high:
+        position = f.tell()
+        head = parse_record_head(f.readline().decode('utf-8', errors='replace'))
+        if head is not None and head[0] > until:
+            return position
+    return high
+
+
+def log_files(path=LOG_FILE):
+    """Текущий файл лога и его ротированные копии (path.1, path.2, ...) от новых к старым."""
+    files = [str(path)]
+    number = 1
+    while os.path.exists(f"{path}.{number}"):
+        files.append(f"{path}.{number}")
+        number += 1
+    return files
+
+
+def parse_cursor(cursor):
+    """Разбирает курсор 'inode:смещение'; None, если курсор пуст или некорректен."""
+    inode, _, offset = (cursor or '').partition(':')
+    if not (inode.isdigit() and offset.isdigit()):
+        return None
+    return int(inode), int(offset)
+
+
+def _inode(name):
+    try:
+        return os.stat(name).st_ino
+    except FileNotFoundError:
+        return None
+
+
+def _iter_records_from(files, before, until=None):
+    """Записи (курсор, время, уровень, текст) от позиции before к началу, через все файлы files.
+
+    Курсор записи — пара (inode, смещение её начала). Если файл курсора уже удалён
+    ротацией, записей нет.
+    """
+    start = 0
+    if before is not None:
+        inodes = [_inode(name) for name in files]
+        if before[0] not in inodes:
+            return
+        start = inodes.index(before[0])
+    for index, name in enumerate(files[start:], start=start):
+        try:
+            f = open(name, 'rb')
+        except FileNotFoundError:
+            # Текущего файла нет — сообщаем об этом; копия могла исчезнуть при ротации
+            if index == 0:
+                raise
+            continue
+        with f:
+            stat = os.fstat(f.fileno())
+            end = stat.st_size
+            if before is not None and index == start:
+                end = min(before[1], end)
+            if until is not None:
+                end = min(end, offset_before_time(f, until, stat.st_size))
+            for offset, record_time, level, text in iter_records_backwards(f, end):
+                yield (stat.st_ino, offset), record_time, level, text
+
+
+def read_log_page(path=LOG_FILE, before=None, limit=200, levels=None, since=None, until=None):
+    """Возвращает страницу записей (от старых к новым) и курсор для следующей, более старой страницы.
+
+    before — курсор 'inode:смещение', с которого читать назад (по умолчанию — конец текущего файла);
+    levels — множество уровней ('INFO', 'ERROR', ...); since/until — границы по времени.
+    Курсор равен None, если более старых записей нет. При limit=0 страница пуста, а курсор — тот же before.
+    """
+    records = []
+    next_before = None
+    # Начало последней показанной записи; пока записей нет — сам курсор before
+    records_start = parse_cursor(before)
+    for record_cursor, record_time, level, text in _iter_records_from(log_files(path), parse_cursor(before), until):
+        if since is not None and record_time < since:
+            break
+        if levels and level not in levels:
+            continue
+        if len(records) >= limit:
+            # Следующая страница начнётся с этой записи: читаем назад от начала последней показанной
+            if records_start is not None:
+                next_before = f"{records_start[0]}:{records_start[1]}"
+            break
+        records.append((record_time, level, text))
+        records_start = record_cursor
+    records.reverse()
+    return records, next_before
@@ -0,0 +1,23 @@
+from django.core.management.base import BaseCommand
+
+from bot.archive import ARCHIVE_AFTER_DAYS, ARCHIVE_CHUNK_SIZE, ARCHIVE_TABLES, archive_table
+
+
+class Command(BaseCommand):
+    help = 'Переносит старые объявления и записи журнала рассылки в сжатый архив и удаляет их из базы'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--table', action='append', choices=sorted(ARCHIVE_TABLES),
+                            help='Таблица для архивирования (можно несколько, по умолчанию все)')
+        parser.add_argument('--older-than-days', type=int, default=ARCHIVE_AFTER_DAYS,
+                            help='Архивировать строки старше этого числа дней')
+        parser.add_argument('--chunk-size', type=int, default=ARCHIVE_CHUNK_SIZE,
+                            help='Сколько строк переносить и удалять за одну транзакцию')
+        parser.add_argument('--dry-run', action='store_true', help='Только посчитать строки')
+
+    def handle(self, *args, **options):
+        for table in options['table'] or list(ARCHIVE_TABLES):
+            count = archive_table(table, older_than_days=options['older_than_days'],
+                                  chunk_size=options['chunk_size'], dry_run=options['dry_run'])
+            verb = 'к переносу' if options['dry_run'] else 'перенесено'
+            self.stdout.write(f"{table}: {verb} {count} строк")
@@ -0,0 +1,67 @@
+import json
+import platform
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test.utils import setup_databases, teardown_databases
+
+from bot.bench.benchmarks import BENCHMARKS, THRESHOLDS_PATH, check_thresholds, load_thresholds
+from bot.bench.fake_server import FakeAvitoServer
+
+
+class Command(BaseCommand):
+    help = 'Запускает бенчмарки против локального фейкового Avito и проверяет пороги регрессии'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--only', action='append', choices=sorted(BENCHMARKS),
+                            help='Запустить только этот бенчмарк (можно несколько)')
+        parser.add_argument('--latency', type=float, default=20,
+                            help='Задержка ответа фейкового сервера, мс')
+        parser.add_argument('--error-rate', type=float, default=0.0,
+                            help='Доля ответов 503 фейкового сервера (0..1)')
+        parser.add_argument('--output', help='Записать результат в JSON-файл')
+        parser.add_argument('--thresholds', default=str(THRESHOLDS_PATH), help='Файл с порогами регрессии')
+        parser.add_argument('--check', action='store_true',
+                            help='Завершиться с ошибкой, если нарушен хотя бы один порог')
+
+    def handle(self, *args, **options):
+        names = options['only'] or list(BENCHMARKS)
+        results = {}
+        # Замеры идут на отдельной тестовой БД, рабочая база не затрагивается. Для SQLite тестовая
+        # база создаётся в файле, а не в памяти, чтобы запись шла через диск с настройками из settings
+        with tempfile.TemporaryDirectory() as directory:
+            if connection.vendor == 'sqlite':
+                connection.settings_dict['TEST']['NAME'] = str(Path(directory) / 'bench.sqlite3')
+            old_config = setup_databases(verbosity=0, interactive=False)
+            try:
+                with FakeAvitoServer(latency=options['latency'] / 1000, error_rate=options['error_rate']) as server:
+                    for name in names:
+                        self.stderr.write(f"Бенчмарк {name}...")
+                        results[name] = BENCHMARKS[name](server)
+            finally:
+                teardown_databases(old_config, verbosity=0)
+
+        failures = check_thresholds(results, load_thresholds(options['thresholds']))
+        report = {
+            'meta': {
+                'timestamp': int(time.time()),
+                'python': sys.version.split()[0],
+                'platform': platform.platform(),
+                'latency_ms': options['latency'],
+                'error_rate': options['error_rate'],
+            },
+            'results': results,
+            'failures': failures,
+        }
+        output = json.dumps(report, ensure_ascii=False, indent=2)
+        if options['output']:
+            with open(options['output'], 'w', encoding='utf-8') as f:
+                f.write(output + '\n')
+        self.stdout.write(output)
+
+        if failures and options['check']:
+            raise CommandError(f"Нарушены пороги: {'; '.join(failures)}")
@@ -0,0 +1,33 @@
+import json
+
+from django.core.management.base import BaseCommand
+
+from bot.bench.benchmarks import bench_extractor
+from bot.bench.fake_server import TESTDATA_DIR
+from bot.extractors import EXTRACTORS
+
+
+class Command(BaseCommand):
+    help = 'Сравнивает скорость и потребление памяти движков извлечения объявлений на сохранённых страницах'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--repeat', type=int, default=20, help='Сколько раз разобрать каждую страницу')
+        parser.add_argument('--engine', action='append', choices=sorted(EXTRACTORS), help='Движок (можно несколько)')
+        parser.add_argument('--json', action='store_true', help='Вывести результат в формате JSON')
+
+    def handle(self, *args, **options):
+        paths = sorted(TESTDATA_DIR.glob('search_page*.html'))
+        pages = [path.read_text(encoding='utf-8') for path in paths]
+        engines = options['engine'] or list(EXTRACTORS)
+
+        results = {engine: bench_extractor(EXTRACTORS[engine], pages, options['repeat']) for engine in engines}
+
+        if options['json']:
+            self.stdout.write(json.dumps(results, ensure_ascii=False, indent=2))
+            return
+        self.stdout.write(f"Страниц в наборе: {len(pages)}, повторов: {options['repeat']}")
+        for engine, result in results.items():
+            self.stdout.write(
+                f"{engine:>6}: {result['pages_per_sec']:>8} стр/с, "
+                f"пик памяти {result['peak_memory_kb']} КБ, объявлений {result['ads']}"
+            )
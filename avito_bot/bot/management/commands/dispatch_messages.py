@@ -0,0 +1,29 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from bot.messenger import dispatch_message
+from bot.models import AvitoAd, Message
+
+
+class Command(BaseCommand):
+    help = 'Отправляет сообщение продавцам объявлений найденных заданием или по ключевому слову'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--message', type=int, required=True, help='id сообщения (Message)')
+        parser.add_argument('--job', type=int, help='id поискового задания (SearchJob)')
+        parser.add_argument('--keyword', help='Ключевое слово (Keyword.word)')
+
+    def handle(self, *args, **options):
+        try:
+            message = Message.objects.get(pk=options['message'])
+        except Message.DoesNotExist:
+            raise CommandError(f"Сообщение #{options['message']} не найдено")
+
+        if options['job']:
+            ads = AvitoAd.objects.filter(jobs=options['job'])
+        elif options['keyword']:
+            ads = AvitoAd.objects.filter(keyword__word=options['keyword'])
+        else:
+            raise CommandError('Укажите --job или --keyword')
+
+        counts = dispatch_message(message, ads.only('pk', 'keyword_id', 'item_id', 'url'))
+        self.stdout.write(', '.join(f"{status}: {count}" for status, count in counts.items()))
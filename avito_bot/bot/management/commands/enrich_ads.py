@@ -0,0 +1,33 @@
+import threading
+
+from django.core.management.base import BaseCommand
+
+from bot.enrich import ENRICH_BATCH_SIZE, ENRICH_WORKERS, enrich_loop
+
+
+class Command(BaseCommand):
+    help = 'Загружает страницы новых объявлений: описание, продавец, адрес и дата публикации'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--once', action='store_true',
+                            help='Обработать ожидающие объявления и завершиться')
+        parser.add_argument('--workers', type=int, default=ENRICH_WORKERS, help='Одновременных загрузок')
+        parser.add_argument('--batch-size', type=int, default=ENRICH_BATCH_SIZE, help='Объявлений за один проход')
+
+    def handle(self, *args, **options):
+        stop_event = threading.Event()
+        kwargs = {'limit': options['batch_size'], 'workers': options['workers']}
+        if options['once']:
+            enrich_loop(stop_event, once=True, **kwargs)
+            return
+
+        thread = threading.Thread(target=enrich_loop, args=(stop_event,), kwargs=kwargs, name='enrich', daemon=True)
+        thread.start()
+        self.stdout.write("Обогащение объявлений запущено. Для остановки нажмите Ctrl+C.")
+        try:
+            while thread.is_alive():
+                thread.join(timeout=1)
+        except KeyboardInterrupt:
+            self.stdout.write("Остановка обогащения...")
+            stop_event.set()
+            thread.join()
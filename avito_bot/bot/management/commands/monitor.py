@@ -0,0 +1,30 @@
+import threading
+
+from django.core.management.base import BaseCommand
+
+from bot.monitor import monitor_loop
+
+
+class Command(BaseCommand):
+    help = 'Мониторит ключевые слова с включённым мониторингом (is_active) по адаптивному расписанию'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--once', action='store_true',
+                            help='Обойти только слова, время которых наступило, и завершиться')
+
+    def handle(self, *args, **options):
+        stop_event = threading.Event()
+        if options['once']:
+            monitor_loop(stop_event, once=True)
+            return
+
+        thread = threading.Thread(target=monitor_loop, args=(stop_event,), name='monitor', daemon=True)
+        thread.start()
+        self.stdout.write("Мониторинг запущен. Для остановки нажмите Ctrl+C.")
+        try:
+            while thread.is_alive():
+                thread.join(timeout=1)
+        except KeyboardInterrupt:
+            self.stdout.write("Остановка мониторинга...")
+            stop_event.set()
+            thread.join()
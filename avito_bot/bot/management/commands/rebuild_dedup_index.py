@@ -0,0 +1,20 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from bot.dedup import rebuild_index
+
+
+class Command(BaseCommand):
+    help = 'Перестраивает LSH-индекс и кластеры почти одинаковых объявлений'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--chunk-size', type=int, default=1000, help='Объявлений в одном пакете')
+
+    def handle(self, *args, **options):
+        started = time.perf_counter()
+        processed, duplicates = rebuild_index(options['chunk_size'])
+        self.stdout.write(
+            f"Объявлений: {processed}, копий в существующих кластерах: {duplicates}, "
+            f"за {time.perf_counter() - started:.1f} с"
+        )
@@ -0,0 +1,14 @@
+from django.core.management.base import BaseCommand
+
+from bot.analytics import rebuild_rollups
+
+
+class Command(BaseCommand):
+    help = 'Пересчитывает сводки цен (PriceRollup) по сохранённым объявлениям'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--keyword', type=int, action='append', help='id ключевого слова (можно несколько)')
+
+    def handle(self, *args, **options):
+        written = rebuild_rollups(options['keyword'])
+        self.stdout.write(f"Записано строк сводки: {written}")
@@ -0,0 +1,14 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from bot.search import rebuild_indexes
+
+
+class Command(BaseCommand):
+    help = 'Перестраивает полнотекстовые индексы объявлений и ответов из лога рассылки'
+
+    def handle(self, *args, **options):
+        started = time.perf_counter()
+        rebuild_indexes()
+        self.stdout.write(f"Индексы перестроены за {time.perf_counter() - started:.1f} с")
@@ -0,0 +1,23 @@
+from django.core.management.base import BaseCommand
+
+from bot.jobs import start_workers
+
+
+class Command(BaseCommand):
+    help = 'Запускает пул воркеров, выполняющих поисковые задания из очереди'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--workers', type=int, default=4, help='Количество воркеров')
+
+    def handle(self, *args, **options):
+        stop_event, threads = start_workers(options['workers'])
+        self.stdout.write(f"Запущено воркеров: {len(threads)}. Для остановки нажмите Ctrl+C.")
+        try:
+            for thread in threads:
+                while thread.is_alive():
+                    thread.join(timeout=1)
+        except KeyboardInterrupt:
+            self.stdout.write("Остановка воркеров...")
+            stop_event.set()
+            for thread in threads:
+                thread.join()
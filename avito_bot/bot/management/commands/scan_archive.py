@@ -0,0 +1,33 @@
+import json
+from datetime import date
+
+from django.core.management.base import BaseCommand, CommandError
+
+from bot.archive import ARCHIVE_TABLES, scan_archive
+
+
+def _parse_date(value):
+    try:
+        return date.fromisoformat(value) if value else None
+    except ValueError:
+        raise CommandError(f"Неверная дата: {value} (ожидается ГГГГ-ММ-ДД)")
+
+
+class Command(BaseCommand):
+    help = 'Читает архив объявлений или журнала рассылки и выводит строки в формате JSON Lines'
+
+    def add_arguments(self, parser):
+        parser.add_argument('table', choices=sorted(ARCHIVE_TABLES))
+        parser.add_argument('--since', help='С даты (ГГГГ-ММ-ДД, включительно)')
+        parser.add_argument('--until', help='По дату (ГГГГ-ММ-ДД, не включая)')
+        parser.add_argument('--keyword', type=int, action='append', help='id ключевого слова (можно несколько)')
+        parser.add_argument('--count', action='store_true', help='Вывести только число строк')
+
+    def handle(self, *args, **options):
+        rows = scan_archive(options['table'], since=_parse_date(options['since']),
+                            until=_parse_date(options['until']), keyword_ids=options['keyword'])
+        if options['count']:
+            self.stdout.write(str(sum(1 for _ in rows)))
+            return
+        for row in rows:
+            self.stdout.write(json.dumps(row, ensure_ascii=False))
@@ -0,0 +1,271 @@
+"""Рассылка сообщения продавцам найденных объявлений через Avito Messenger API.
+
+Для каждого объявления заранее создаётся LogEntry со статусом pending и
+ключом идемпотентности (сообщение + объявление), поэтому повторный запуск
+рассылки не отправит одно сообщение дважды. Перед отправкой строка
+переводится в статус sending условным UPDATE: отправляет только тот процесс,
+который её захватил. Строки, оставшиеся в sending после сбоя, повторно
+не отправляются — их нужно проверить вручную.
+
+Отправка сообщения не идемпотентна, поэтому POST идёт через клиент без
+повторных попыток. Повторный запуск рассылки отправляет заново только строки
+failed — те, что точно не дошли (API отклонил запрос или соединение не
+установлено). После таймаута ответа, обрыва соединения или ответа 5xx
+сообщение могло быть доставлено: такие строки получают статус unknown
+и тоже проверяются вручную.
+
+Отправка идёт в несколько потоков с ограничением частоты на аккаунт
+(AVITO_MESSENGER_RATE_PER_MINUTE). Ограничение общее для всех процессов
+рассылки: через кэш Django, как темп запросов в bot.pacing, каждый процесс
+берёт долю частоты по числу активных процессов. Строки захватываются,
+отправляются и записываются небольшими пакетами (OUTCOME_CHUNK_SIZE),
+поэтому после сбоя процесса в sending остаётся не больше одного пакета.
+Messenger API пишет только в существующие чаты, поэтому чат по объявлению
+ищется заранее, а объявления без чата помечаются как пропущенные.
+"""
+import hashlib
+import logging
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+from django.core.cache import cache
+
+from .db_writer import write
+from .http_client import get_client
+from .models import LogEntry
+from .pacing import PROCESS_ID
+from .tokens import token_manager
+from . import utils
+
+logger = logging.getLogger(__name__)
+
+MESSENGER_ACCOUNT_ID = os.getenv('AVITO_ACCOUNT_ID')
+MESSENGER_RATE_PER_MINUTE = int(os.getenv('AVITO_MESSENGER_RATE_PER_MINUTE', '300'))
+MESSENGER_CONCURRENCY = int(os.getenv('AVITO_MESSENGER_CONCURRENCY', '4'))
+# Сколько объявлений передавать в одном запросе поиска чатов
+CHAT_LOOKUP_BATCH = 100
+OUTCOME_BATCH_SIZE = 500
+# Сколько строк захватывать и записывать за раз
+OUTCOME_CHUNK_SIZE = 20
+RATE_LIMIT_CACHE_KEY = 'avito_messenger_rate:{account_id}'
+RATE_LIMIT_SYNC_INTERVAL = 1.0
+# Процесс, не синхронизировавшийся дольше этого, не считается активным
+RATE_LIMIT_PROCESS_TTL = 30
+
+
+class MessengerError(Exception):
+    """Ошибка обращения к Messenger API."""
+
+
+class RateLimiter:
+    """Потокобезопасное ограничение частоты по алгоритму token bucket.
+
+    С shared_key частота делится между процессами, которые синхронизируются
+    через кэш Django под этим ключом; без него ограничение действует на процесс.
+    """
+
+    def __init__(self, rate_per_minute, burst=None, shared_key=None, owner=None):
+        self.total_rate = rate_per_minute / 60.0
+        self.rate = self.total_rate
+        self.capacity = burst or max(int(self.rate), 1)
+        self.tokens = float(self.capacity)
+        self.updated = time.monotonic()
+        self.shared_key = shared_key
+        self.owner = owner or PROCESS_ID
+        self.processes = 1
+        self.synced_at = None
+        self._lock = threading.Lock()
+
+    def sync(self):
+        """Отмечает процесс в кэше и пересчитывает его долю частоты по числу активных процессов."""
+        if self.shared_key is None:
+            return
+        with self._lock:
+            now = time.monotonic()
+            if self.synced_at is not None and now - self.synced_at < RATE_LIMIT_SYNC_INTERVAL:
+                return
+            self.synced_at = now
+        wall = time.time()
+        try:
+            processes = {owner: seen for owner, seen in (cache.get(self.shared_key) or {}).items()
+                         if wall - seen <= RATE_LIMIT_PROCESS_TTL}
+            processes[self.owner] = wall
+            cache.set(self.shared_key, processes, RATE_LIMIT_PROCESS_TTL * 10)
+        except Exception as e:
+            logger.error(f"Не удалось синхронизировать ограничение частоты {self.shared_key}: {e}")
+            return
+        with self._lock:
+            self.processes = len(processes)
+            self.rate = self.total_rate / self.processes
+            self.tokens = min(self.tokens, self.capacity / self.processes)
+
+    def acquire(self):
+        """Ждёт, пока не появится разрешение на очередной запрос."""
+        while True:
+            self.sync()
+            with self._lock:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                wait = (1 - self.tokens) / self.rate
+            time.sleep(wait)
+
+
+_rate_limiters = {}
+_rate_limiters_lock = threading.Lock()
+
+
+def get_rate_limiter(account_id):
+    """Ограничитель частоты для аккаунта, общий для потоков процесса и для процессов рассылки."""
+    with _rate_limiters_lock:
+        limiter = _rate_limiters.get(account_id)
+        if limiter is None:
+            limiter = RateLimiter(MESSENGER_RATE_PER_MINUTE,
+                                  shared_key=RATE_LIMIT_CACHE_KEY.format(account_id=account_id))
+            _rate_limiters[account_id] = limiter
+        return limiter
+
+
+def make_idempotency_key(message, ad):
+    """Ключ идемпотентности отправки сообщения по объявлению."""
+    target = ad.item_id or ad.url
+    return hashlib.sha256(f"{message.pk}:{target}".encode('utf-8')).hexdigest()
+
+
+def get_account_id(session, token):
+    """Идентификатор нашего аккаунта: из AVITO_ACCOUNT_ID или запросом /core/v1/accounts/self."""
+    if MESSENGER_ACCOUNT_ID:
+        return MESSENGER_ACCOUNT_ID
+    response = session.get(f"{utils.AVITO_API_BASE_URL}/core/v1/accounts/self",
+                           headers={'Authorization': f'Bearer {token}'}, timeout=60)
+    response.raise_for_status()
+    return str(response.json()['id'])
+
+
+def resolve_chats(session, token, account_id, item_ids):
+    """Возвращает словарь item_id -> chat_id для объявлений, по которым уже есть чат."""
+    chats = {}
+    item_ids = [item_id for item_id in item_ids if item_id]
+    for start in range(0, len(item_ids), CHAT_LOOKUP_BATCH):
+        batch = item_ids[start:start + CHAT_LOOKUP_BATCH]
+        response = session.get(
+            f"{utils.AVITO_API_BASE_URL}/messenger/v2/accounts/{account_id}/chats",
+            params={'item_ids': ','.join(batch), 'limit': CHAT_LOOKUP_BATCH},
+            headers={'Authorization': f'Bearer {token}'},
+            timeout=60,
+        )
+        response.raise_for_status()
+        for chat in response.json().get('chats', []):
+            item = (chat.get('context') or {}).get('value') or {}
+            if item.get('id') is not None:
+                chats[str(item['id'])] = chat['id']
+    return chats
+
+
+def send_message(session, token, account_id, chat_id, text):
+    """Отправляет текстовое сообщение в чат. Возвращает тело ответа API."""
+    response = session.post(
+        f"{utils.AVITO_API_BASE_URL}/messenger/v1/accounts/{account_id}/chats/{chat_id}/messages",
+        json={'message': {'text': text}, 'type': 'text'},
+        headers={'Authorization': f'Bearer {token}'},
+        timeout=60,
+    )
+    response.raise_for_status()
+    return response.text
+
+
+def outcome_status(error):
+    """Статус строки журнала после ошибки отправки: failed — точно не доставлено, unknown — неизвестно."""
+    if isinstance(error, requests.exceptions.HTTPError):
+        status = error.response.status_code if error.response is not None else None
+        return LogEntry.STATUS_UNKNOWN if status is None or status >= 500 else LogEntry.STATUS_FAILED
+    if isinstance(error, requests.exceptions.ConnectTimeout):
+        return LogEntry.STATUS_FAILED
+    if isinstance(error, (requests.exceptions.Timeout, requests.exceptions.ConnectionError)):
+        # Запрос мог уйти до обрыва: повторная отправка рискует продублировать сообщение
+        return LogEntry.STATUS_UNKNOWN
+    return LogEntry.STATUS_FAILED
+
+
+def _bulk_record(entries):
+    """Записывает итоги отправки пакетами."""
+    write(LogEntry.objects.bulk_update, entries, ['status', 'response'], batch_size=OUTCOME_BATCH_SIZE)
+
+
+def dispatch_message(message, ads):
+    """Отправляет message продавцам объявлений ads (AvitoAd). Возвращает счётчики по статусам."""
+    ads = list(ads)
+    keys = {make_idempotency_key(message, ad): ad for ad in ads}
+
+    # Строки журнала создаются заранее одним запросом; уже существующие ключи не дублируются
+    LogEntry.objects.bulk_create(
+        [
+            LogEntry(keyword_id=ad.keyword_id, message=message, item_id=ad.item_id or '',
+                     idempotency_key=key, status=LogEntry.STATUS_PENDING, response='')
+            for key, ad in keys.items()
+        ],
+        batch_size=OUTCOME_BATCH_SIZE,
+        ignore_conflicts=True,
+    )
+    entries = list(LogEntry.objects.filter(
+        idempotency_key__in=list(keys), status__in=[LogEntry.STATUS_PENDING, LogEntry.STATUS_FAILED],
+    ))
+    counts = {status: 0 for status, _ in LogEntry.STATUS_CHOICES}
+    if not entries:
+        logger.info(f"Сообщение #{message.pk}: отправлять некому")
+        return counts
+
+    token = token_manager.get_token()
+    if not token:
+        raise MessengerError("Нет действительного access_token для Messenger API")
+    session = get_client('avito_api')
+    account_id = get_account_id(session, token)
+    chats = resolve_chats(session, token, account_id, [entry.item_id for entry in entries])
+    limiter = get_rate_limiter(account_id)
+    send_session = get_client('avito_messenger', retry_post=False)
+
+    skipped = []
+    to_claim = []
+    for entry in entries:
+        if entry.item_id in chats:
+            to_claim.append(entry)
+        else:
+            entry.status, entry.response = LogEntry.STATUS_SKIPPED, 'Нет чата с продавцом по объявлению'
+            skipped.append(entry)
+    _bulk_record(skipped)
+    outcomes = list(skipped)
+
+    # Потоки только отправляют запросы; строки захватываются и итоги пишутся из текущего потока
+    def send(entry):
+        limiter.acquire()
+        try:
+            entry.response = send_message(send_session, token, account_id, chats[entry.item_id], message.content)
+            entry.status = LogEntry.STATUS_SENT
+        except Exception as e:
+            logger.error(f"Ошибка отправки сообщения #{message.pk} по объявлению {entry.item_id}: {e}")
+            entry.status, entry.response = outcome_status(e), str(e)
+        return entry
+
+    with ThreadPoolExecutor(max_workers=MESSENGER_CONCURRENCY) as executor:
+        for start in range(0, len(to_claim), OUTCOME_CHUNK_SIZE):
+            # Захватываем строки; те, что уже отправляет другой процесс, пропускаем
+            to_send = [
+                entry for entry in to_claim[start:start + OUTCOME_CHUNK_SIZE]
+                if LogEntry.objects.filter(
+                    pk=entry.pk, status__in=[LogEntry.STATUS_PENDING, LogEntry.STATUS_FAILED],
+                ).update(status=LogEntry.STATUS_SENDING)
+            ]
+            sent = list(executor.map(send, to_send))
+            _bulk_record(sent)
+            outcomes.extend(sent)
+
+    for entry in outcomes:
+        counts[entry.status] += 1
+    logger.info(f"Рассылка сообщения #{message.pk}: {counts}")
+    return counts
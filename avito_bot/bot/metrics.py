@@ -0,0 +1,331 @@
+"""Счётчики, гистограммы времени этапов обработки и текущие значения (gauge) в формате Prometheus.
+
+Каждый процесс (веб-воркер, run_search_workers, monitor) копит метрики в
+памяти и раз в METRICS_FLUSH_INTERVAL секунд сбрасывает их снимок в свой
+файл в каталоге settings.METRICS_DIR (BOT_METRICS_DIR, по умолчанию
+metrics/ рядом с manage.py). Представление /metrics складывает снимки
+всех процессов, так что значения не зависят от того, какой воркер ответил.
+
+Счётчики и гистограммы завершившихся процессов остаются в сумме, иначе она
+уменьшалась бы, а счётчик Prometheus не убывает. Снимки, не обновлявшиеся
+дольше METRICS_RETENTION, складываются в общий файл RETIRED_FILE и потом
+удаляются, поэтому число файлов не растёт с каждым перезапуском процесса.
+Значения gauge складываются только по живым процессам (снимок не старше
+GAUGE_FRESHNESS): каждый процесс сообщает свою долю.
+"""
+import atexit
+import json
+import logging
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+from django.conf import settings
+
+logger = logging.getLogger(__name__)
+
+METRICS_DIR = settings.METRICS_DIR
+METRICS_FLUSH_INTERVAL = 5
+METRICS_RETENTION = 24 * 60 * 60
+# Сумма снимков завершившихся процессов и имена уже сложенных в неё снимков
+RETIRED_FILE = 'retired.json'
+# Сложенные снимки удаляются, когда RETIRED_FILE старше этого, секунды: читатель, который
+# ещё видит прежний RETIRED_FILE, успевает прочитать их как обычные снимки
+RETIRED_GRACE = 60
+# Снимок старше этого считается снимком завершившегося процесса: его gauge не учитываются
+GAUGE_FRESHNESS = 3 * METRICS_FLUSH_INTERVAL
+
+# Границы корзин гистограмм, секунды
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+METRIC_HELP = {
+    'bot_token_acquire_seconds': ('histogram', 'Время получения access_token Avito API'),
+    'bot_http_requests_total': ('counter', 'HTTP-запросы к Avito по хосту и коду ответа'),
+    'bot_http_retries_total': ('counter', 'Повторные попытки HTTP-запросов к Avito'),
+    'bot_http_request_seconds': ('histogram', 'Время HTTP-запроса к Avito, включая повторы'),
+    'bot_parse_seconds': ('histogram', 'Время разбора страницы выдачи'),
+    'bot_persist_seconds': ('histogram', 'Время сохранения пакета объявлений'),
+    'bot_persist_rows_total': ('counter', 'Сохранённые объявления'),
+    'bot_template_render_seconds': ('histogram', 'Время отрисовки шаблона'),
+    'bot_request_seconds': ('histogram', 'Время обработки HTTP-запроса к боту'),
+    'bot_job_seconds': ('histogram', 'Время выполнения поискового задания'),
+    'bot_pacing_allowed_rate': ('gauge', 'Допустимая частота запросов к хосту, запросов в секунду'),
+    'bot_pacing_backoffs_total': ('counter', 'Снижения частоты запросов к хосту по причине (429, 403, captcha, 5xx, error, latency)'),
+    'bot_pacing_wait_seconds': ('histogram', 'Ожидание очереди запроса к хосту'),
+    'bot_plan_units_total': ('counter', 'Единицы загрузки планировщика: started, joined (идущая) и reused (недавняя)'),
+}
+
+
+def _label_key(labels):
+    return tuple(sorted((labels or {}).items()))
+
+
+class MetricsRegistry:
+    """Метрики одного процесса."""
+
+    def __init__(self, buckets=DEFAULT_BUCKETS):
+        self.buckets = tuple(buckets)
+        self._lock = threading.Lock()
+        self._counters = {}
+        self._histograms = {}
+        self._gauges = {}
+
+    def inc(self, name, labels=None, value=1):
+        key = (name, _label_key(labels))
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + value
+
+    def observe(self, name, value, labels=None):
+        key = (name, _label_key(labels))
+        with self._lock:
+            histogram = self._histograms.get(key)
+            if histogram is None:
+                histogram = self._histograms[key] = {'buckets': [0] * len(self.buckets), 'sum': 0.0, 'count': 0}
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    histogram['buckets'][i] += 1
+                    break
+            histogram['sum'] += value
+            histogram['count'] += 1
+
+    def set(self, name, value, labels=None):
+        key = (name, _label_key(labels))
+        with self._lock:
+            self._gauges[key] = value
+
+    @contextmanager
+    def timer(self, name, labels=None):
+        """Измеряет время блока и записывает его в гистограмму name."""
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, time.perf_counter() - started, labels)
+
+    def snapshot(self):
+        """Состояние в виде, пригодном для JSON."""
+        with self._lock:
+            return {
+                'buckets': list(self.buckets),
+                'counters': [[name, list(labels), value] for (name, labels), value in self._counters.items()],
+                'histograms': [
+                    [name, list(labels), {'buckets': list(h['buckets']), 'sum': h['sum'], 'count': h['count']}]
+                    for (name, labels), h in self._histograms.items()
+                ],
+                'gauges': [[name, list(labels), value] for (name, labels), value in self._gauges.items()],
+            }
+
+
+registry = MetricsRegistry()
+
+_started = int(time.time())
+# pid процесса, в котором запущен фоновый сброс; после fork поток нужно запустить заново
+_flusher_pid = None
+_flusher_lock = threading.Lock()
+
+
+def inc(name, labels=None, value=1):
+    start_flusher()
+    registry.inc(name, labels, value)
+
+
+def observe(name, value, labels=None):
+    start_flusher()
+    registry.observe(name, value, labels)
+
+
+def set_gauge(name, value, labels=None):
+    start_flusher()
+    registry.set(name, value, labels)
+
+
+def timer(name, labels=None):
+    start_flusher()
+    return registry.timer(name, labels)
+
+
+def _snapshot_path():
+    # Время запуска в имени файла: снимок процесса с тем же pid после перезапуска не перезапишет старый
+    return METRICS_DIR / f"{os.getpid()}-{_started}.json"
+
+
+def flush():
+    """Записывает снимок метрик процесса в его файл (атомарно)."""
+    try:
+        METRICS_DIR.mkdir(parents=True, exist_ok=True)
+        path = _snapshot_path()
+        tmp_path = path.with_suffix('.tmp')
+        tmp_path.write_text(json.dumps(registry.snapshot(), ensure_ascii=False), encoding='utf-8')
+        os.replace(tmp_path, path)
+    except OSError as e:
+        logger.error(f"Не удалось записать метрики: {e}")
+
+
+def _flush_loop():
+    while True:
+        time.sleep(METRICS_FLUSH_INTERVAL)
+        flush()
+
+
+def start_flusher():
+    """Запускает (однократно на процесс) фоновый сброс метрик на диск."""
+    global _flusher_pid
+    if _flusher_pid == os.getpid():
+        return
+    with _flusher_lock:
+        if _flusher_pid == os.getpid():
+            return
+        threading.Thread(target=_flush_loop, name='metrics-flush', daemon=True).start()
+        if _flusher_pid is None:
+            atexit.register(flush)
+        _flusher_pid = os.getpid()
+
+
+def _empty_snapshot():
+    return {'buckets': list(DEFAULT_BUCKETS), 'counters': [], 'histograms': [], 'gauges': []}
+
+
+def _read_snapshot(path):
+    """Снимок из файла или None, если файла нет, он повреждён или записан с другими границами корзин."""
+    try:
+        snapshot = json.loads(path.read_text(encoding='utf-8'))
+    except (OSError, ValueError):
+        return None
+    if tuple(snapshot['buckets']) != tuple(DEFAULT_BUCKETS):
+        # Снимок процесса со старыми границами корзин сложить нельзя
+        return None
+    return snapshot
+
+
+def _add(counters, histograms, snapshot):
+    """Прибавляет счётчики и гистограммы снимка к суммам."""
+    for name, labels, value in snapshot['counters']:
+        key = (name, tuple(tuple(pair) for pair in labels))
+        counters[key] = counters.get(key, 0) + value
+    for name, labels, h in snapshot['histograms']:
+        key = (name, tuple(tuple(pair) for pair in labels))
+        total = histograms.setdefault(key, {'buckets': [0] * len(DEFAULT_BUCKETS), 'sum': 0.0, 'count': 0})
+        total['buckets'] = [a + b for a, b in zip(total['buckets'], h['buckets'])]
+        total['sum'] += h['sum']
+        total['count'] += h['count']
+
+
+def compact():
+    """Складывает снимки завершившихся процессов (старше METRICS_RETENTION) в RETIRED_FILE.
+
+    Сложенный снимок удаляется только при следующем сжатии, не раньше RETIRED_GRACE: до тех пор
+    читатели нового RETIRED_FILE пропускают его по имени, а читатели прежнего — складывают сами.
+    Одновременные сжатия в разных процессах дают одинаковый результат.
+    """
+    retired_path = METRICS_DIR / RETIRED_FILE
+    retired = _read_snapshot(retired_path) or _empty_snapshot()
+    merged = set(retired.get('merged', []))
+    now = time.time()
+    try:
+        retired_age = now - retired_path.stat().st_mtime
+    except OSError:
+        retired_age = None
+    if merged and retired_age is not None and retired_age > RETIRED_GRACE:
+        for name in merged:
+            (METRICS_DIR / name).unlink(missing_ok=True)
+        merged = set()
+
+    stale = []
+    for path in METRICS_DIR.glob('*.json'):
+        if path.name == RETIRED_FILE or path.name in merged:
+            continue
+        try:
+            if now - path.stat().st_mtime > METRICS_RETENTION:
+                stale.append(path)
+        except OSError:
+            continue
+    if not stale:
+        return
+
+    counters, histograms = {}, {}
+    _add(counters, histograms, retired)
+    for path in stale:
+        snapshot = _read_snapshot(path)
+        if snapshot is not None:
+            _add(counters, histograms, snapshot)
+    retired = {
+        'buckets': list(DEFAULT_BUCKETS),
+        'counters': [[name, list(labels), value] for (name, labels), value in counters.items()],
+        'histograms': [[name, list(labels), h] for (name, labels), h in histograms.items()],
+        'gauges': [],
+        'merged': sorted(merged | {path.name for path in stale}),
+    }
+    try:
+        tmp_path = retired_path.with_suffix(f'.{os.getpid()}.tmp')
+        tmp_path.write_text(json.dumps(retired, ensure_ascii=False), encoding='utf-8')
+        os.replace(tmp_path, retired_path)
+    except OSError as e:
+        logger.error(f"Не удалось сохранить метрики завершившихся процессов: {e}")
+
+
+def collect():
+    """Складывает снимки всех процессов. Возвращает (buckets, counters, histograms, gauges)."""
+    flush()
+    compact()
+    counters, histograms, gauges = {}, {}, {}
+    # Сначала сумма завершившихся процессов: снимки, уже сложенные в неё, пропускаются
+    retired = _read_snapshot(METRICS_DIR / RETIRED_FILE) or _empty_snapshot()
+    _add(counters, histograms, retired)
+    skipped = set(retired.get('merged', [])) | {RETIRED_FILE}
+    now = time.time()
+    for path in METRICS_DIR.glob('*.json'):
+        if path.name in skipped:
+            continue
+        try:
+            age = now - path.stat().st_mtime
+        except OSError:
+            continue
+        snapshot = _read_snapshot(path)
+        if snapshot is None:
+            continue
+        _add(counters, histograms, snapshot)
+        for name, labels, value in snapshot.get('gauges', []) if age <= GAUGE_FRESHNESS else ():
+            key = (name, tuple(tuple(pair) for pair in labels))
+            gauges[key] = gauges.get(key, 0) + value
+    return DEFAULT_BUCKETS, counters, histograms, gauges
+
+
+def _format_labels(labels, extra=()):
+    pairs = list(labels) + list(extra)
+    if not pairs:
+        return ''
+    escaped = (str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n') for _, value in pairs)
+    return '{' + ','.join(f'{name}="{value}"' for (name, _), value in zip(pairs, escaped)) + '}'
+
+
+def render_prometheus():
+    """Текст метрик всех процессов в формате Prometheus (text exposition 0.0.4)."""
+    buckets, counters, histograms, gauges = collect()
+    lines = []
+    described = set()
+
+    def describe(name, kind):
+        if name in described:
+            return
+        described.add(name)
+        help_text = METRIC_HELP.get(name, (kind, name))[1]
+        lines.append(f"# HELP {name} {help_text}")
+        lines.append(f"# TYPE {name} {kind}")
+
+    for (name, labels), value in sorted(counters.items()):
+        describe(name, 'counter')
+        lines.append(f"{name}{_format_labels(labels)} {value}")
+    for (name, labels), value in sorted(gauges.items()):
+        describe(name, 'gauge')
+        lines.append(f"{name}{_format_labels(labels)} {value}")
+    for (name, labels), h in sorted(histograms.items()):
+        describe(name, 'histogram')
+        cumulative = 0
+        for bound, count in zip(buckets, h['buckets']):
+            cumulative += count
+            lines.append(f"{name}_bucket{_format_labels(labels, [('le', bound)])} {cumulative}")
+        lines.append(f"{name}_bucket{_format_labels(labels, [('le', '+Inf')])} {h['count']}")
+        lines.append(f"{name}_sum{_format_labels(labels)} {h['sum']}")
+        lines.append(f"{name}_count{_format_labels(labels)} {h['count']}")
+    return '\n'.join(lines) + '\n'
@@ -0,0 +1,23 @@
+import time
+
+from . import metrics
+from .profiling import profiled
+
+
+class MetricsMiddleware:
+    """Записывает время обработки запросов в метрики и профилирует медленные запросы (BOT_PROFILE=1)."""
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        started = time.perf_counter()
+        with profiled(f"request {request.method} {request.path}"):
+            response = self.get_response(request)
+        match = request.resolver_match
+        metrics.observe('bot_request_seconds', time.perf_counter() - started, {
+            'view': match.url_name if match and match.url_name else 'unknown',
+            'method': request.method,
+            'status': str(response.status_code),
+        })
+        return response
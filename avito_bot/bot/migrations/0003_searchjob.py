@@ -0,0 +1,41 @@
+# Generated by Django 5.1 on 2026-10-18 06:25
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('bot', '0002_avitoad'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SearchJob',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('keywords', models.JSONField(default=list)),
+                ('parse_method', models.CharField(default='scrape', max_length=10)),
+                ('max_ads', models.PositiveIntegerField(default=10)),
+                ('status', models.CharField(choices=[('pending', 'В очереди'), ('running', 'Выполняется'), ('done', 'Завершено'), ('failed', 'Ошибка')], default='pending', max_length=10)),
+                ('pages_done', models.PositiveIntegerField(default=0)),
+                ('ads_found', models.PositiveIntegerField(default=0)),
+                ('error', models.TextField(blank=True)),
+                ('attempts', models.PositiveSmallIntegerField(default=0)),
+                ('lease_owner', models.CharField(blank=True, max_length=64)),
+                ('lease_expires_at', models.DateTimeField(blank=True, null=True)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('started_at', models.DateTimeField(blank=True, null=True)),
+                ('finished_at', models.DateTimeField(blank=True, null=True)),
+            ],
+            options={
+                'indexes': [models.Index(fields=['status', 'created_at'], name='bot_searchj_status_35a71f_idx')],
+            },
+        ),
+        migrations.AddField(
+            model_name='avitoad',
+            name='job',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='ads', to='bot.searchjob'),
+        ),
+    ]
@@ -0,0 +1,26 @@
+# Generated by Django 5.1 on 2026-10-18 06:27
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('bot', '0003_searchjob'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SeenItem',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('query', models.CharField(max_length=255)),
+                ('location', models.CharField(max_length=100)),
+                ('item_id', models.CharField(max_length=32)),
+                ('first_seen_at', models.DateTimeField(auto_now_add=True)),
+            ],
+            options={
+                'constraints': [models.UniqueConstraint(fields=('query', 'location', 'item_id'), name='unique_seen_item')],
+            },
+        ),
+    ]
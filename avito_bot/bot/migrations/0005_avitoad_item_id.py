@@ -0,0 +1,35 @@
+# Generated by Django 5.1 on 2026-10-18 06:28
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('bot', '0004_seenitem'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='avitoad',
+            name='item_id',
+            field=models.CharField(blank=True, max_length=32, null=True),
+        ),
+        migrations.AlterField(
+            model_name='avitoad',
+            name='price',
+            field=models.DecimalField(blank=True, decimal_places=2, max_digits=14, null=True),
+        ),
+        migrations.AddIndex(
+            model_name='avitoad',
+            index=models.Index(fields=['keyword', 'created_at'], name='bot_avitoad_keyword_c700b9_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='avitoad',
+            index=models.Index(fields=['price'], name='bot_avitoad_price_fd3ada_idx'),
+        ),
+        migrations.AddConstraint(
+            model_name='avitoad',
+            constraint=models.UniqueConstraint(fields=('keyword', 'item_id'), name='unique_keyword_item'),
+        ),
+    ]
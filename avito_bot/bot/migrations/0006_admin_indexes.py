@@ -0,0 +1,25 @@
+# Generated by Django 5.1 on 2026-10-18 06:32
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('bot', '0005_avitoad_item_id'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='avitoad',
+            index=models.Index(fields=['created_at'], name='bot_avitoad_created_ea20d2_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='logentry',
+            index=models.Index(fields=['created_at'], name='bot_logentr_created_750233_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='logentry',
+            index=models.Index(fields=['keyword', 'created_at'], name='bot_logentr_keyword_442628_idx'),
+        ),
+    ]
@@ -0,0 +1,24 @@
+# Полнотекстовые индексы FTS5 для AvitoAd и LogEntry, поддерживаемые триггерами (см. bot.fts).
+
+from django.db import migrations
+
+from bot import fts
+
+
+def create_indexes(apps, schema_editor):
+    fts.create_indexes(schema_editor)
+
+
+def drop_indexes(apps, schema_editor):
+    fts.drop_indexes(schema_editor)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('bot', '0006_admin_indexes'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_indexes, drop_indexes),
+    ]
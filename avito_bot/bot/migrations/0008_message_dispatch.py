@@ -0,0 +1,43 @@
+# Generated by Django 5.1 on 2026-10-18 06:35
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+from bot import fts
+
+
+def restore_fulltext_triggers(apps, schema_editor):
+    # AddField пересоздаёт bot_logentry (см. bot.fts)
+    fts.restore_triggers(schema_editor, [fts.LOG_INDEX])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('bot', '0007_fulltext_search'),
+    ]
+
+    operations = [
+        migrations.RunPython(migrations.RunPython.noop, restore_fulltext_triggers),
+        migrations.AddField(
+            model_name='logentry',
+            name='idempotency_key',
+            field=models.CharField(blank=True, max_length=64, null=True, unique=True),
+        ),
+        migrations.AddField(
+            model_name='logentry',
+            name='item_id',
+            field=models.CharField(blank=True, max_length=32),
+        ),
+        migrations.AddField(
+            model_name='logentry',
+            name='status',
+            field=models.CharField(choices=[('pending', 'Ожидает отправки'), ('sending', 'Отправляется'), ('sent', 'Отправлено'), ('failed', 'Ошибка'), ('skipped', 'Пропущено')], default='pending', max_length=10),
+        ),
+        migrations.AddField(
+            model_name='searchjob',
+            name='message',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='jobs', to='bot.message'),
+        ),
+        migrations.RunPython(restore_fulltext_triggers, migrations.RunPython.noop),
+    ]
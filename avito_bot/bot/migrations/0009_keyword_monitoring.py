@@ -0,0 +1,42 @@
+# Generated by Django 5.1 on 2026-10-18 06:39
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('bot', '0008_message_dispatch'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='keyword',
+            name='crawl_interval',
+            field=models.PositiveIntegerField(default=3600, help_text='Интервал обхода, секунды'),
+        ),
+        migrations.AddField(
+            model_name='keyword',
+            name='is_active',
+            field=models.BooleanField(default=True),
+        ),
+        migrations.AddField(
+            model_name='keyword',
+            name='last_run_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='keyword',
+            name='new_ads_rate',
+            field=models.FloatField(default=0),
+        ),
+        migrations.AddField(
+            model_name='keyword',
+            name='next_run_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AddIndex(
+            model_name='keyword',
+            index=models.Index(fields=['is_active', 'next_run_at'], name='bot_keyword_is_acti_1bbfd6_idx'),
+        ),
+    ]
@@ -0,0 +1,49 @@
+# Generated by Django 5.1 on 2026-10-18 06:51
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+from bot import fts
+
+
+def restore_fulltext_triggers(apps, schema_editor):
+    # AddField пересоздаёт bot_avitoad (см. bot.fts); триггеры bot_logentry пересоздаются
+    # для баз, мигрированных прежней версией 0008, которая их не восстанавливала
+    fts.restore_triggers(schema_editor, [fts.AD_INDEX, fts.LOG_INDEX])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('bot', '0009_keyword_monitoring'),
+    ]
+
+    operations = [
+        migrations.RunPython(migrations.RunPython.noop, restore_fulltext_triggers),
+        migrations.AddField(
+            model_name='avitoad',
+            name='price_period',
+            field=models.CharField(blank=True, default='', max_length=8),
+        ),
+        migrations.CreateModel(
+            name='PriceRollup',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('day', models.DateField()),
+                ('region', models.CharField(max_length=100)),
+                ('price_period', models.CharField(blank=True, default='', max_length=8)),
+                ('count', models.PositiveIntegerField(default=0)),
+                ('min_price', models.DecimalField(decimal_places=2, max_digits=14)),
+                ('median_price', models.DecimalField(decimal_places=2, max_digits=14)),
+                ('p90_price', models.DecimalField(decimal_places=2, max_digits=14)),
+                ('mean_price', models.DecimalField(decimal_places=2, max_digits=14)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('keyword', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='price_rollups', to='bot.keyword')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['day'], name='bot_pricero_day_638828_idx')],
+                'constraints': [models.UniqueConstraint(fields=('keyword', 'day', 'region', 'price_period'), name='unique_price_rollup')],
+            },
+        ),
+        migrations.RunPython(restore_fulltext_triggers, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,45 @@
+# Generated by Django 5.1 on 2026-10-18 06:55
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('bot', '0010_price_rollups'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='AdBucket',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('key', models.BigIntegerField()),
+                ('cluster_id', models.BigIntegerField()),
+            ],
+        ),
+        migrations.AddField(
+            model_name='avitoad',
+            name='cluster_id',
+            field=models.BigIntegerField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='avitoad',
+            name='minhash',
+            field=models.BinaryField(blank=True, null=True),
+        ),
+        migrations.AddIndex(
+            model_name='avitoad',
+            index=models.Index(fields=['cluster_id'], name='bot_avitoad_cluster_bfcc2b_idx'),
+        ),
+        migrations.AddField(
+            model_name='adbucket',
+            name='ad',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='lsh_buckets', to='bot.avitoad'),
+        ),
+        migrations.AddIndex(
+            model_name='adbucket',
+            index=models.Index(fields=['key', 'cluster_id', 'ad'], name='bot_adbucke_key_9b51c3_idx'),
+        ),
+    ]
@@ -0,0 +1,46 @@
+# Generated by Django 5.1 on 2026-10-18 07:13
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('bot', '0011_dedup_clusters'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='avitoad',
+            name='address',
+            field=models.CharField(blank=True, max_length=255, null=True),
+        ),
+        migrations.AddField(
+            model_name='avitoad',
+            name='enriched_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='avitoad',
+            name='published_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='avitoad',
+            name='seller_id',
+            field=models.CharField(blank=True, max_length=64, null=True),
+        ),
+        migrations.AddField(
+            model_name='avitoad',
+            name='seller_name',
+            field=models.CharField(blank=True, max_length=255, null=True),
+        ),
+        migrations.AddIndex(
+            model_name='avitoad',
+            index=models.Index(fields=['enriched_at'], name='bot_avitoad_enriche_524267_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='avitoad',
+            index=models.Index(fields=['seller_id'], name='bot_avitoad_seller__0df472_idx'),
+        ),
+    ]
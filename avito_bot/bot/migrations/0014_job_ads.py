@@ -0,0 +1,62 @@
+# Generated by Django 5.1 on 2026-10-18 07:27
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+from bot import fts
+
+
+def copy_job_links(apps, schema_editor):
+    """Переносит AvitoAd.job в связи JobAd в порядке id объявлений."""
+    AvitoAd = apps.get_model('bot', 'AvitoAd')
+    JobAd = apps.get_model('bot', 'JobAd')
+    links = AvitoAd.objects.filter(job__isnull=False).order_by('pk').values_list('job_id', 'pk')
+    JobAd.objects.bulk_create([JobAd(job_id=job_id, ad_id=ad_id) for job_id, ad_id in links.iterator()],
+                              batch_size=500)
+
+
+def copy_job_links_back(apps, schema_editor):
+    AvitoAd = apps.get_model('bot', 'AvitoAd')
+    JobAd = apps.get_model('bot', 'JobAd')
+    # Из нескольких заданий объявления обратно переносится последнее
+    for job_id, ad_id in JobAd.objects.order_by('pk').values_list('job_id', 'ad_id').iterator():
+        AvitoAd.objects.filter(pk=ad_id).update(job_id=job_id)
+
+
+def restore_fulltext_triggers(apps, schema_editor):
+    # RemoveField и AddField пересоздают bot_avitoad (см. bot.fts)
+    fts.restore_triggers(schema_editor, [fts.AD_INDEX])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('bot', '0013_lease'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='JobAd',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('ad', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='job_links', to='bot.avitoad')),
+                ('job', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='ad_links', to='bot.searchjob')),
+            ],
+        ),
+        migrations.AddConstraint(
+            model_name='jobad',
+            constraint=models.UniqueConstraint(fields=('job', 'ad'), name='unique_job_ad'),
+        ),
+        migrations.RunPython(copy_job_links, copy_job_links_back),
+        migrations.RunPython(migrations.RunPython.noop, restore_fulltext_triggers),
+        migrations.RemoveField(
+            model_name='avitoad',
+            name='job',
+        ),
+        migrations.AddField(
+            model_name='avitoad',
+            name='jobs',
+            field=models.ManyToManyField(blank=True, related_name='ads', through='bot.JobAd', to='bot.searchjob'),
+        ),
+        migrations.RunPython(restore_fulltext_triggers, migrations.RunPython.noop),
+    ]
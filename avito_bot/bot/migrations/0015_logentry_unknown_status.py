@@ -0,0 +1,18 @@
+# Generated by Django 5.1 on 2026-10-18 07:34
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('bot', '0014_job_ads'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='logentry',
+            name='status',
+            field=models.CharField(choices=[('pending', 'Ожидает отправки'), ('sending', 'Отправляется'), ('sent', 'Отправлено'), ('failed', 'Ошибка'), ('skipped', 'Пропущено'), ('unknown', 'Неизвестно')], default='pending', max_length=10),
+        ),
+    ]
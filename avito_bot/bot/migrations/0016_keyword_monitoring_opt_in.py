@@ -0,0 +1,26 @@
+# Generated by Django 5.1 on 2026-10-18 07:36
+
+from django.db import migrations, models
+
+
+def disable_monitoring(apps, schema_editor):
+    """Мониторинг включается вручную: ключевые слова, созданные поиском до 0016, получили is_active=True
+    только из значения по умолчанию в 0009 и обходиться не должны."""
+    Keyword = apps.get_model('bot', 'Keyword')
+    Keyword.objects.filter(is_active=True).update(is_active=False)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('bot', '0015_logentry_unknown_status'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='keyword',
+            name='is_active',
+            field=models.BooleanField(default=False),
+        ),
+        migrations.RunPython(disable_monitoring, migrations.RunPython.noop),
+    ]
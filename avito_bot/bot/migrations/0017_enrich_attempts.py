@@ -0,0 +1,32 @@
+# Generated by Django 5.1 on 2026-10-18 07:49
+
+from django.db import migrations, models
+
+from bot import fts
+
+
+def restore_fulltext_triggers(apps, schema_editor):
+    # AddField со значением по умолчанию пересоздаёт bot_avitoad (см. bot.fts)
+    fts.restore_triggers(schema_editor, [fts.AD_INDEX])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('bot', '0016_keyword_monitoring_opt_in'),
+    ]
+
+    operations = [
+        migrations.RunPython(migrations.RunPython.noop, restore_fulltext_triggers),
+        migrations.AddField(
+            model_name='avitoad',
+            name='enrich_attempts',
+            field=models.PositiveSmallIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='avitoad',
+            name='enrich_retry_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.RunPython(restore_fulltext_triggers, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,57 @@
+# Generated by Django 5.1 on 2026-10-18 08:09
+
+from django.db import migrations, models
+from django.db.models import Count
+
+
+def merge_duplicate_keywords(apps, schema_editor):
+    """Объединяет ключевые слова с одинаковым word, созданные параллельными поисками.
+
+    Остаётся слово с включённым мониторингом, иначе самое старое. Объявления
+    и журнал рассылки переходят к нему; объявление, которое у него уже есть
+    (тот же item_id), удаляется, а его связи с заданиями переходят на оставшееся.
+    Сводки цен удалённых слов удаляются — пересчитайте их командой
+    rebuild_price_rollups.
+    """
+    Keyword = apps.get_model('bot', 'Keyword')
+    AvitoAd = apps.get_model('bot', 'AvitoAd')
+    JobAd = apps.get_model('bot', 'JobAd')
+    LogEntry = apps.get_model('bot', 'LogEntry')
+
+    duplicated = (Keyword.objects.values('word').annotate(count=Count('pk')).filter(count__gt=1)
+                  .values_list('word', flat=True))
+    for word in list(duplicated):
+        keep, *others = Keyword.objects.filter(word=word).order_by('-is_active', 'pk')
+        other_ids = [keyword.pk for keyword in others]
+
+        kept_items = dict(AvitoAd.objects.filter(keyword=keep, item_id__isnull=False).values_list('item_id', 'pk'))
+        ads = AvitoAd.objects.filter(keyword_id__in=other_ids).order_by('pk').values_list('pk', 'item_id')
+        for ad_id, item_id in list(ads):
+            target_id = kept_items.get(item_id) if item_id is not None else None
+            if target_id is None:
+                AvitoAd.objects.filter(pk=ad_id).update(keyword=keep)
+                if item_id is not None:
+                    kept_items[item_id] = ad_id
+                continue
+            linked_jobs = JobAd.objects.filter(ad_id=target_id).values_list('job_id', flat=True)
+            JobAd.objects.filter(ad_id=ad_id).exclude(job_id__in=list(linked_jobs)).update(ad_id=target_id)
+            AvitoAd.objects.filter(pk=ad_id).delete()
+
+        LogEntry.objects.filter(keyword_id__in=other_ids).update(keyword=keep)
+        Keyword.objects.filter(pk__in=other_ids).delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('bot', '0017_enrich_attempts'),
+    ]
+
+    operations = [
+        migrations.RunPython(merge_duplicate_keywords, migrations.RunPython.noop),
+        migrations.AlterField(
+            model_name='keyword',
+            name='word',
+            field=models.CharField(max_length=100, unique=True),
+        ),
+    ]
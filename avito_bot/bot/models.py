@@ -1,8 +1,21 @@
 from django.db import models
 
 class Keyword(models.Model):
-    word = models.CharField(max_length=100)
+    word = models.CharField(max_length=100, unique=True)
     created_at = models.DateTimeField(auto_now_add=True)
+    # Расписание фонового мониторинга (manage.py monitor)
+    # Мониторинг включается явно: ключевые слова создаются и при обычном поиске
+    is_active = models.BooleanField(default=False)
+    crawl_interval = models.PositiveIntegerField(default=3600, help_text='Интервал обхода, секунды')
+    next_run_at = models.DateTimeField(null=True, blank=True)
+    last_run_at = models.DateTimeField(null=True, blank=True)
+    # Сглаженная (EWMA) частота появления новых объявлений, штук в час
+    new_ads_rate = models.FloatField(default=0)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['is_active', 'next_run_at']),
+        ]
 
     def __str__(self):
         return self.word
@@ -16,23 +29,195 @@ class Message(models.Model):
         return self.content
 
 
+class SearchJob(models.Model):
+    STATUS_PENDING = 'pending'
+    STATUS_RUNNING = 'running'
+    STATUS_DONE = 'done'
+    STATUS_FAILED = 'failed'
+    STATUS_CHOICES = [
+        (STATUS_PENDING, 'В очереди'),
+        (STATUS_RUNNING, 'Выполняется'),
+        (STATUS_DONE, 'Завершено'),
+        (STATUS_FAILED, 'Ошибка'),
+    ]
+
+    keywords = models.JSONField(default=list)
+    parse_method = models.CharField(max_length=10, default='scrape')
+    max_ads = models.PositiveIntegerField(default=10)
+    message = models.ForeignKey(Message, on_delete=models.SET_NULL, null=True, blank=True, related_name='jobs')
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default=STATUS_PENDING)
+    pages_done = models.PositiveIntegerField(default=0)
+    ads_found = models.PositiveIntegerField(default=0)
+    error = models.TextField(blank=True)
+    attempts = models.PositiveSmallIntegerField(default=0)
+    lease_owner = models.CharField(max_length=64, blank=True)
+    lease_expires_at = models.DateTimeField(null=True, blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    started_at = models.DateTimeField(null=True, blank=True)
+    finished_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['status', 'created_at']),
+        ]
+
+    def __str__(self):
+        return f"SearchJob #{self.pk} ({self.status})"
+
+
+class Lease(models.Model):
+    """Именованная межпроцессная блокировка с истечением срока (см. bot.leases)."""
+    name = models.CharField(max_length=64, primary_key=True)
+    owner = models.CharField(max_length=64, blank=True)
+    expires_at = models.DateTimeField(null=True, blank=True)
+
+    def __str__(self):
+        return f"{self.name} ({self.owner or 'свободна'})"
+
+
 class AvitoAd(models.Model):
     keyword = models.ForeignKey(Keyword, on_delete=models.CASCADE, related_name='ads')
+    # Задания, нашедшие объявление: повторно найденное объявление остаётся в результатах прежних заданий
+    jobs = models.ManyToManyField(SearchJob, through='JobAd', related_name='ads', blank=True)
+    item_id = models.CharField(max_length=32, null=True, blank=True)
     title = models.CharField(max_length=255)
     description = models.TextField()
     url = models.URLField()
-    price = models.DecimalField(max_digits=10, decimal_places=2, null=True, blank=True)
+    price = models.DecimalField(max_digits=14, decimal_places=2, null=True, blank=True)
+    # Период цены: '' — за весь объект, 'month' — аренда в месяц, 'sqm' — за м² (см. bot.analytics)
+    price_period = models.CharField(max_length=8, blank=True, default='')
+    # Кластер почти одинаковых объявлений: pk первого объявления кластера (см. bot.dedup)
+    cluster_id = models.BigIntegerField(null=True, blank=True)
+    # MinHash-подпись заголовка и описания: NUM_PERM чисел uint32
+    minhash = models.BinaryField(null=True, blank=True)
+    # Поля со страницы объявления, их заполняет bot.enrich; enriched_at пуст, пока страница не загружена
+    seller_id = models.CharField(max_length=64, null=True, blank=True)
+    seller_name = models.CharField(max_length=255, null=True, blank=True)
+    address = models.CharField(max_length=255, null=True, blank=True)
+    published_at = models.DateTimeField(null=True, blank=True)
+    enriched_at = models.DateTimeField(null=True, blank=True)
+    # Неудачные загрузки страницы и время следующей попытки; после последней попытки оно пусто
+    enrich_attempts = models.PositiveSmallIntegerField(default=0)
+    enrich_retry_at = models.DateTimeField(null=True, blank=True)
     created_at = models.DateTimeField(auto_now_add=True)
 
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['keyword', 'item_id'], name='unique_keyword_item'),
+        ]
+        indexes = [
+            models.Index(fields=['keyword', 'created_at']),
+            models.Index(fields=['price']),
+            models.Index(fields=['created_at']),
+            models.Index(fields=['cluster_id']),
+            models.Index(fields=['enriched_at']),
+            models.Index(fields=['seller_id']),
+        ]
+
     def __str__(self):
         return self.title
 
 
+class JobAd(models.Model):
+    """Связь задания с найденным объявлением; id растёт в порядке нахождения (курсор потока событий)."""
+    job = models.ForeignKey(SearchJob, on_delete=models.CASCADE, related_name='ad_links')
+    ad = models.ForeignKey(AvitoAd, on_delete=models.CASCADE, related_name='job_links')
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['job', 'ad'], name='unique_job_ad'),
+        ]
+
+
+class AdBucket(models.Model):
+    """Корзина LSH-индекса: хэш полосы MinHash-подписи и кластер, в котором он встречается.
+
+    На пару (key, cluster_id) хранится одна строка — с объявлением, чья подпись
+    сравнивается с кандидатами, поэтому размер корзины не растёт с числом копий.
+    """
+    key = models.BigIntegerField()
+    cluster_id = models.BigIntegerField()
+    ad = models.ForeignKey(AvitoAd, on_delete=models.CASCADE, related_name='lsh_buckets')
+
+    class Meta:
+        indexes = [
+            # Покрывающий индекс: поиск кандидатов не читает саму таблицу
+            models.Index(fields=['key', 'cluster_id', 'ad']),
+        ]
+
+
+class PriceRollup(models.Model):
+    """Сводка цен объявлений по ключевому слову за день в регионе (обновляется при сохранении объявлений)."""
+    keyword = models.ForeignKey(Keyword, on_delete=models.CASCADE, related_name='price_rollups')
+    day = models.DateField()
+    region = models.CharField(max_length=100)
+    price_period = models.CharField(max_length=8, blank=True, default='')
+    count = models.PositiveIntegerField(default=0)
+    min_price = models.DecimalField(max_digits=14, decimal_places=2)
+    median_price = models.DecimalField(max_digits=14, decimal_places=2)
+    p90_price = models.DecimalField(max_digits=14, decimal_places=2)
+    mean_price = models.DecimalField(max_digits=14, decimal_places=2)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['keyword', 'day', 'region', 'price_period'], name='unique_price_rollup'),
+        ]
+        indexes = [
+            models.Index(fields=['day']),
+        ]
+
+    def __str__(self):
+        return f"{self.keyword} {self.day} {self.region}"
+
+
+class SeenItem(models.Model):
+    """Объявление, уже встречавшееся в выдаче по запросу и региону (для инкрементального обхода)."""
+    query = models.CharField(max_length=255)
+    location = models.CharField(max_length=100)
+    item_id = models.CharField(max_length=32)
+    first_seen_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['query', 'location', 'item_id'], name='unique_seen_item'),
+        ]
+
+    def __str__(self):
+        return f"{self.item_id} ({self.query}, {self.location})"
+
+
 class LogEntry(models.Model):
+    STATUS_PENDING = 'pending'
+    STATUS_SENDING = 'sending'
+    STATUS_SENT = 'sent'
+    STATUS_FAILED = 'failed'
+    STATUS_SKIPPED = 'skipped'
+    # Ответа не получено (таймаут, обрыв, 5xx): сообщение могло дойти, повторно не отправляется
+    STATUS_UNKNOWN = 'unknown'
+    STATUS_CHOICES = [
+        (STATUS_PENDING, 'Ожидает отправки'),
+        (STATUS_SENDING, 'Отправляется'),
+        (STATUS_SENT, 'Отправлено'),
+        (STATUS_FAILED, 'Ошибка'),
+        (STATUS_SKIPPED, 'Пропущено'),
+        (STATUS_UNKNOWN, 'Неизвестно'),
+    ]
+
     keyword = models.ForeignKey(Keyword, on_delete=models.CASCADE)
     message = models.ForeignKey(Message, on_delete=models.CASCADE)
+    item_id = models.CharField(max_length=32, blank=True)
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default=STATUS_PENDING)
+    # Ключ идемпотентности: одно сообщение отправляется по объявлению не более одного раза
+    idempotency_key = models.CharField(max_length=64, unique=True, null=True, blank=True)
     response = models.TextField()
     created_at = models.DateTimeField(auto_now_add=True)
 
+    class Meta:
+        indexes = [
+            models.Index(fields=['created_at']),
+            models.Index(fields=['keyword', 'created_at']),
+        ]
+
     def __str__(self):
         return f"LogEntry for {self.keyword.word} on {self.created_at}"
@@ -0,0 +1,178 @@
+"""Фоновый мониторинг ключевых слов по расписанию.
+
+Каждое активное ключевое слово (Keyword.is_active) обходится инкрементально:
+сохраняются только новые объявления, обход останавливается на первой
+странице без новых. Интервал обхода подстраивается под частоту новых
+объявлений (EWMA): по «горячим» словам — чаще, по тихим — реже, в пределах
+MONITOR_MIN_INTERVAL..MONITOR_MAX_INTERVAL.
+
+Время следующего запуска хранится в Keyword.next_run_at, поэтому после
+перезапуска обходятся только действительно просроченные слова, и они
+распределяются по окну MONITOR_STARTUP_SPREAD, а не запускаются разом.
+Число загружаемых страниц ограничено MONITOR_PAGES_PER_MINUTE: разрешение
+берётся до постановки страницы в очередь загрузки. Этот бюджет свой у каждого
+процесса мониторинга: при N процессах страниц загружается до
+N × MONITOR_PAGES_PER_MINUTE, поэтому задавайте его в расчёте на процесс.
+Общий для всех процессов темп запросов к Avito держит bot.pacing.
+
+Страницы мониторинга всегда загружаются из сети, мимо кэша ответов: иначе
+по «горячему» слову, обходимому чаще HTTP_CACHE_TTL, возвращалась бы
+прежняя первая страница, новых объявлений не находилось бы, и интервал
+обхода рос бы именно у самых активных слов.
+
+Мониторинг включается для слова явно (Keyword.is_active): слова, созданные
+поиском, по умолчанию не обходятся.
+"""
+import logging
+import os
+import random
+from datetime import timedelta
+
+from django.db.models import Min, Q
+from django.utils import timezone
+
+from .ingest import ingest_ads
+from .messenger import RateLimiter
+from .models import Keyword
+from .seen import seen_items
+from .utils import scrape_avito_listings
+
+logger = logging.getLogger(__name__)
+
+MONITOR_LOCATION = os.getenv('AVITO_MONITOR_LOCATION', 'rossiya')
+# Бюджет страниц в минуту на один процесс мониторинга
+MONITOR_PAGES_PER_MINUTE = int(os.getenv('AVITO_MONITOR_PAGES_PER_MINUTE', '20'))
+MONITOR_MAX_PAGES = 5
+MONITOR_MAX_ADS = 200
+
+MONITOR_MIN_INTERVAL = 5 * 60
+MONITOR_MAX_INTERVAL = 24 * 60 * 60
+# Сколько новых объявлений в среднем хотим находить за один обход
+MONITOR_TARGET_NEW_ADS = 5
+# Во сколько раз интервал может вырасти за один обход без новых объявлений
+MONITOR_BACKOFF_FACTOR = 2
+EWMA_ALPHA = 0.3
+# Случайный разброс времени следующего запуска, доля интервала
+MONITOR_JITTER = 0.1
+MONITOR_STARTUP_SPREAD = 10 * 60
+# На сколько слово «занимается» процессом мониторинга на время обхода
+MONITOR_CLAIM_SECONDS = 15 * 60
+MONITOR_IDLE_POLL = 30
+
+
+def next_interval(interval, rate):
+    """Новый интервал обхода (секунды) по сглаженной частоте новых объявлений в час."""
+    if rate > 0:
+        target = MONITOR_TARGET_NEW_ADS / rate * 3600
+    else:
+        target = MONITOR_MAX_INTERVAL
+    # Замедляемся постепенно, ускоряемся сразу: всплеск новых объявлений важнее экономии запросов
+    target = min(target, interval * MONITOR_BACKOFF_FACTOR)
+    return int(min(max(target, MONITOR_MIN_INTERVAL), MONITOR_MAX_INTERVAL))
+
+
+def with_jitter(seconds):
+    return seconds * random.uniform(1 - MONITOR_JITTER, 1 + MONITOR_JITTER)
+
+
+def stagger_overdue(now=None):
+    """Распределяет просроченные слова по окну MONITOR_STARTUP_SPREAD. Возвращает их число."""
+    now = now or timezone.now()
+    overdue = list(
+        Keyword.objects.filter(Q(next_run_at__isnull=True) | Q(next_run_at__lte=now), is_active=True)
+        .order_by('next_run_at', 'pk')
+        .only('pk', 'next_run_at')
+    )
+    if not overdue:
+        return 0
+    step = MONITOR_STARTUP_SPREAD / len(overdue)
+    for i, keyword in enumerate(overdue):
+        keyword.next_run_at = now + timedelta(seconds=i * step)
+    Keyword.objects.bulk_update(overdue, ['next_run_at'], batch_size=500)
+    logger.info(f"Просроченных ключевых слов: {len(overdue)}, распределены на {MONITOR_STARTUP_SPREAD} с")
+    return len(overdue)
+
+
+def claim_due_keyword(now=None):
+    """Захватывает ключевое слово, время обхода которого наступило.
+
+    Условное обновление next_run_at не даёт двум процессам мониторинга взять одно слово;
+    если процесс упадёт во время обхода, слово освободится через MONITOR_CLAIM_SECONDS.
+    """
+    now = now or timezone.now()
+    candidates = (
+        Keyword.objects.filter(is_active=True, next_run_at__lte=now)
+        .order_by('next_run_at')
+        .values_list('pk', 'next_run_at')[:10]
+    )
+    for pk, next_run_at in candidates:
+        claimed = Keyword.objects.filter(pk=pk, next_run_at=next_run_at).update(
+            next_run_at=now + timedelta(seconds=MONITOR_CLAIM_SECONDS),
+        )
+        if claimed:
+            return Keyword.objects.get(pk=pk)
+    return None
+
+
+def seconds_until_next_run(now=None):
+    now = now or timezone.now()
+    next_run_at = Keyword.objects.filter(is_active=True).aggregate(next_run_at=Min('next_run_at'))['next_run_at']
+    if next_run_at is None:
+        return MONITOR_IDLE_POLL
+    return min(max((next_run_at - now).total_seconds(), 0), MONITOR_IDLE_POLL)
+
+
+def crawl_keyword(keyword, budget=None):
+    """Инкрементально обходит выдачу по слову и пересчитывает его расписание. Возвращает число новых объявлений."""
+    started = timezone.now()
+    new_ads = 0
+
+    def on_page(query, page, ads):
+        nonlocal new_ads
+        ingest_ads(ads)
+        seen_items.mark_seen(query, MONITOR_LOCATION, ads)
+        new_ads += len(ads)
+
+    try:
+        # Разрешение бюджета берётся до постановки страницы в очередь, а не после её загрузки
+        scrape_avito_listings([keyword.word], location=MONITOR_LOCATION, max_pages=MONITOR_MAX_PAGES,
+                              max_ads=MONITOR_MAX_ADS, on_page=on_page, seen_index=seen_items,
+                              before_fetch=budget.acquire if budget is not None else None, bypass_cache=True)
+    except Exception as e:
+        logger.error(f"Ошибка мониторинга по слову '{keyword.word}': {e}")
+
+    finished = timezone.now()
+    rate, interval = keyword.new_ads_rate, keyword.crawl_interval
+    if keyword.last_run_at is not None:
+        # Первый обход находит всю выдачу сразу, поэтому частоту считаем только со второго
+        hours = max((finished - keyword.last_run_at).total_seconds(), 1) / 3600
+        rate = EWMA_ALPHA * (new_ads / hours) + (1 - EWMA_ALPHA) * rate
+        interval = next_interval(interval, rate)
+
+    Keyword.objects.filter(pk=keyword.pk).update(
+        last_run_at=started,
+        new_ads_rate=rate,
+        crawl_interval=interval,
+        next_run_at=finished + timedelta(seconds=with_jitter(interval)),
+    )
+    logger.info(f"Мониторинг '{keyword.word}': новых объявлений {new_ads}, "
+                f"частота {rate:.2f}/ч, следующий обход через {interval} с")
+    return new_ads
+
+
+def monitor_loop(stop_event, once=False):
+    """Обходит ключевые слова по расписанию, пока не установлен stop_event.
+
+    При once=True обходит только слова, время которых уже наступило, и завершается.
+    """
+    budget = RateLimiter(MONITOR_PAGES_PER_MINUTE)
+    if not once:
+        stagger_overdue()
+    while not stop_event.is_set():
+        keyword = claim_due_keyword()
+        if keyword is None:
+            if once:
+                return
+            stop_event.wait(seconds_until_next_run())
+            continue
+        crawl_keyword(keyword, budget)
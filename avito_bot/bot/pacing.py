@@ -0,0 +1,238 @@
+"""Адаптивный темп запросов к хостам Avito вместо фиксированной случайной задержки.
+
+Для каждого хоста держится допустимая частота запросов (AIMD). Пока ответы
+успешные и быстрые, частота растёт на PACING_INCREASE запроса в секунду за
+ответ, но не выше PACING_MAX_RATE: по умолчанию это один запрос в секунду,
+потому что Avito ограничивает не только частоту, но и блокирует IP, а
+блокировку ответы показывают слишком поздно. Медленного старта нет — частота
+с начального значения растёт так же осторожно. На 429, 403, страницу с
+капчей (Avito отдаёт её с кодом 200), 5xx, сетевую ошибку или всплеск
+задержки (выше PACING_LATENCY_FACTOR × сглаженной задержки) частота
+умножается на PACING_BACKOFF, но не чаще раза за интервал между запросами:
+пачка ошибок от уже отправленных запросов считается одним сигналом.
+Заголовок Retry-After останавливает запросы к хосту на указанное время.
+
+Состояние общее для потоков процесса, а между процессами (веб, воркеры,
+monitor) — через кэш Django, как токен в bot.tokens: каждый процесс берёт
+долю частоты по числу активных процессов. Снижение частоты и блокировка
+по Retry-After публикуются сразу, остальное — не чаще раза в
+PACING_SYNC_INTERVAL. Запись в кэш без блокировок: одновременные
+публикации могут перезаписать друг друга, и тогда состояние сойдётся при
+следующей синхронизации.
+"""
+import logging
+import os
+import random
+import threading
+import time
+import uuid
+from email.utils import parsedate_to_datetime
+from urllib.parse import urlsplit
+
+from django.core.cache import cache
+
+from . import metrics
+
+logger = logging.getLogger(__name__)
+
+PACING_ENABLED = os.getenv('AVITO_PACING', '1') == '1'
+# Частота в запросах в секунду: начальная (в среднем как прежняя задержка 2–5 с) и границы
+PACING_INITIAL_RATE = float(os.getenv('AVITO_PACING_INITIAL_RATE', '0.3'))
+PACING_MIN_RATE = float(os.getenv('AVITO_PACING_MIN_RATE', '0.05'))
+PACING_MAX_RATE = float(os.getenv('AVITO_PACING_MAX_RATE', '1'))
+PACING_INCREASE = 0.1
+PACING_BACKOFF = 0.7
+PACING_LATENCY_FACTOR = 3.0
+# Задержка ниже этой всплеском не считается, секунды
+PACING_LATENCY_FLOOR = 1.0
+# Вес нового ответа в сглаженной задержке
+PACING_LATENCY_ALPHA = 0.2
+# Разброс интервала между запросами, доля
+PACING_JITTER = 0.2
+# Дольше этого Retry-After не соблюдается, секунды
+PACING_MAX_RETRY_AFTER = 600
+PACING_SYNC_INTERVAL = 1.0
+# Процесс, не синхронизировавшийся дольше этого, не считается активным
+PACING_PROCESS_TTL = 30
+
+# Признаки страницы блокировки с капчей, которую Avito отдаёт вместо выдачи с кодом 200
+CAPTCHA_MARKERS = (b'firewall-container', 'Доступ ограничен'.encode('utf-8'))
+
+PACING_CACHE_KEY = 'avito_pacing:{host}'
+# Процесс в общем состоянии; uuid отличает процессы с тем же pid после перезапуска
+PROCESS_ID = f"{os.getpid()}-{uuid.uuid4().hex[:8]}"
+
+
+def parse_retry_after(value):
+    """Retry-After в секундах: число секунд или HTTP-дата. None, если заголовка нет или он неразборчив."""
+    if not value:
+        return None
+    value = value.strip()
+    if value.isdigit():
+        return float(value)
+    try:
+        return max(parsedate_to_datetime(value).timestamp() - time.time(), 0.0)
+    except (TypeError, ValueError):
+        return None
+
+
+def is_captcha(response):
+    """True, если ответ — страница блокировки с капчей вместо запрошенной страницы."""
+    if response.status_code != 200 or 'html' not in response.headers.get('Content-Type', ''):
+        return False
+    return any(marker in response.content for marker in CAPTCHA_MARKERS)
+
+
+class HostPacer:
+    """Темп запросов к одному хосту."""
+
+    def __init__(self, host, shared=True, owner=None):
+        self.host = host
+        self.shared = shared
+        self.owner = owner or PROCESS_ID
+        self.rate = min(PACING_INITIAL_RATE, PACING_MAX_RATE)
+        self.latency = None
+        self.next_slot = 0.0
+        self.blocked_until = 0.0
+        self.last_decrease = 0.0
+        self.decreased_at = 0.0
+        self.processes = 1
+        self.synced_at = None
+        self._lock = threading.Lock()
+
+    def interval(self):
+        """Интервал между запросами этого процесса, секунды."""
+        return self.processes / self.rate
+
+    def wait(self, stop_event=None):
+        """Ждёт очереди на запрос. Возвращает False, если ожидание прервано stop_event."""
+        self.sync()
+        waited = 0.0
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                start = max(now, self.next_slot, now + self.blocked_until - time.time())
+                self.next_slot = start + self.interval() * random.uniform(1 - PACING_JITTER, 1 + PACING_JITTER)
+            delay = start - now
+            if delay > 0:
+                if stop_event is not None:
+                    stop_event.wait(delay)
+                else:
+                    time.sleep(delay)
+                waited += delay
+            if stop_event is not None and stop_event.is_set():
+                return False
+            with self._lock:
+                # Блокировка по Retry-After могла начаться, пока мы ждали, — тогда встаём в очередь заново
+                if time.time() >= self.blocked_until:
+                    break
+        metrics.observe('bot_pacing_wait_seconds', waited, {'host': self.host})
+        return True
+
+    def record(self, status, latency, retry_after=None, captcha=False):
+        """Учитывает ответ хоста: status — код ответа (None при сетевой ошибке), latency — секунды.
+
+        captcha=True — вместо страницы пришла капча (см. is_captcha).
+        """
+        reason = None
+        with self._lock:
+            if retry_after is not None:
+                self.blocked_until = max(self.blocked_until, time.time() + min(retry_after, PACING_MAX_RETRY_AFTER))
+            if status is None:
+                reason = 'error'
+            elif captcha:
+                reason = 'captcha'
+            elif status in (403, 429):
+                reason = str(status)
+            elif status >= 500:
+                reason = '5xx'
+            elif (self.latency is not None
+                  and latency > max(PACING_LATENCY_FLOOR, PACING_LATENCY_FACTOR * self.latency)):
+                reason = 'latency'
+            if status is not None:
+                self.latency = latency if self.latency is None else (
+                    (1 - PACING_LATENCY_ALPHA) * self.latency + PACING_LATENCY_ALPHA * latency)
+
+            now = time.monotonic()
+            if reason is None:
+                self.rate = min(self.rate + PACING_INCREASE, PACING_MAX_RATE)
+            elif now - self.last_decrease >= self.interval():
+                self.rate = max(self.rate * PACING_BACKOFF, PACING_MIN_RATE)
+                self.last_decrease = now
+                self.decreased_at = time.time()
+            else:
+                reason = None
+            rate = self.rate / self.processes
+        metrics.set_gauge('bot_pacing_allowed_rate', rate, {'host': self.host})
+        if reason is not None:
+            metrics.inc('bot_pacing_backoffs_total', {'host': self.host, 'reason': reason})
+            logger.info(f"Темп запросов к {self.host} снижен до {rate:.2f}/с: {reason}")
+        if reason is not None or retry_after is not None:
+            self.sync(force=True)
+
+    def sync(self, force=False):
+        """Обменивается состоянием с другими процессами через кэш Django."""
+        if not self.shared:
+            return
+        with self._lock:
+            now = time.monotonic()
+            if not force and self.synced_at is not None and now - self.synced_at < PACING_SYNC_INTERVAL:
+                return
+            self.synced_at = now
+        key = PACING_CACHE_KEY.format(host=self.host)
+        try:
+            state = cache.get(key) or {}
+        except Exception as e:
+            logger.error(f"Не удалось прочитать темп запросов к {self.host}: {e}")
+            return
+
+        wall = time.time()
+        with self._lock:
+            # Снижение, опубликованное другим процессом позже нашего, принимаем; рост каждый процесс ведёт сам
+            if state.get('decreased_at', 0) > self.decreased_at:
+                self.rate = min(self.rate, state['rate'])
+                self.decreased_at = state['decreased_at']
+            self.blocked_until = max(self.blocked_until, state.get('blocked_until', 0))
+            processes = {owner: seen for owner, seen in state.get('processes', {}).items()
+                         if wall - seen <= PACING_PROCESS_TTL}
+            processes[self.owner] = wall
+            self.processes = len(processes)
+            state = {
+                'rate': self.rate,
+                'decreased_at': self.decreased_at,
+                'blocked_until': self.blocked_until,
+                'processes': processes,
+            }
+            rate = self.rate / self.processes
+        try:
+            cache.set(key, state, PACING_PROCESS_TTL * 10)
+        except Exception as e:
+            logger.error(f"Не удалось сохранить темп запросов к {self.host}: {e}")
+        metrics.set_gauge('bot_pacing_allowed_rate', rate, {'host': self.host})
+
+
+_pacers = {}
+_pacers_lock = threading.Lock()
+
+
+def get_pacer(url):
+    """Возвращает общий для процесса HostPacer хоста из url."""
+    host = urlsplit(url).netloc
+    with _pacers_lock:
+        pacer = _pacers.get(host)
+        if pacer is None:
+            pacer = _pacers[host] = HostPacer(host)
+        return pacer
+
+
+def pace(url, stop_event=None):
+    """Ждёт очереди на запрос к хосту url. Возвращает False, если ожидание прервано stop_event."""
+    if not PACING_ENABLED:
+        return stop_event is None or not stop_event.is_set()
+    return get_pacer(url).wait(stop_event)
+
+
+def record_response(url, status, latency, retry_after=None, captcha=False):
+    """Сообщает темпу хоста url результат запроса."""
+    if PACING_ENABLED:
+        get_pacer(url).record(status, latency, retry_after, captcha)
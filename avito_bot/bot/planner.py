@@ -0,0 +1,189 @@
+"""Планировщик поисковых запросов: общие загрузки выдачи по ключевым словам.
+
+Запрос задания разбивается на единицы загрузки — по одной на каноническое
+ключевое слово (без учёта регистра и лишних пробелов) с регионом,
+категорией и глубиной обхода. Единица, которая уже загружается или
+завершилась не раньше PLAN_REUSE_SECONDS назад, повторно не запускается:
+задание подписывается на её страницы (single-flight). Страницы единиц
+читаются в порядке ключевых слов, объявления с уже встреченным item_id
+отбрасываются, поэтому пересекающиеся поиски многих пользователей
+обходятся почти как один обход.
+
+Единицы запускаются по мере надобности: если первое ключевое слово уже дало
+max_ads объявлений, остальные не загружаются. Общие загрузки живут в пределах
+процесса; между процессами страницы переиспользует кэш ответов (bot.http_cache).
+"""
+import logging
+import os
+import re
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from . import metrics
+from .extractors import item_id_from_url
+from .utils import MAX_CONCURRENCY_PER_HOST, scrape_avito_listings
+
+logger = logging.getLogger(__name__)
+
+# Сколько секунд завершённая загрузка отдаётся новым запросам вместо повторного обхода
+PLAN_REUSE_SECONDS = float(os.getenv('AVITO_PLAN_REUSE_SECONDS', '120'))
+# Сколько единиц загружается одновременно
+PLAN_WORKERS = int(os.getenv('AVITO_PLAN_WORKERS', str(MAX_CONCURRENCY_PER_HOST)))
+# Сколько ждать следующей страницы общей загрузки, прежде чем считать её зависшей
+PAGE_WAIT_TIMEOUT = 300
+
+SPACES_RE = re.compile(r'\s+')
+
+
+def canonical_keyword(word):
+    """Ключевое слово в каноническом виде: 'Аренда  офиса ' -> 'аренда офиса'."""
+    return SPACES_RE.sub(' ', word).strip().casefold()
+
+
+def ad_key(ad):
+    """Ключ объявления для слияния результатов: item_id, а если его нет — URL."""
+    return ad.get('item_id') or item_id_from_url(ad.get('url')) or ad.get('url')
+
+
+class _Flight:
+    """Одна общая загрузка единицы: страницы накапливаются, подписчики читают их по мере поступления."""
+
+    def __init__(self, key, limit):
+        self.key = key
+        self.limit = limit
+        self.pages = []
+        self.ads = 0
+        self.done = False
+        self.error = None
+        self.finished_at = None
+        self._condition = threading.Condition()
+
+    def add_page(self, query, page, ads):
+        with self._condition:
+            self.pages.append((page, ads))
+            self.ads += len(ads)
+            self._condition.notify_all()
+
+    def finish(self, error=None):
+        with self._condition:
+            self.error = error
+            self.done = True
+            self.finished_at = time.monotonic()
+            self._condition.notify_all()
+
+    def covers(self, limit, now, reuse_seconds):
+        """Можно ли отдать эту загрузку запросу до limit объявлений."""
+        if self.error is not None:
+            return False
+        if not self.done:
+            return limit <= self.limit
+        if now - self.finished_at > reuse_seconds:
+            return False
+        # Загрузка, давшая меньше своего предела, дошла до конца выдачи — больше объявлений нет
+        return limit <= self.limit or self.ads < self.limit
+
+    def iter_pages(self):
+        """Страницы по порядку; ждёт новые, пока загрузка не завершится."""
+        index = 0
+        while True:
+            with self._condition:
+                while index >= len(self.pages) and not self.done:
+                    if not self._condition.wait(PAGE_WAIT_TIMEOUT):
+                        raise TimeoutError(f"Загрузка '{self.key[0]}' не прислала страницу за {PAGE_WAIT_TIMEOUT} с")
+                if index >= len(self.pages):
+                    if self.error is not None:
+                        raise RuntimeError(f"Загрузка '{self.key[0]}' завершилась ошибкой: {self.error}")
+                    return
+                page, ads = self.pages[index]
+            index += 1
+            yield page, ads
+
+
+class QueryPlanner:
+    """Общие для процесса загрузки выдачи по единицам (ключевое слово, регион, категория, глубина)."""
+
+    def __init__(self, workers=PLAN_WORKERS, reuse_seconds=PLAN_REUSE_SECONDS):
+        self.reuse_seconds = reuse_seconds
+        self._lock = threading.Lock()
+        self._flights = {}
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='plan')
+
+    def shutdown(self):
+        self._executor.shutdown(wait=True)
+
+    def _evict(self, now):
+        expired = [key for key, flight in self._flights.items()
+                   if flight.done and now - flight.finished_at > self.reuse_seconds]
+        for key in expired:
+            del self._flights[key]
+
+    def acquire(self, key, limit):
+        """Возвращает загрузку единицы key, которой хватит на limit объявлений, запуская её при необходимости."""
+        now = time.monotonic()
+        with self._lock:
+            self._evict(now)
+            flight = self._flights.get(key)
+            if flight is not None and flight.covers(limit, now, self.reuse_seconds):
+                metrics.inc('bot_plan_units_total', {'outcome': 'reused' if flight.done else 'joined'})
+                return flight
+            flight = _Flight(key, limit)
+            self._flights[key] = flight
+        metrics.inc('bot_plan_units_total', {'outcome': 'started'})
+        self._executor.submit(self._run, flight)
+        return flight
+
+    def _run(self, flight):
+        keyword, location, category, max_pages = flight.key
+        try:
+            scrape_avito_listings([keyword], location=location, category=category, max_pages=max_pages,
+                                  max_ads=flight.limit, on_page=flight.add_page)
+        except Exception as e:
+            logger.error(f"Ошибка загрузки по ключевому слову '{keyword}': {e}")
+            flight.finish(e)
+        else:
+            flight.finish()
+
+    def search(self, keyword_list, location='rossiya', category='nedvizhimost', max_pages=5, max_ads=10,
+               on_page=None):
+        """Ищет объявления по ключевым словам через общие загрузки, как scrape_avito_listings.
+
+        on_page(keyword, page, ads) получает только ещё не встречавшиеся в этом поиске
+        объявления; ad['keyword'] — написание слова из keyword_list.
+        """
+        units = {}
+        for word in keyword_list:
+            units.setdefault(canonical_keyword(word), word)
+
+        seen = set()
+        result = []
+        for canonical, word in units.items():
+            flight = self.acquire((canonical, location, category, max_pages), max_ads)
+            for page, ads in flight.iter_pages():
+                fresh = []
+                for ad in ads:
+                    key = ad_key(ad)
+                    if key is not None:
+                        if key in seen:
+                            continue
+                        seen.add(key)
+                    # Словари страниц общие для всех подписчиков, поэтому копируем
+                    fresh.append(dict(ad, keyword=word))
+                fresh = fresh[:max_ads - len(result)]
+                if on_page:
+                    on_page(word, page, fresh)
+                result.extend(fresh)
+                if len(result) >= max_ads:
+                    return result
+        logger.info(f"Планировщик: найдено объявлений {len(result)} по {len(units)} ключевым словам")
+        return result
+
+
+planner = QueryPlanner()
+
+
+def search_listings(keyword_list, location='rossiya', category='nedvizhimost', max_pages=5, max_ads=10,
+                    on_page=None):
+    """Поиск через общий планировщик процесса (см. QueryPlanner.search)."""
+    return planner.search(keyword_list, location=location, category=category, max_pages=max_pages,
+                          max_ads=max_ads, on_page=on_page)
@@ -0,0 +1,69 @@
+"""Профилирование медленных поисков и запросов (включается явно).
+
+При BOT_PROFILE=1 выполнение задания поиска и обработка HTTP-запроса
+идут под cProfile. Если блок работал дольше BOT_PROFILE_THRESHOLD секунд,
+в каталог settings.PROFILE_DIR (BOT_PROFILE_DIR, по умолчанию profiles/ рядом
+с manage.py) пишутся файл .prof (открывается snakeviz, flameprof и т. п.)
+и текстовая сводка .txt с самыми дорогими функциями.
+cProfile видит только поток, в котором запущен блок: загрузки страниц
+в пуле потоков попадают в профиль как ожидание результатов.
+"""
+import cProfile
+import io
+import logging
+import os
+import pstats
+import re
+import time
+from contextlib import contextmanager
+
+from django.conf import settings
+
+logger = logging.getLogger(__name__)
+
+PROFILE_ENABLED = os.getenv('BOT_PROFILE', '0') == '1'
+PROFILE_THRESHOLD = float(os.getenv('BOT_PROFILE_THRESHOLD', '5'))
+PROFILE_DIR = settings.PROFILE_DIR
+# Сколько функций выводить в текстовой сводке
+PROFILE_TOP = 40
+
+
+def _dump(profiler, name, elapsed):
+    PROFILE_DIR.mkdir(parents=True, exist_ok=True)
+    stem = f"{time.strftime('%Y%m%d-%H%M%S')}-{re.sub(r'[^0-9A-Za-z_-]+', '_', name).strip('_')}"
+    prof_path = PROFILE_DIR / f"{stem}.prof"
+    profiler.dump_stats(prof_path)
+
+    summary = io.StringIO()
+    summary.write(f"{name}: {elapsed:.2f} с\n\n")
+    stats = pstats.Stats(profiler, stream=summary)
+    stats.sort_stats('cumulative').print_stats(PROFILE_TOP)
+    stats.sort_stats('tottime').print_stats(PROFILE_TOP)
+    (PROFILE_DIR / f"{stem}.txt").write_text(summary.getvalue(), encoding='utf-8')
+    logger.warning(f"Медленное выполнение '{name}' ({elapsed:.2f} с), профиль: {prof_path}")
+
+
+@contextmanager
+def profiled(name):
+    """Профилирует блок, если профилирование включено, и сохраняет профиль, если блок был медленным."""
+    if not PROFILE_ENABLED:
+        yield
+        return
+    profiler = cProfile.Profile()
+    try:
+        profiler.enable()
+    except ValueError:
+        # В этом потоке уже работает другой профилировщик
+        yield
+        return
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        profiler.disable()
+        elapsed = time.perf_counter() - started
+        if elapsed >= PROFILE_THRESHOLD:
+            try:
+                _dump(profiler, name, elapsed)
+            except OSError as e:
+                logger.error(f"Не удалось сохранить профиль '{name}': {e}")
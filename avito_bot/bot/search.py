@@ -0,0 +1,185 @@
+"""Полнотекстовый поиск по объявлениям и ответам в логе рассылки (SQLite FTS5).
+
+Индексы bot_avitoad_fts и bot_logentry_fts — внешние по отношению к таблицам
+AvitoAd и LogEntry (content=...) и поддерживаются триггерами (bot.fts).
+Для русской морфологии слова запроса приводятся к основе стеммером Snowball
+и ищутся по префиксу: «офисы» -> офис* находит «офис», «офисное», «офисами».
+Результаты ранжируются по bm25, совпадения подсвечиваются тегом <mark>.
+"""
+import logging
+import re
+
+from django.db import connection
+from django.utils.html import escape
+
+from .fts import AD_INDEX, LOG_INDEX
+
+logger = logging.getLogger(__name__)
+
+
+# Маркеры подсветки; заменяются на <mark> после экранирования HTML
+_MARK_START = '\x02'
+_MARK_END = '\x03'
+
+WORD_RE = re.compile(r'\w+', re.UNICODE)
+
+
+class RussianStemmer:
+    """Стеммер Snowball для русского языка (https://snowballstem.org/algorithms/russian/stemmer.html)."""
+
+    VOWELS = 'аеиоуыэюя'
+
+    PERFECTIVE_GERUND_1 = ('вшись', 'вши', 'в')
+    PERFECTIVE_GERUND_2 = ('ившись', 'ывшись', 'ивши', 'ывши', 'ив', 'ыв')
+    ADJECTIVE = ('ими', 'ыми', 'его', 'ого', 'ему', 'ому', 'ее', 'ие', 'ые', 'ое', 'ей', 'ий', 'ый', 'ой',
+                 'ем', 'им', 'ым', 'ом', 'их', 'ых', 'ую', 'юю', 'ая', 'яя', 'ою', 'ею')
+    PARTICIPLE_1 = ('ем', 'нн', 'вш', 'ющ', 'щ')
+    PARTICIPLE_2 = ('ивш', 'ывш', 'ующ')
+    REFLEXIVE = ('ся', 'сь')
+    VERB_1 = ('ете', 'йте', 'ешь', 'нно', 'ла', 'на', 'ли', 'ем', 'ло', 'но', 'ет', 'ют', 'ны', 'ть', 'й', 'л', 'н')
+    VERB_2 = ('ейте', 'уйте', 'ила', 'ыла', 'ена', 'ите', 'или', 'ыли', 'ило', 'ыло', 'ено', 'ует', 'уют',
+              'ены', 'ить', 'ыть', 'ишь', 'ей', 'уй', 'ил', 'ыл', 'им', 'ым', 'ен', 'ят', 'ит', 'ыт', 'ую', 'ю')
+    NOUN = ('иями', 'ями', 'ами', 'ией', 'иям', 'ием', 'иях', 'ев', 'ов', 'ие', 'ье', 'еи', 'ии', 'ей', 'ой',
+            'ий', 'ям', 'ем', 'ам', 'ом', 'ах', 'ях', 'ию', 'ью', 'ия', 'ья', 'а', 'е', 'и', 'й', 'о', 'у',
+            'ы', 'ь', 'ю', 'я')
+    SUPERLATIVE = ('ейше', 'ейш')
+    DERIVATIONAL = ('ость', 'ост')
+
+    def _regions(self, word):
+        """Возвращает начала областей RV и R2."""
+        rv = next((i + 1 for i, ch in enumerate(word) if ch in self.VOWELS), len(word))
+
+        def next_region(start):
+            for i in range(start + 1, len(word)):
+                if word[i] not in self.VOWELS and word[i - 1] in self.VOWELS:
+                    return i + 1
+            return len(word)
+
+        r1 = next_region(0)
+        return rv, next_region(r1)
+
+    @staticmethod
+    def _remove(word, start, endings, preceded_endings=()):
+        """Удаляет самое длинное окончание из области [start:].
+
+        Окончания из preceded_endings удаляются, только если перед ними стоит «а» или «я».
+        Возвращает новое слово или None, если окончание не найдено.
+        """
+        region = word[start:]
+        candidates = [(e, False) for e in endings] + [(e, True) for e in preceded_endings]
+        for ending, needs_a in sorted(candidates, key=lambda c: len(c[0]), reverse=True):
+            if region.endswith(ending):
+                if needs_a:
+                    before = region[:-len(ending)]
+                    if not before or before[-1] not in 'ая':
+                        return None
+                return word[:-len(ending)]
+        return None
+
+    def stem(self, word):
+        word = word.lower().replace('ё', 'е')
+        rv, r2 = self._regions(word)
+
+        # Шаг 1
+        result = self._remove(word, rv, self.PERFECTIVE_GERUND_2, self.PERFECTIVE_GERUND_1)
+        if result is None:
+            word = self._remove(word, rv, self.REFLEXIVE) or word
+            result = self._remove(word, rv, self.ADJECTIVE)
+            if result is not None:
+                result = self._remove(result, rv, self.PARTICIPLE_2, self.PARTICIPLE_1) or result
+            else:
+                result = self._remove(word, rv, self.VERB_2, self.VERB_1)
+                if result is None:
+                    result = self._remove(word, rv, self.NOUN)
+        word = result if result is not None else word
+
+        # Шаг 2
+        if word[rv:].endswith('и'):
+            word = word[:-1]
+
+        # Шаг 3
+        word = self._remove(word, max(r2, rv), self.DERIVATIONAL) or word
+
+        # Шаг 4
+        if word[rv:].endswith('нн'):
+            word = word[:-1]
+        else:
+            superlative = self._remove(word, rv, self.SUPERLATIVE)
+            if superlative is not None:
+                word = superlative[:-1] if superlative[rv:].endswith('нн') else superlative
+            elif word[rv:].endswith('ь'):
+                word = word[:-1]
+        return word
+
+
+stemmer = RussianStemmer()
+
+
+def build_match_query(text):
+    """Строит выражение MATCH для FTS5: основы слов запроса с поиском по префиксу, через AND."""
+    terms = []
+    for word in WORD_RE.findall(text.lower()):
+        # Однобуквенные предлоги и союзы («в», «и», «с») только размывают запрос
+        if len(word) < 2:
+            continue
+        stem = stemmer.stem(word)
+        # Слишком короткая основа даст слишком много совпадений — ищем слово как есть
+        if len(stem) < 3:
+            stem = word
+        terms.append(f'"{stem}"*')
+    return ' '.join(terms)
+
+
+def _highlight(text):
+    """Экранирует HTML и заменяет маркеры подсветки на <mark>."""
+    return escape(text or '').replace(_MARK_START, '<mark>').replace(_MARK_END, '</mark>')
+
+
+def search_ads(text, limit=20, offset=0):
+    """Ищет объявления по заголовку и описанию. Возвращает список словарей, лучшие совпадения первыми."""
+    match = build_match_query(text)
+    if not match:
+        return []
+    sql = (
+        f"SELECT a.id, a.url, a.price, "
+        f"highlight({AD_INDEX}, 0, %s, %s), snippet({AD_INDEX}, 1, %s, %s, '…', 24), "
+        f"bm25({AD_INDEX}, 10.0, 1.0) AS rank "
+        f"FROM {AD_INDEX} JOIN bot_avitoad a ON a.id = {AD_INDEX}.rowid "
+        f"WHERE {AD_INDEX} MATCH %s ORDER BY rank LIMIT %s OFFSET %s"
+    )
+    with connection.cursor() as cursor:
+        cursor.execute(sql, [_MARK_START, _MARK_END, _MARK_START, _MARK_END, match, limit, offset])
+        rows = cursor.fetchall()
+    return [
+        {'id': pk, 'url': url, 'price': price, 'title': _highlight(title),
+         'snippet': _highlight(snippet), 'rank': rank}
+        for pk, url, price, title, snippet, rank in rows
+    ]
+
+
+def search_log_responses(text, limit=20, offset=0):
+    """Ищет записи LogEntry по тексту ответа."""
+    match = build_match_query(text)
+    if not match:
+        return []
+    sql = (
+        f"SELECT l.id, l.created_at, snippet({LOG_INDEX}, 0, %s, %s, '…', 24), bm25({LOG_INDEX}) AS rank "
+        f"FROM {LOG_INDEX} JOIN bot_logentry l ON l.id = {LOG_INDEX}.rowid "
+        f"WHERE {LOG_INDEX} MATCH %s ORDER BY rank LIMIT %s OFFSET %s"
+    )
+    with connection.cursor() as cursor:
+        cursor.execute(sql, [_MARK_START, _MARK_END, match, limit, offset])
+        rows = cursor.fetchall()
+    return [
+        {'id': pk, 'created_at': created_at, 'snippet': _highlight(snippet), 'rank': rank}
+        for pk, created_at, snippet, rank in rows
+    ]
+
+
+def rebuild_indexes():
+    """Полностью перестраивает индексы по содержимому таблиц и оптимизирует их."""
+    with connection.cursor() as cursor:
+        for index in (AD_INDEX, LOG_INDEX):
+            cursor.execute(f"INSERT INTO {index}({index}) VALUES ('rebuild')")
+            cursor.execute(f"INSERT INTO {index}({index}) VALUES ('optimize')")
+            logger.info(f"Полнотекстовый индекс {index} перестроен")
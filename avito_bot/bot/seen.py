@@ -0,0 +1,134 @@
+"""Индекс уже просмотренных объявлений для инкрементального обхода выдачи.
+
+Идентификаторы объявлений хранятся в таблице SeenItem (по запросу и региону),
+а в памяти процесса для каждой пары держится фильтр Блума. Фильтр отвечает
+«точно новое» без обращения к БД; положительные ответы подтверждаются одним
+запросом на страницу, так что ложные срабатывания фильтра не теряют объявления.
+
+Объявления, отмеченные другими процессами, подгружаются в фильтр не чаще раза
+в SEEN_SYNC_INTERVAL секунд; до этого такое объявление считается новым,
+и повторно его сохранит upsert без дубликатов.
+"""
+import hashlib
+import logging
+import math
+import os
+import threading
+import time
+
+from .db_writer import write
+from .models import SeenItem
+
+logger = logging.getLogger(__name__)
+
+SEEN_SYNC_INTERVAL = float(os.getenv('AVITO_SEEN_SYNC_INTERVAL', '5'))
+
+
+class BloomFilter:
+    """Простой фильтр Блума на bytearray с двойным хешированием."""
+
+    def __init__(self, capacity, error_rate=0.01):
+        capacity = max(capacity, 1)
+        self.capacity = capacity
+        self.size = max(int(-capacity * math.log(error_rate) / (math.log(2) ** 2)), 8)
+        self.hash_count = max(int(round(self.size / capacity * math.log(2))), 1)
+        self.bits = bytearray((self.size + 7) // 8)
+        self.count = 0
+
+    def _positions(self, key):
+        digest = hashlib.blake2b(key.encode('utf-8'), digest_size=16).digest()
+        h1 = int.from_bytes(digest[:8], 'little')
+        h2 = int.from_bytes(digest[8:], 'little') | 1
+        return ((h1 + i * h2) % self.size for i in range(self.hash_count))
+
+    def add(self, key):
+        """Добавляет ключ. Возвращает False, если все его биты уже были установлены."""
+        added = False
+        for position in self._positions(key):
+            byte, bit = position >> 3, 1 << (position & 7)
+            if not self.bits[byte] & bit:
+                self.bits[byte] |= bit
+                added = True
+        # Считаем только новые ключи, иначе повторные добавления раньше времени «переполняют» фильтр
+        if added:
+            self.count += 1
+        return added
+
+    def __contains__(self, key):
+        return all(self.bits[position >> 3] & (1 << (position & 7)) for position in self._positions(key))
+
+
+class _SeenKey:
+    """Состояние одной пары (запрос, регион) в памяти процесса."""
+
+    def __init__(self, capacity):
+        self.bloom = BloomFilter(capacity)
+        self.last_pk = 0
+        self.synced_at = None
+
+
+class SeenItemIndex:
+    """Общий для процесса индекс просмотренных объявлений.
+
+    filter_new() отбрасывает уже известные объявления, mark_seen() записывает
+    идентификаторы в БД. mark_seen() вызывается после сохранения объявлений,
+    чтобы при сбое новые объявления не считались просмотренными.
+    """
+
+    # Во сколько раз ёмкость фильтра превышает число известных объявлений
+    CAPACITY_FACTOR = 4
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._keys = {}
+
+    def _sync(self, query, location):
+        """Подгружает из БД идентификаторы, добавленные с момента прошлой синхронизации."""
+        state = self._keys.get((query, location))
+        now = time.monotonic()
+        if (state is not None and state.bloom.count <= state.bloom.capacity
+                and now - state.synced_at < SEEN_SYNC_INTERVAL):
+            return state
+        rows = SeenItem.objects.filter(query=query, location=location)
+        if state is None or state.bloom.count > state.bloom.capacity:
+            # Первая загрузка или фильтр переполнен — строим его заново с запасом
+            state = _SeenKey(rows.count() * self.CAPACITY_FACTOR + 1024)
+            self._keys[(query, location)] = state
+        for pk, item_id in rows.filter(pk__gt=state.last_pk).order_by('pk').values_list('pk', 'item_id').iterator():
+            state.bloom.add(item_id)
+            state.last_pk = pk
+        state.synced_at = now
+        return state
+
+    def filter_new(self, query, location, ads):
+        """Возвращает объявления со страницы, которых ещё не было в выдаче по этому запросу."""
+        with self._lock:
+            state = self._sync(query, location)
+            maybe_known = {ad['item_id'] for ad in ads if ad.get('item_id') and ad['item_id'] in state.bloom}
+            known = set()
+            if maybe_known:
+                known = set(
+                    SeenItem.objects.filter(query=query, location=location, item_id__in=maybe_known)
+                    .values_list('item_id', flat=True)
+                )
+            return [ad for ad in ads if ad.get('item_id') not in known]
+
+    def mark_seen(self, query, location, ads):
+        """Запоминает объявления как просмотренные по запросу и региону."""
+        item_ids = {ad['item_id'] for ad in ads if ad.get('item_id')}
+        if not item_ids:
+            return
+        write(
+            SeenItem.objects.bulk_create,
+            [SeenItem(query=query, location=location, item_id=item_id) for item_id in item_ids],
+            batch_size=500,
+            ignore_conflicts=True,
+        )
+        with self._lock:
+            state = self._keys.get((query, location))
+            if state is not None:
+                for item_id in item_ids:
+                    state.bloom.add(item_id)
+
+
+seen_items = SeenItemIndex()
@@ -0,0 +1,25 @@
+"""Бэкенд шаблонов Django, записывающий время отрисовки в метрики."""
+from django.template.backends.django import DjangoTemplates
+
+from . import metrics
+
+
+class TimedTemplate:
+    def __init__(self, template, name):
+        self.template = template
+        self.name = name
+
+    def render(self, context=None, request=None):
+        with metrics.timer('bot_template_render_seconds', {'template': self.name}):
+            return self.template.render(context, request)
+
+    def __getattr__(self, name):
+        return getattr(self.template, name)
+
+
+class TimedDjangoTemplates(DjangoTemplates):
+    def get_template(self, template_name):
+        return TimedTemplate(super().get_template(template_name), template_name)
+
+    def from_string(self, template_code):
+        return TimedTemplate(super().from_string(template_code), '<string>')
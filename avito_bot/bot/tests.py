@@ -1,3 +1,1241 @@
-from django.test import TestCase
+import json
+import logging
+import os
+import tempfile
+import threading
+import time
+import zlib
+from datetime import datetime, timedelta
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+from unittest import mock
+from urllib.parse import parse_qs, urlsplit
 
-# Create your tests here.
+import requests
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.db import connection, connections
+from django.db.migrations.executor import MigrationExecutor
+from django.test import TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+
+from . import admin as bot_admin
+from . import archive, dedup, enrich, http_client, jobs, log_handlers, logreader, messenger, metrics, monitor, pacing, planner, seen, tokens, utils
+from .analytics import normalize_prices, rebuild_rollups
+from .avito_api import fetch_api_listings
+from .bench.benchmarks import against_server, bench_scrape, check_thresholds
+from .bench.fake_server import PAGE_ID_STEP, TESTDATA_DIR, FakeAvitoServer
+from .db_writer import WriteQueue
+from .extractors import EXTRACTORS, extract_listings
+from .http_cache import ResponseCache
+from .messenger import dispatch_message
+from .tokens import token_manager
+from .ingest import ingest_ads, resolve_keywords
+from .models import AvitoAd, JobAd, Keyword, Lease, LogEntry, Message, PriceRollup, SearchJob, SeenItem
+from .search import search_ads
+from .seen import SeenItemIndex
+
+
+class ConcurrentScrapeTests(TestCase):
+
+    def test_pages_are_fetched_concurrently_and_returned_in_order(self):
+        with FakeAvitoServer(latency=0.05, pages=4) as server, against_server(server):
+            ads = utils.scrape_avito_listings(['офис', 'склад'], max_pages=4, max_ads=10 ** 6, split_keywords=True)
+        self.assertEqual(server.requests, 8)
+        self.assertGreater(server.max_in_flight, 1)
+        self.assertLessEqual(server.max_in_flight, utils.MAX_CONCURRENCY_PER_HOST)
+        # Сначала запросы в порядке ключевых слов, внутри — страницы по порядку (50 объявлений на странице)
+        self.assertEqual([ad['keyword'] for ad in ads], ['офис'] * 200 + ['склад'] * 200)
+        pages = [int(ad['item_id']) // PAGE_ID_STEP for ad in ads[::50]]
+        self.assertEqual(pages, sorted(pages[:4]) * 2)
+        self.assertEqual(len(set(pages)), 4)
+
+    def test_stops_at_max_ads(self):
+        with FakeAvitoServer(pages=10) as server, against_server(server):
+            ads = utils.scrape_avito_listings(['офис'], max_pages=10, max_ads=60)
+        self.assertEqual(len(ads), 60)
+        # Две нужные страницы и не больше окна опережения сверх них
+        self.assertLessEqual(server.requests, 2 + utils.MAX_CONCURRENCY_PER_HOST)
+
+    def test_response_after_stop_is_not_cached(self):
+        stop_event = threading.Event()
+        with FakeAvitoServer() as server, tempfile.TemporaryDirectory() as directory, \
+                mock.patch.object(pacing, 'PACING_ENABLED', False), \
+                mock.patch.object(utils, 'response_cache', ResponseCache(path=str(Path(directory) / 'http.sqlite3'))):
+            session = utils.get_session_with_retries()
+            url = f'{server.url}/rossiya/nedvizhimost?q=офис&p=5'
+
+            def get_and_stop(*args, **kwargs):
+                # Поиск завершается, пока запрос ещё выполняется
+                stop_event.set()
+                return requests.Session.get(session, *args, **kwargs)
+
+            with mock.patch.object(session, 'get', side_effect=get_and_stop):
+                self.assertIsNone(utils.fetch_page(session, url, {}, stop_event))
+            self.assertEqual(server.requests, 1)
+            self.assertIsNone(utils.response_cache.get(url, {}))
+
+
+@override_settings(CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}})
+class TokenManagerTests(TransactionTestCase):
+
+    def setUp(self):
+        cache.clear()
+        self.calls = 0
+        calls_lock = threading.Lock()
+
+        def fake_get_token():
+            with calls_lock:
+                self.calls += 1
+                number = self.calls
+            time.sleep(0.2)
+            return {'access_token': f'token-{number}', 'expires_at': time.time() + 3600}
+
+        patcher = mock.patch.object(tokens, 'get_avito_token', fake_get_token)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_concurrent_refresh_makes_one_request(self):
+        # Отдельные менеджеры — как разные процессы: общие у них только кэш и БД
+        results = []
+
+        def refresh():
+            results.append(tokens.TokenManager().refresh())
+            connections.close_all()
+
+        threads = [threading.Thread(target=refresh) for _ in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join(10)
+
+        self.assertEqual(self.calls, 1)
+        self.assertEqual([entry['access_token'] for entry in results], ['token-1'] * 4)
+        self.assertEqual(Lease.objects.get(name=tokens.LOCK_NAME).owner, '')
+
+    def test_expiring_token_is_refreshed_ahead_of_time(self):
+        manager = tokens.TokenManager()
+        cache.set(tokens.TOKEN_CACHE_KEY,
+                  {'access_token': 'old', 'expires_at': time.time() + utils.TOKEN_REFRESH_BUFFER + 60}, 3600)
+        self.assertEqual(manager.get_cached(), 'old')
+        self.assertEqual(manager.refresh()['access_token'], 'old')
+        self.assertEqual(self.calls, 0)
+
+        # Фоновое обновление берёт новый токен заранее, пока старый ещё действует
+        self.assertEqual(manager.refresh(lead=tokens.PROACTIVE_REFRESH_LEAD)['access_token'], 'token-1')
+        self.assertEqual(manager.get_cached(), 'token-1')
+
+        # Занятая блокировка с истёкшим сроком (упавший процесс) не мешает обновлению
+        Lease.objects.filter(name=tokens.LOCK_NAME).update(owner='упавший', expires_at=timezone.now())
+        cache.delete(tokens.TOKEN_CACHE_KEY)
+        self.assertEqual(manager.refresh(wait_timeout=1)['access_token'], 'token-2')
+
+    def test_token_refreshed_before_lease_is_reused(self):
+        # Другой процесс обновил токен и отпустил блокировку между проверкой кэша и захватом
+        acquire = tokens.leases.acquire
+
+        def acquire_after_refresh(*args):
+            cache.set(tokens.TOKEN_CACHE_KEY, {'access_token': 'fresh', 'expires_at': time.time() + 3600}, 3600)
+            return acquire(*args)
+
+        with mock.patch.object(tokens.leases, 'acquire', acquire_after_refresh):
+            self.assertEqual(tokens.TokenManager().refresh()['access_token'], 'fresh')
+        self.assertEqual(self.calls, 0)
+
+
+class IncrementalCrawlTests(TestCase):
+
+    def test_known_first_page_stops_the_crawl_with_one_request(self):
+        index = SeenItemIndex()
+        with FakeAvitoServer(pages=3) as server, against_server(server):
+            ads = utils.scrape_avito_listings(['офис'], max_pages=3, max_ads=10 ** 6, seen_index=index)
+            self.assertEqual((len(ads), server.requests), (150, 3))
+            index.mark_seen('офис', 'rossiya', ads)
+
+            before = server.requests
+            with mock.patch.object(seen, 'SEEN_SYNC_INTERVAL', 0):
+                self.assertEqual(utils.scrape_avito_listings(['офис'], max_pages=3, max_ads=10 ** 6,
+                                                             seen_index=index), [])
+            self.assertEqual(server.requests - before, 1)
+
+            # Другой процесс узнаёт об отмеченных объявлениях из БД
+            before = server.requests
+            self.assertEqual(utils.scrape_avito_listings(['офис'], max_pages=3, max_ads=10 ** 6,
+                                                         seen_index=SeenItemIndex()), [])
+            self.assertEqual(server.requests - before, 1)
+        # Синхронизация с БД не считает уже добавленные объявления второй раз
+        self.assertEqual(index._keys[('офис', 'rossiya')].bloom.count, 150)
+        # Между синхронизациями заведомо новые объявления отсеиваются без запросов к БД
+        with self.assertNumQueries(0):
+            self.assertEqual(len(index.filter_new('офис', 'rossiya', [{'item_id': '1'}])), 1)
+
+    def test_incremental_crawl_does_not_read_the_response_cache(self):
+        with FakeAvitoServer(pages=1) as server, against_server(server), tempfile.TemporaryDirectory() as directory, \
+                mock.patch.object(utils, 'response_cache', ResponseCache(path=str(Path(directory) / 'http.sqlite3'))):
+            self.assertEqual(len(utils.scrape_avito_listings(['офис'], max_pages=1, max_ads=10 ** 6)), 50)
+            # Обычный обход берёт страницу из кэша, инкрементальный всегда идёт в сеть
+            utils.scrape_avito_listings(['офис'], max_pages=1, max_ads=10 ** 6)
+            self.assertEqual(server.requests, 1)
+            ads = utils.scrape_avito_listings(['офис'], max_pages=1, max_ads=10 ** 6, seen_index=SeenItemIndex())
+            self.assertEqual((len(ads), server.requests), (50, 2))
+
+
+class SearchJobQueueTests(TestCase):
+
+    @staticmethod
+    def fetcher(pages):
+        def fetch(keywords, max_ads, on_page):
+            for page, ids in enumerate(pages, start=1):
+                on_page(keywords[0], page, [
+                    {'title': f'Офис {item_id}', 'price': '1 000 ₽', 'item_id': item_id, 'keyword': keywords[0],
+                     'url': f'https://www.avito.ru/moskva/ofis_{item_id}'}
+                    for item_id in ids
+                ])
+        return fetch
+
+    def test_claim_is_exclusive_and_expired_lease_is_taken_over(self):
+        first = jobs.enqueue_search(['офис'])
+        second = jobs.enqueue_search(['склад'])
+        stale = jobs.claim_job('a')
+        self.assertEqual(stale.pk, first.pk)
+        self.assertEqual(jobs.claim_job('b').pk, second.pk)
+        self.assertIsNone(jobs.claim_job('c'))
+
+        SearchJob.objects.filter(pk=first.pk).update(lease_expires_at=timezone.now() - timedelta(seconds=1))
+        job = jobs.claim_job('c')
+        self.assertEqual((job.pk, job.lease_owner, job.attempts), (first.pk, 'c', 2))
+
+        # Воркер, потерявший аренду, не может ни обновить прогресс, ни завершить задание
+        with mock.patch.dict(jobs.FETCHERS, {'scrape': self.fetcher([['1']])}):
+            jobs.process_job(stale, 'a')
+        job.refresh_from_db()
+        self.assertEqual((job.status, job.lease_owner, job.pages_done), (SearchJob.STATUS_RUNNING, 'c', 0))
+
+    def test_job_saves_pages_and_finishes(self):
+        job = jobs.enqueue_search(['офис'], max_ads=3)
+        with mock.patch.dict(jobs.FETCHERS, {'scrape': self.fetcher([['1', '2'], ['3', '4']])}):
+            jobs.process_job(jobs.claim_job('w'), 'w')
+        job.refresh_from_db()
+        self.assertEqual((job.status, job.pages_done, job.ads_found), (SearchJob.STATUS_DONE, 2, 3))
+        self.assertEqual(sorted(job.ads.values_list('item_id', flat=True)), ['1', '2', '3'])
+
+    def test_ad_found_by_two_jobs_stays_in_both(self):
+        first = jobs.enqueue_search(['офис'])
+        second = jobs.enqueue_search(['офис'])
+        with mock.patch.dict(jobs.FETCHERS, {'scrape': self.fetcher([['1', '2']])}):
+            jobs.process_job(jobs.claim_job('w'), 'w')
+        with mock.patch.dict(jobs.FETCHERS, {'scrape': self.fetcher([['2', '3']])}):
+            jobs.process_job(jobs.claim_job('w'), 'w')
+        self.assertEqual(sorted(first.ads.values_list('item_id', flat=True)), ['1', '2'])
+        self.assertEqual(sorted(second.ads.values_list('item_id', flat=True)), ['2', '3'])
+        self.assertEqual(AvitoAd.objects.filter(item_id='2').count(), 1)
+
+    def test_failed_job_is_retried_until_max_attempts(self):
+        def broken(keywords, max_ads, on_page):
+            raise RuntimeError('Avito недоступен')
+
+        job = jobs.enqueue_search(['офис'])
+        with mock.patch.dict(jobs.FETCHERS, {'scrape': broken}):
+            for attempt in range(1, jobs.MAX_ATTEMPTS + 1):
+                jobs.process_job(jobs.claim_job('w'), 'w')
+                job.refresh_from_db()
+                expected = SearchJob.STATUS_FAILED if attempt == jobs.MAX_ATTEMPTS else SearchJob.STATUS_PENDING
+                self.assertEqual((job.status, job.attempts), (expected, attempt))
+        self.assertEqual(job.error, 'Avito недоступен')
+        self.assertIsNone(jobs.claim_job('w'))
+
+
+class ExtractorTests(TestCase):
+    BASE_URL = 'https://www.avito.ru'
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.html = (TESTDATA_DIR / 'search_page.html').read_text(encoding='utf-8')
+
+    def test_engines_return_the_same_listings(self):
+        ads, has_next = extract_listings(self.html, self.BASE_URL, 1, engine='lxml')
+        self.assertEqual((len(ads), has_next), (50, True))
+        self.assertEqual(ads[0], {
+            'title': 'Помещение свободного назначения, 80 м²',
+            'price': '320 000 ₽ в месяц',
+            'url': 'https://www.avito.ru/moskva/kommercheskaya_nedvizhimost/ofis_343_m_3000340563',
+            'item_id': '3000340563',
+        })
+        self.assertEqual(extract_listings(self.html, self.BASE_URL, 1, engine='bs4'), (ads, has_next))
+        # На последней странице пагинации ссылки на следующую нет
+        self.assertFalse(extract_listings(self.html, self.BASE_URL, 7)[1])
+
+    def test_falls_back_to_bs4_when_default_engine_fails(self):
+        def broken(html, base_url, page):
+            raise ValueError('неожиданная разметка')
+
+        with mock.patch.dict(EXTRACTORS, {'lxml': broken}):
+            ads, _ = extract_listings(self.html, self.BASE_URL, 1, engine='lxml')
+        self.assertEqual(len(ads), 50)
+
+
+class ResponseCacheTests(TestCase):
+
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.path = str(Path(directory.name) / 'http.sqlite3')
+
+    def test_expired_entry_is_not_returned(self):
+        cache_ = ResponseCache(path=self.path, ttl=60)
+        with mock.patch('bot.http_cache.time.time', return_value=1000.0):
+            cache_.set('https://www.avito.ru/moskva?q=офис&p=1', 'страница')
+        # Порядок параметров и регистр хоста на ключ не влияют
+        with mock.patch('bot.http_cache.time.time', return_value=1059.0):
+            self.assertEqual(cache_.get('https://WWW.avito.ru/moskva?p=1&q=офис'), 'страница')
+        with mock.patch('bot.http_cache.time.time', return_value=1061.0):
+            self.assertIsNone(cache_.get('https://www.avito.ru/moskva?q=офис&p=1'))
+        self.assertEqual((cache_.hits, cache_.misses), (1, 1))
+
+    def test_least_recently_used_entries_are_evicted(self):
+        # Лимит на байт меньше четырёх записей: при записи четвёртой вытесняется одна
+        bodies = {name: os.urandom(3000).hex() for name in 'abcd'}
+        limit = sum(len(zlib.compress(body.encode('utf-8'))) for body in bodies.values()) - 1
+        cache_ = ResponseCache(path=self.path, ttl=600, max_bytes=limit)
+        with mock.patch('bot.http_cache.time.time', return_value=1000.0) as clock:
+            for name in 'abc':
+                clock.return_value += 1
+                cache_.set(f'https://www.avito.ru/{name}', bodies[name])
+            clock.return_value += 1
+            cache_.get('https://www.avito.ru/a')
+            cache_.set('https://www.avito.ru/d', bodies['d'])
+
+            self.assertIsNone(cache_.get('https://www.avito.ru/b'))
+            self.assertEqual(cache_.get('https://www.avito.ru/a'), bodies['a'])
+            self.assertEqual(cache_.stats()['entries'], 3)
+            self.assertLessEqual(cache_.stats()['bytes'], limit)
+            # Счётчик размера совпадает с суммой записей и после перезаписи существующего ключа
+            cache_.set('https://www.avito.ru/d', 'короткая')
+            total = cache_._connection().execute('SELECT SUM(size) FROM responses').fetchone()[0]
+            self.assertEqual(cache_.stats()['bytes'], total)
+
+
+class SharedClientTests(TestCase):
+
+    def test_threads_share_one_client_and_reuse_connections(self):
+        sessions = []
+
+        def fetch(url):
+            session = http_client.get_client('test')
+            sessions.append(session)
+            for page in range(1, 4):
+                session.get(f'{url}/moskva?p={page}', timeout=5).raise_for_status()
+
+        with FakeAvitoServer() as server, mock.patch.dict(http_client._clients, clear=True), \
+                mock.patch.object(pacing, 'PACING_ENABLED', False):
+            threads = [threading.Thread(target=fetch, args=(server.url,)) for _ in range(4)]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join(10)
+            stats = http_client.pool_stats()['test'][server.url]
+
+        self.assertEqual(len({id(session) for session in sessions}), 1)
+        self.assertEqual(server.requests, 12)
+        # Соединений открыто не больше, чем потоков, остальные запросы идут по уже открытым
+        self.assertEqual(stats['requests'], 12)
+        self.assertLessEqual(stats['opened'], 4)
+        self.assertGreaterEqual(stats['reused'], 8)
+
+
+class LogReaderTests(TestCase):
+
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.path = Path(directory.name) / 'bot.log'
+
+    def write_log(self, path, minutes, level_of=lambda minute: 'INFO'):
+        with open(path, 'w', encoding='utf-8') as f:
+            for minute in minutes:
+                f.write(json.dumps({'time': f'2024-09-18 09:{minute:02d}:00', 'level': level_of(minute),
+                                    'logger': 'bot', 'message': f'запись {minute}'}, ensure_ascii=False) + '\n')
+
+    def read_all(self, **kwargs):
+        pages, before = [], None
+        while True:
+            records, before = logreader.read_log_page(self.path, before=before, **kwargs)
+            pages.append([record_time.minute for record_time, _, _ in records])
+            if before is None:
+                return pages
+
+    def test_pages_continue_into_rotated_backups(self):
+        self.write_log(f'{self.path}.2', range(0, 4))
+        self.write_log(f'{self.path}.1', range(4, 8))
+        self.write_log(self.path, range(8, 10))
+        self.assertEqual(self.read_all(limit=3), [[7, 8, 9], [4, 5, 6], [1, 2, 3], [0]])
+
+    def test_cursor_survives_rotation(self):
+        self.write_log(f'{self.path}.1', range(0, 4))
+        self.write_log(self.path, range(4, 8))
+        records, before = logreader.read_log_page(self.path, limit=3)
+        self.assertEqual([record_time.minute for record_time, _, _ in records], [5, 6, 7])
+
+        # Между страницами лог ротирован: курсор указывает на тот же файл под новым именем
+        os.rename(f'{self.path}.1', f'{self.path}.2')
+        os.rename(self.path, f'{self.path}.1')
+        self.write_log(self.path, range(8, 10))
+        records, before = logreader.read_log_page(self.path, before=before, limit=3)
+        self.assertEqual([record_time.minute for record_time, _, _ in records], [2, 3, 4])
+
+    def test_empty_limit_returns_empty_page_and_same_cursor(self):
+        self.write_log(self.path, range(0, 4))
+        self.assertEqual(logreader.read_log_page(self.path, limit=0), ([], None))
+        records, before = logreader.read_log_page(self.path, limit=2)
+        self.assertEqual(logreader.read_log_page(self.path, before=before, limit=0), ([], before))
+
+    def test_level_and_time_filters(self):
+        self.write_log(f'{self.path}.1', range(0, 10), lambda minute: 'ERROR' if minute % 3 == 0 else 'INFO')
+        self.write_log(self.path, range(10, 20), lambda minute: 'ERROR' if minute % 3 == 0 else 'INFO')
+        self.assertEqual(self.read_all(limit=2, levels={'ERROR'}), [[15, 18], [9, 12], [3, 6], [0]])
+        self.assertEqual(
+            self.read_all(limit=4, since=datetime(2024, 9, 18, 9, 7), until=datetime(2024, 9, 18, 9, 12)),
+            [[9, 10, 11, 12], [7, 8]],
+        )
+
+    def test_view_links_to_older_page(self):
+        self.write_log(self.path, range(0, 3))
+        with override_settings(BOT_LOG_FILE=self.path), mock.patch('bot.views.LOG_PAGE_SIZE', 2):
+            response = self.client.get(reverse('log_view'))
+            content = b''.join(response.streaming_content).decode('utf-8')
+            self.assertIn('запись 2', content)
+            self.assertNotIn('запись 0', content)
+            before = logreader.read_log_page(self.path, limit=2)[1]
+            self.assertIn(f'before={before.replace(":", "%3A")}', content)
+            response = self.client.get(reverse('log_view'), {'before': before})
+            self.assertIn('запись 0', b''.join(response.streaming_content).decode('utf-8'))
+
+
+class QueueingFileHandlerTests(TestCase):
+
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.path = Path(directory.name) / 'bot.log'
+        self.handler = log_handlers.QueueingFileHandler(self.path)
+        self.addCleanup(self.handler.close)
+        self.logger = logging.getLogger('bot.tests.queueing')
+        self.logger.addHandler(self.handler)
+        self.addCleanup(self.logger.removeHandler, self.handler)
+
+    def read(self, path):
+        return [json.loads(line) for line in Path(path).read_text(encoding='utf-8').splitlines()]
+
+    def test_records_are_written_as_json_in_background(self):
+        self.logger.error('Объявлений: %d', 3)
+        try:
+            raise ValueError('сбой')
+        except ValueError:
+            self.logger.exception('Ошибка загрузки')
+        self.handler.close()
+
+        first, second = self.read(self.path)
+        self.assertEqual((first['level'], first['logger'], first['message']),
+                         ('ERROR', 'bot.tests.queueing', 'Объявлений: 3'))
+        self.assertNotIn('exc', first)
+        # Трассировка форматируется до очереди и доходит до файла
+        self.assertIn('ValueError: сбой', second['exc'])
+
+    def test_reopens_file_after_external_rotation(self):
+        self.logger.warning('до ротации')
+        self.handler.listener.stop()
+        self.handler.listener.start()
+        os.rename(self.path, f'{self.path}.1')
+        self.logger.warning('после ротации')
+        self.handler.close()
+
+        self.assertEqual([record['message'] for record in self.read(f'{self.path}.1')], ['до ротации'])
+        self.assertEqual([record['message'] for record in self.read(self.path)], ['после ротации'])
+
+    def test_rotates_by_size_without_logrotate(self):
+        handler = log_handlers.QueueingFileHandler(self.path.with_name('sized.log'), max_bytes=200)
+        self.addCleanup(handler.close)
+        self.logger.removeHandler(self.handler)
+        self.logger.addHandler(handler)
+        self.addCleanup(self.logger.removeHandler, handler)
+        for number in range(5):
+            self.logger.warning('запись %d', number)
+        handler.close()
+
+        # Новые записи — в bot.log, старые — в bot.log.1, bot.log.2, ... (как после logrotate)
+        paths = sorted(self.path.parent.glob('sized.log*'),
+                       key=lambda path: int(path.suffix[1:]) if path.suffix != '.log' else 0, reverse=True)
+        self.assertGreater(len(paths), 1)
+        self.assertEqual([record['message'] for path in paths for record in self.read(path)],
+                         [f'запись {number}' for number in range(5)])
+
+
+class AdminChangelistQueryCountTests(TestCase):
+    """Число запросов на странице списка не должно зависеть от числа строк."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_superuser('admin', 'admin@example.com', 'password')
+
+    def setUp(self):
+        self.client.force_login(self.user)
+
+    def create_rows(self, count):
+        keyword = Keyword.objects.create(word=f"слово {Keyword.objects.count()}")
+        message = Message.objects.create(content='Здравствуйте')
+        start = AvitoAd.objects.count()
+        AvitoAd.objects.bulk_create([
+            AvitoAd(keyword=keyword, item_id=str(start + i), title=f"Офис {i}", description='',
+                    url=f"https://www.avito.ru/x_{start + i}", price=1000 * i)
+            for i in range(count)
+        ])
+        LogEntry.objects.bulk_create([
+            LogEntry(keyword=keyword, message=message, response='ok') for _ in range(count)
+        ])
+
+    def count_queries(self, url):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        return len(queries)
+
+    def test_avitoad_changelist_query_count_is_constant(self):
+        url = reverse('admin:bot_avitoad_changelist')
+        self.create_rows(5)
+        few = self.count_queries(url)
+        self.create_rows(60)
+        self.assertEqual(self.count_queries(url), few)
+
+    def test_logentry_changelist_query_count_is_constant(self):
+        url = reverse('admin:bot_logentry_changelist')
+        self.create_rows(5)
+        few = self.count_queries(url)
+        self.create_rows(60)
+        self.assertEqual(self.count_queries(url), few)
+
+    def test_keyset_cursor_returns_next_page(self):
+        self.create_rows(150)
+        url = reverse('admin:bot_avitoad_changelist')
+        response = self.client.get(url)
+        cl = response.context['cl']
+        first_page = [ad.pk for ad in cl.result_list]
+        self.assertEqual(first_page, sorted(first_page, reverse=True))
+        self.assertIsNotNone(cl.keyset_next_url)
+
+        response = self.client.get(url + cl.keyset_next_url)
+        second_page = [ad.pk for ad in response.context['cl'].result_list]
+        self.assertTrue(second_page)
+        self.assertLess(max(second_page), min(first_page))
+
+    def test_large_table_count_is_estimated(self):
+        self.create_rows(30)
+        original = bot_admin.ESTIMATED_COUNT_THRESHOLD
+        bot_admin.ESTIMATED_COUNT_THRESHOLD = 10
+        try:
+            paginator = bot_admin.EstimatedCountPaginator(AvitoAd.objects.order_by('-pk'), 100)
+            with self.assertNumQueries(1):
+                self.assertEqual(paginator.count, 30)
+        finally:
+            bot_admin.ESTIMATED_COUNT_THRESHOLD = original
+
+
+class FullTextSearchTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        keyword = Keyword.objects.create(word='Офис')
+        AvitoAd.objects.create(keyword=keyword, item_id='1', title='Офисное помещение, 45 м²',
+                               description='Сдаётся <b>офис</b> в центре, отдельный вход', url='https://www.avito.ru/x_1')
+        AvitoAd.objects.create(keyword=keyword, item_id='2', title='Склад, 500 м²',
+                               description='Тёплый склад у трассы', url='https://www.avito.ru/x_2')
+
+    def test_search_matches_word_forms_and_highlights(self):
+        results = search_ads('офисы')
+        self.assertEqual([result['id'] for result in results], [AvitoAd.objects.get(item_id='1').pk])
+        self.assertIn('<mark>Офисное</mark>', results[0]['title'])
+        self.assertIn('&lt;b&gt;', results[0]['snippet'])
+
+    def test_index_follows_updates_and_deletes(self):
+        ad = AvitoAd.objects.get(item_id='2')
+        ad.title = 'Офис на складе'
+        ad.save()
+        self.assertEqual(len(search_ads('офис')), 2)
+        ad.delete()
+        self.assertEqual(len(search_ads('офис')), 1)
+
+
+class JobEventsTests(TestCase):
+
+    def test_stream_resumes_after_last_event_id(self):
+        keyword = Keyword.objects.create(word='офис')
+        job = SearchJob.objects.create(keywords=['офис'], status=SearchJob.STATUS_DONE, pages_done=1, ads_found=3)
+        ads = [
+            AvitoAd.objects.create(keyword=keyword, item_id=str(i), title=f'Офис {i}', description='',
+                                   url=f'https://www.avito.ru/x_{i}', price=1000 * i)
+            for i in range(3)
+        ]
+        # Объявление 0 сохранено раньше остальных, но найдено этим заданием последним
+        links = [JobAd.objects.create(job=job, ad=ads[i]) for i in (1, 2, 0)]
+        response = self.client.get(reverse('job_events', args=[job.pk]), HTTP_LAST_EVENT_ID=str(links[0].pk))
+        self.assertEqual(response['Content-Type'], 'text/event-stream')
+        events = b''.join(response.streaming_content).decode('utf-8').strip().split('\n\n')
+
+        names = [line for event in events for line in event.split('\n') if line.startswith('event: ')]
+        self.assertEqual(names, ['event: ads', 'event: progress', 'event: end'])
+        self.assertTrue(events[0].startswith(f'id: {links[2].pk}\n'))
+        sent = json.loads(events[0].split('data: ', 1)[1])
+        self.assertEqual([ad['id'] for ad in sent], [ads[2].pk, ads[0].pk])
+        self.assertEqual(sent[0]['price'], '2000.00')
+
+
+class MonitorSchedulingTests(TestCase):
+
+    def test_interval_follows_new_ads_rate(self):
+        # 10 новых объявлений в час -> цель в 5 объявлений достигается за полчаса
+        self.assertEqual(monitor.next_interval(3600, 10), 1800)
+        # Без новых объявлений интервал растёт не более чем вдвое и не выходит за пределы
+        self.assertEqual(monitor.next_interval(3600, 0), 7200)
+        self.assertEqual(monitor.next_interval(monitor.MONITOR_MAX_INTERVAL, 0), monitor.MONITOR_MAX_INTERVAL)
+        self.assertEqual(monitor.next_interval(600, 1000), monitor.MONITOR_MIN_INTERVAL)
+
+    def test_overdue_keywords_are_spread_and_claimed_once(self):
+        now = timezone.now()
+        for i in range(4):
+            Keyword.objects.create(word=f'слово {i}', is_active=True, next_run_at=now - timedelta(hours=i))
+        # Слова, созданные поиском, мониторингом не обходятся
+        Keyword.objects.create(word='выключено', next_run_at=now - timedelta(hours=5))
+
+        self.assertEqual(monitor.stagger_overdue(now), 4)
+        runs = sorted(Keyword.objects.filter(is_active=True).values_list('next_run_at', flat=True))
+        self.assertEqual(runs[0], now)
+        self.assertEqual(runs[-1], now + timedelta(seconds=monitor.MONITOR_STARTUP_SPREAD * 3 / 4))
+
+        keyword = monitor.claim_due_keyword(now)
+        self.assertEqual(keyword.word, 'слово 3')
+        self.assertIsNone(monitor.claim_due_keyword(now))
+
+    def test_budget_is_taken_before_each_page_is_requested(self):
+        keyword = Keyword.objects.create(word='офис', is_active=True)
+        with FakeAvitoServer(pages=3) as server, against_server(server), \
+                mock.patch.object(monitor, 'seen_items', SeenItemIndex()):
+            budget = mock.Mock()
+            # Сколько запросов сервер получил к моменту каждого разрешения
+            budget.acquire.side_effect = lambda: granted.append(server.requests)
+            granted = []
+            self.assertEqual(monitor.crawl_keyword(keyword, budget), 150)
+        self.assertEqual(granted, [0, 1, 2])
+        self.assertEqual(server.requests, 3)
+
+
+class KeywordMonitoringMigrationTests(TransactionTestCase):
+
+    def test_existing_keywords_are_not_monitored_after_migration(self):
+        before = [('bot', '0015_logentry_unknown_status')]
+        executor = MigrationExecutor(connection)
+        executor.migrate(before)
+        Keyword = executor.loader.project_state(before).apps.get_model('bot', 'Keyword')
+        Keyword.objects.create(word='Офис')
+        Keyword.objects.create(word='Склад')
+
+        executor = MigrationExecutor(connection)
+        executor.loader.build_graph()
+        executor.migrate(executor.loader.graph.leaf_nodes('bot'))
+        self.assertEqual(set(Keyword.objects.values_list('word', 'is_active')), {('Офис', False), ('Склад', False)})
+
+
+class KeywordUniquenessTests(TransactionTestCase):
+
+    def test_duplicate_keywords_are_merged_by_migration(self):
+        before = [('bot', '0017_enrich_attempts')]
+        executor = MigrationExecutor(connection)
+        executor.migrate(before)
+        apps = executor.loader.project_state(before).apps
+        Keyword, AvitoAd = apps.get_model('bot', 'Keyword'), apps.get_model('bot', 'AvitoAd')
+        old = Keyword.objects.create(word='Офис')
+        monitored = Keyword.objects.create(word='Офис', is_active=True)
+        duplicate_ad = AvitoAd.objects.create(keyword=old, item_id='1', title='Офис', description='', url='https://x/1')
+        AvitoAd.objects.create(keyword=old, item_id='2', title='Офис', description='', url='https://x/2')
+        kept_ad = AvitoAd.objects.create(keyword=monitored, item_id='1', title='Офис', description='', url='https://x/1')
+        job = apps.get_model('bot', 'SearchJob').objects.create(keywords=['Офис'])
+        apps.get_model('bot', 'JobAd').objects.create(job=job, ad=duplicate_ad)
+        apps.get_model('bot', 'LogEntry').objects.create(
+            keyword=old, message=apps.get_model('bot', 'Message').objects.create(content='Здравствуйте!'),
+            item_id='2', response='')
+
+        executor = MigrationExecutor(connection)
+        executor.loader.build_graph()
+        executor.migrate(executor.loader.graph.leaf_nodes('bot'))
+        self.assertEqual(list(Keyword.objects.values_list('pk', flat=True)), [monitored.pk])
+        self.assertEqual(sorted(AvitoAd.objects.filter(keyword=monitored.pk).values_list('item_id', flat=True)),
+                         ['1', '2'])
+        self.assertEqual(list(JobAd.objects.values_list('ad_id', flat=True)), [kept_ad.pk])
+        self.assertEqual(list(LogEntry.objects.values_list('keyword_id', flat=True)), [monitored.pk])
+
+    def test_keyword_created_concurrently_is_reused(self):
+        bulk_create = Keyword.objects.bulk_create
+
+        # Другой поиск создаёт то же слово между выборкой и вставкой
+        def bulk_create_after_other_search(*args, **kwargs):
+            Keyword.objects.create(word='Офис')
+            return bulk_create(*args, **kwargs)
+
+        with mock.patch.object(Keyword.objects, 'bulk_create', bulk_create_after_other_search):
+            keywords = resolve_keywords(['Офис', 'Склад'])
+        self.assertEqual(set(keywords), {'Офис', 'Склад'})
+        self.assertEqual(Keyword.objects.count(), 2)
+        self.assertEqual(keywords['Офис'].pk, Keyword.objects.get(word='Офис').pk)
+
+
+class MetricsTests(TestCase):
+
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        for patcher in (
+            mock.patch.object(metrics, 'METRICS_DIR', Path(directory.name)),
+            mock.patch.object(metrics, 'registry', metrics.MetricsRegistry()),
+        ):
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def test_snapshots_of_all_processes_are_summed(self):
+        other = metrics.MetricsRegistry()
+        other.inc('bot_http_requests_total', {'host': 'www.avito.ru', 'status': '200'}, 3)
+        other.observe('bot_parse_seconds', 0.02, {'engine': 'lxml'})
+        other.set('bot_pacing_allowed_rate', 1.5, {'host': 'www.avito.ru'})
+        (metrics.METRICS_DIR / '1-1.json').write_text(json.dumps(other.snapshot()), encoding='utf-8')
+
+        metrics.inc('bot_http_requests_total', {'host': 'www.avito.ru', 'status': '200'}, 2)
+        metrics.observe('bot_parse_seconds', 2, {'engine': 'lxml'})
+        metrics.set_gauge('bot_pacing_allowed_rate', 0.5, {'host': 'www.avito.ru'})
+        response = self.client.get(reverse('metrics'))
+        text = response.content.decode('utf-8')
+
+        self.assertEqual(response.status_code, 200)
+        self.assertIn('bot_http_requests_total{host="www.avito.ru",status="200"} 5', text)
+        self.assertIn('bot_parse_seconds_bucket{engine="lxml",le="0.025"} 1', text)
+        self.assertIn('bot_parse_seconds_bucket{engine="lxml",le="+Inf"} 2', text)
+        self.assertIn('# TYPE bot_parse_seconds histogram', text)
+        self.assertIn('bot_pacing_allowed_rate{host="www.avito.ru"} 2.0', text)
+
+    def test_counters_of_finished_processes_are_kept(self):
+        finished = metrics.MetricsRegistry()
+        finished.inc('bot_persist_rows_total', value=7)
+        finished.observe('bot_parse_seconds', 0.02, {'engine': 'lxml'})
+        path = metrics.METRICS_DIR / '1-1.json'
+        path.write_text(json.dumps(finished.snapshot()), encoding='utf-8')
+        old = time.time() - metrics.METRICS_RETENTION - 1
+        os.utime(path, (old, old))
+        metrics.inc('bot_persist_rows_total', value=1)
+
+        with mock.patch.object(metrics, 'RETIRED_GRACE', -1):
+            for _ in range(3):
+                _, counters, histograms, _ = metrics.collect()
+                self.assertEqual(counters[('bot_persist_rows_total', ())], 8)
+                self.assertEqual(histograms[('bot_parse_seconds', (('engine', 'lxml'),))]['count'], 1)
+        # Снимок сложен в общий файл завершившихся процессов и удалён
+        self.assertFalse(path.exists())
+        self.assertTrue((metrics.METRICS_DIR / metrics.RETIRED_FILE).exists())
+
+
+class WriteQueueTests(TransactionTestCase):
+
+    def test_operations_are_grouped_and_failures_isolated(self):
+        writer = WriteQueue(linger=0.05)
+
+        def fail():
+            SeenItem.objects.create(query='q', location='rossiya', item_id='2')
+            raise ValueError('ошибка')
+
+        futures = [
+            writer.submit(SeenItem.objects.create, query='q', location='rossiya', item_id='1'),
+            writer.submit(fail),
+            writer.submit(SeenItem.objects.create, query='q', location='rossiya', item_id='3'),
+        ]
+        self.assertEqual(futures[0].result().item_id, '1')
+        with self.assertRaises(ValueError):
+            futures[1].result()
+        futures[2].result()
+
+        self.assertEqual(writer.batches, 1)
+        self.assertEqual(sorted(SeenItem.objects.values_list('item_id', flat=True)), ['1', '3'])
+
+
+class ArchiveTests(TestCase):
+
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.root = Path(directory.name)
+        patcher = mock.patch.object(archive, 'ARCHIVE_CHUNK_PAUSE', 0)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_old_rows_move_to_partitions_and_scan_back(self):
+        keyword = Keyword.objects.create(word='офис')
+        for i in range(5):
+            AvitoAd.objects.create(keyword=keyword, item_id=str(i), title=f'Офис {i}', description='',
+                                   url=f'https://www.avito.ru/x_{i}', price=1000 + i)
+        job = SearchJob.objects.create(keywords=['офис'])
+        job.ads.add(AvitoAd.objects.get(item_id='0'))
+        # created_at заполняется автоматически, поэтому состариваем строки отдельным запросом
+        AvitoAd.objects.filter(item_id__in=['0', '1', '2']).update(created_at=timezone.now() - timedelta(days=400))
+
+        moved = archive.archive_table('ads', older_than_days=180, chunk_size=2, root=self.root)
+
+        self.assertEqual(moved, 3)
+        self.assertEqual(sorted(AvitoAd.objects.values_list('item_id', flat=True)), ['3', '4'])
+        rows = list(archive.scan_archive('ads', keyword_ids=[keyword.pk], root=self.root))
+        self.assertEqual([row['item_id'] for row in rows], ['0', '1', '2'])
+        self.assertEqual((rows[0]['keyword'], rows[0]['price']), ('офис', '1000.00'))
+        # В архив попадают все столбцы объявления, кроме подписи MinHash, и задания, которые его нашли
+        self.assertEqual(set(rows[0]) - {'keyword', 'job_ids'},
+                         {field.attname for field in AvitoAd._meta.concrete_fields} - {'minhash'})
+        self.assertEqual((rows[0]['job_ids'], rows[1]['job_ids']), ([job.pk], []))
+        self.assertEqual(list(archive.scan_archive('ads', since=timezone.now().date(), root=self.root)), [])
+        self.assertEqual(list(archive.scan_archive('ads', keyword_ids=[keyword.pk + 1], root=self.root)), [])
+
+
+class PriceAnalyticsTests(TestCase):
+
+    def test_prices_are_normalized_with_units_and_periods(self):
+        values, periods = normalize_prices(
+            ['1 200 000 ₽', '85 000 ₽ в месяц', '1,5 млн ₽', '2 500 ₽ за сутки', 'Не указано', '900 ₽ за м²'])
+        self.assertEqual(values[:4].tolist(), [1200000, 85000, 1500000, 75000])
+        self.assertTrue(values[4] != values[4])
+        self.assertEqual(periods.tolist(), ['', 'month', '', 'month', '', 'sqm'])
+        # Пакет разбирается одной строкой: пустые тексты и переводы строк не сдвигают цены
+        values, _ = normalize_prices(['', None, 'цена\n320\xa0000,50 ₽', '7'])
+        self.assertEqual(values[2:].tolist(), [320000.5, 7])
+        self.assertTrue(values[0] != values[0] and values[1] != values[1])
+
+    def test_rollups_follow_ingest_and_view_reads_only_rollups(self):
+        ads = [
+            {'title': f'Офис {i}', 'price': f'{price} ₽ в месяц', 'item_id': str(i), 'keyword': 'офис',
+             'url': f'https://www.avito.ru/moskva/kommercheskaya_nedvizhimost/ofis_{i}'}
+            for i, price in enumerate([50000, 60000, 70000, 80000, 9000000])
+        ]
+        ingest_ads(ads)
+        rollup = PriceRollup.objects.get()
+        self.assertEqual((rollup.region, rollup.price_period, rollup.count), ('moskva', 'month', 5))
+        self.assertEqual((rollup.min_price, rollup.median_price), (50000, 70000))
+        # Выброс в 9 млн отсечён до Q3 + 3·IQR = 140 000
+        self.assertEqual(rollup.mean_price, 80000)
+
+        ingest_ads([dict(ads[0], price='55 000 ₽ в месяц')])
+        self.assertEqual(PriceRollup.objects.get().min_price, 55000)
+
+        # Объявление сменило период цены: пересчитываются и новая группа, и та, из которой оно ушло
+        ingest_ads([dict(ads[0], price='5 000 000 ₽')])
+        self.assertEqual(sorted(PriceRollup.objects.values_list('price_period', 'count')), [('', 1), ('month', 4)])
+        ingest_ads([dict(ads[0], price='55 000 ₽ в месяц')])
+
+        # Сводки других дней не пересчитываются
+        AvitoAd.objects.filter(item_id='4').update(created_at=timezone.now() - timedelta(days=3))
+        rebuild_rollups()
+        old = PriceRollup.objects.get(count=1)
+        ingest_ads([dict(ads[1], price='65 000 ₽ в месяц')])
+        self.assertEqual(PriceRollup.objects.get(count=1).updated_at, old.updated_at)
+        self.assertEqual(PriceRollup.objects.get(count=4).median_price, 67500)
+
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(reverse('analytics'), {'region': 'moskva'})
+        self.assertContains(response, '67500')
+        self.assertFalse([query for query in queries if 'bot_avitoad' in query['sql']])
+
+
+class DedupTests(TestCase):
+    DESCRIPTION = ('Сдаётся офис 45 м² в бизнес-центре класса B, отдельный вход, свежий ремонт, '
+                   'кондиционеры, охрана и парковка, пять минут пешком от метро Белорусская.')
+
+    def test_near_duplicates_share_cluster_across_keywords(self):
+        ingest_ads([
+            {'title': 'Офис 45 м² у метро', 'description': self.DESCRIPTION, 'item_id': '1', 'keyword': 'Офис',
+             'url': 'https://www.avito.ru/moskva/ofis_1', 'price': '90 000 ₽'},
+            {'title': 'Офис 45 м² у метро', 'description': self.DESCRIPTION, 'item_id': '1',
+             'keyword': 'Аренда офиса', 'url': 'https://www.avito.ru/moskva/ofis_1', 'price': '90 000 ₽'},
+        ])
+        # Перевыложенное объявление с небольшой правкой текста и другое объявление
+        ingest_ads([
+            {'title': 'Офис 45 м² рядом с метро', 'description': self.DESCRIPTION.replace('свежий', 'хороший'),
+             'item_id': '2', 'keyword': 'Офисные помещения', 'url': 'https://www.avito.ru/moskva/ofis_2'},
+            {'title': 'Склад 300 м²', 'description': 'Тёплый склад с пандусом и высокими потолками в Подольске.',
+             'item_id': '3', 'keyword': 'Офис', 'url': 'https://www.avito.ru/moskva/sklad_3'},
+        ])
+        # Кластеры считаются только после обогащения объявлений
+        self.assertEqual(dedup.assign_pending(), (0, 0))
+        AvitoAd.objects.update(enriched_at=timezone.now())
+        self.assertEqual(dedup.assign_pending(), (4, 2))
+        self.assertEqual(dedup.assign_pending(), (0, 0))
+        clusters = dict(AvitoAd.objects.values_list('item_id', 'cluster_id').order_by('pk'))
+        first = AvitoAd.objects.order_by('pk').first()
+        self.assertEqual(clusters['1'], first.pk)
+        self.assertEqual(clusters['2'], first.pk)
+        self.assertNotEqual(clusters['3'], first.pk)
+        self.assertEqual(AvitoAd.objects.filter(cluster_id=first.pk).count(), 3)
+
+        cluster_id, score = dedup.find_similar('Офис 45 м² у метро', self.DESCRIPTION)
+        self.assertEqual((cluster_id, score), (first.pk, 1.0))
+
+        self.assertEqual(dedup.rebuild_index(chunk_size=2), (4, 2))
+        self.assertEqual(dict(AvitoAd.objects.values_list('item_id', 'cluster_id').order_by('pk')), clusters)
+
+
+class QueryPlannerTests(TestCase):
+    RESULTS = {
+        'офис': [['1', '2'], ['3']],
+        'аренда офиса': [['3', '4']],
+        'склад': [['5']],
+    }
+
+    def setUp(self):
+        self.calls = []
+        self.release = threading.Event()
+
+        def fake_scrape(keyword_list, max_ads, on_page, **kwargs):
+            self.calls.append(keyword_list[0])
+            # Загрузка «идёт», пока тест не отпустит её: второй поиск должен к ней присоединиться
+            self.release.wait(5)
+            for page, ids in enumerate(self.RESULTS[keyword_list[0]], start=1):
+                on_page(keyword_list[0], page, [{'item_id': item_id, 'keyword': keyword_list[0]} for item_id in ids])
+
+        patcher = mock.patch.object(planner, 'scrape_avito_listings', fake_scrape)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.planner = planner.QueryPlanner(workers=4, reuse_seconds=60)
+
+    def test_overlapping_searches_share_units_and_merge_by_item_id(self):
+        results = {}
+
+        def search(name, keywords):
+            results[name] = self.planner.search(keywords, max_ads=10)
+
+        threads = [
+            threading.Thread(target=search, args=('first', ['Офис', 'Аренда офиса'])),
+            threading.Thread(target=search, args=('second', ['офис ', 'Склад', 'ОФИС'])),
+        ]
+        for thread in threads:
+            thread.start()
+        self.release.set()
+        for thread in threads:
+            thread.join(5)
+
+        self.assertEqual(sorted(self.calls), ['аренда офиса', 'офис', 'склад'])
+        self.assertEqual([(ad['item_id'], ad['keyword']) for ad in results['first']],
+                         [('1', 'Офис'), ('2', 'Офис'), ('3', 'Офис'), ('4', 'Аренда офиса')])
+        self.assertEqual([ad['item_id'] for ad in results['second']], ['1', '2', '3', '5'])
+
+        # Недавно завершённая единица отдаётся без нового обхода
+        pages = []
+        self.planner.search(['Аренда офиса'], max_ads=10, on_page=lambda word, page, ads: pages.append(len(ads)))
+        self.assertEqual((len(self.calls), pages), (3, [2]))
+
+
+class EnrichTests(TestCase):
+
+    def test_new_ads_are_enriched_once_per_item(self):
+        with FakeAvitoServer() as server, tempfile.TemporaryDirectory() as directory, \
+                mock.patch.object(pacing, 'PACING_ENABLED', False), \
+                mock.patch.object(utils, 'response_cache', ResponseCache(path=str(Path(directory) / 'http.sqlite3'))):
+            ingest_ads([
+                {'title': 'Офис, 343 м²', 'item_id': '3000000001', 'keyword': 'Офис',
+                 'url': f'{server.url}/moskva/kommercheskaya_nedvizhimost/ofis_3000000001'},
+                {'title': 'Офис, 343 м²', 'item_id': '3000000001', 'keyword': 'Аренда офиса',
+                 'url': f'{server.url}/moskva/kommercheskaya_nedvizhimost/ofis_3000000001'},
+                {'title': 'Склад', 'item_id': '3000000002', 'keyword': 'Офис',
+                 'url': f'{server.url}/moskva/kommercheskaya_nedvizhimost/sklad_3000000002'},
+            ])
+            self.assertEqual(enrich.enrich_pending(workers=2), 2)
+            # Страница загружается один раз на item_id и кэшируется по нему
+            self.assertEqual(server.requests, 2)
+            self.assertIsNotNone(utils.response_cache.get('', key=enrich.detail_cache_key('3000000001')))
+            # Уже обогащённые объявления повторно не загружаются
+            self.assertEqual(enrich.enrich_pending(), 0)
+            self.assertEqual(server.requests, 2)
+            # Проход обогащения распределяет обогащённые объявления по кластерам
+            enrich.enrich_loop(threading.Event(), once=True)
+            self.assertEqual(server.requests, 2)
+
+        self.assertFalse(AvitoAd.objects.filter(enriched_at__isnull=True).exists())
+        for ad in AvitoAd.objects.filter(item_id='3000000001'):
+            self.assertEqual(ad.seller_id, 'b5c1e0f2a7d94e3c8a6f1b2d3e4f5a6b')
+            self.assertEqual(ad.seller_name, 'ООО «Бизнес Парк»')
+            self.assertEqual(ad.address, 'Москва, Пресненская наб., 12')
+            self.assertEqual(ad.published_at.isoformat(), '2026-10-17T06:15:00+00:00')
+            self.assertEqual(ad.description, 'Сдаётся офис 343 м² в бизнес-центре класса А.\n'
+                                             'Отдельный вход, парковка, круглосуточная охрана.')
+        # Описание попадает в полнотекстовый индекс
+        self.assertEqual(len(search_ads('круглосуточная охрана')), 3)
+        clusters = set(AvitoAd.objects.filter(item_id='3000000001').values_list('cluster_id', flat=True))
+        self.assertEqual(len(clusters), 1)
+        self.assertIsNotNone(clusters.pop())
+
+    def test_failing_items_are_retried_with_backoff_and_then_skipped(self):
+        ingest_ads([
+            {'title': 'Офис', 'item_id': '3000000001', 'keyword': 'Офис',
+             'url': 'https://www.avito.ru/moskva/ofis_3000000001'},
+            {'title': 'Офис', 'item_id': '3000000001', 'keyword': 'Аренда офиса',
+             'url': 'https://www.avito.ru/moskva/ofis_3000000001'},
+        ])
+        failure = requests.exceptions.ConnectionError('Connection refused')
+        with mock.patch.object(enrich, 'ENRICH_MAX_ATTEMPTS', 2), \
+                mock.patch.object(enrich, 'fetch_details', side_effect=failure) as fetch:
+            started = timezone.now()
+            self.assertEqual(enrich.enrich_pending(), 0)
+            for ad in AvitoAd.objects.all():
+                self.assertEqual(ad.enrich_attempts, 1)
+                self.assertGreaterEqual(ad.enrich_retry_at, started + timedelta(seconds=enrich.ENRICH_RETRY_DELAY))
+            # До срока повтора объявление не загружается
+            self.assertEqual(enrich.pending_items(), {})
+
+            AvitoAd.objects.update(enrich_retry_at=timezone.now())
+            self.assertEqual(enrich.enrich_pending(), 0)
+            self.assertEqual(fetch.call_count, 2)
+            self.assertEqual(set(AvitoAd.objects.values_list('enrich_attempts', 'enrich_retry_at')), {(2, None)})
+
+            # Исчерпавшее попытки объявление не занимает место в пакете новых
+            ingest_ads([{'title': 'Склад', 'item_id': '3000000002', 'keyword': 'Офис',
+                         'url': 'https://www.avito.ru/moskva/sklad_3000000002'}])
+            self.assertEqual(list(enrich.pending_items(limit=1)), ['3000000002'])
+        # Кластеры считаются и для объявлений, которые уже не обогатятся
+        self.assertEqual(dedup.assign_pending(), (2, 1))
+
+
+class PacingTests(TestCase):
+
+    def test_rate_grows_on_success_and_backs_off_on_throttling(self):
+        pacer = pacing.HostPacer('www.avito.ru', shared=False)
+        pacer.record(200, 0.1)
+        grown = pacing.PACING_INITIAL_RATE + pacing.PACING_INCREASE
+        self.assertAlmostEqual(pacer.rate, grown)
+
+        started = time.time()
+        pacer.record(429, 0.1, retry_after=pacing.parse_retry_after('30'))
+        backed_off = pacer.rate
+        self.assertAlmostEqual(backed_off, grown * pacing.PACING_BACKOFF)
+        self.assertGreaterEqual(pacer.blocked_until, started + 30)
+
+        # После первого снижения рост аддитивный; ошибка сразу после снижения частоту не трогает
+        pacer.record(200, 0.1)
+        self.assertAlmostEqual(pacer.rate, backed_off + pacing.PACING_INCREASE)
+        pacer.record(503, 0.1)
+        self.assertAlmostEqual(pacer.rate, backed_off + pacing.PACING_INCREASE)
+
+        stop_event = threading.Event()
+        stop_event.set()
+        self.assertFalse(pacer.wait(stop_event))
+
+    def test_rate_is_capped_and_blocks_count_as_throttling(self):
+        pacer = pacing.HostPacer('www.avito.ru', shared=False)
+        for _ in range(100):
+            pacer.record(200, 0.1)
+        self.assertEqual(pacer.rate, pacing.PACING_MAX_RATE)
+
+        pacer.record(403, 0.1)
+        self.assertAlmostEqual(pacer.rate, pacing.PACING_MAX_RATE * pacing.PACING_BACKOFF)
+        pacer.last_decrease = 0.0
+        pacer.record(200, 0.1, captcha=True)
+        self.assertAlmostEqual(pacer.rate, pacing.PACING_MAX_RATE * pacing.PACING_BACKOFF ** 2)
+
+    def test_captcha_page_is_retried_and_not_cached(self):
+        with FakeAvitoServer(captchas=1) as server, tempfile.TemporaryDirectory() as directory, \
+                mock.patch.object(pacing, 'PACING_ENABLED', False), \
+                mock.patch.object(utils, 'response_cache', ResponseCache(path=str(Path(directory) / 'http.sqlite3'))):
+            url = f'{server.url}/moskva/nedvizhimost?q=ofis'
+            with mock.patch.object(pacing, 'record_response') as record:
+                html = utils.fetch_page(utils.get_session_with_retries(), url, {}, threading.Event())
+            self.assertEqual(server.requests, 2)
+            self.assertTrue(extract_listings(html, server.url, 1)[0])
+            self.assertEqual([call.kwargs['captcha'] for call in record.call_args_list], [True, False])
+
+            server.captchas = utils.THROTTLED_RETRIES + 1
+            with self.assertRaises(requests.exceptions.HTTPError):
+                utils.fetch_page(utils.get_session_with_retries(), f'{url}&p=2', {}, threading.Event())
+            self.assertIsNone(utils.response_cache.get(f'{url}&p=2', {}))
+
+    @override_settings(CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}})
+    def test_backoff_and_retry_after_are_shared_between_processes(self):
+        first = pacing.HostPacer('www.avito.ru', owner='first')
+        second = pacing.HostPacer('www.avito.ru', owner='second')
+        first.sync()
+        second.sync()
+        self.assertEqual(second.processes, 2)
+
+        first.record(429, 0.1, retry_after=60)
+        second.sync(force=True)
+        self.assertEqual(second.rate, first.rate)
+        self.assertEqual(second.blocked_until, first.blocked_until)
+        self.assertAlmostEqual(second.interval(), 2 / first.rate)
+
+
+API_TESTDATA_DIR = Path(__file__).resolve().parent / 'testdata' / 'api'
+
+
+class RecordedApiHandler(BaseHTTPRequestHandler):
+    """Отдаёт записанные ответы Avito API из testdata/api."""
+
+    def _send_json(self, status, path):
+        body = path.read_bytes() if path else b'{}'
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    sent_messages = []
+    # Код ответа на отправку сообщения
+    message_status = 200
+
+    def do_POST(self):
+        if self.path == '/token':
+            self._send_json(200, API_TESTDATA_DIR / 'token.json')
+        elif self.path.startswith('/messenger/v1/accounts/42/chats/'):
+            length = int(self.headers.get('Content-Length', 0))
+            self.sent_messages.append((self.path, json.loads(self.rfile.read(length))))
+            self._send_json(self.message_status, None)
+        else:
+            self._send_json(404, None)
+
+    def do_GET(self):
+        url = urlsplit(self.path)
+        if url.path == '/core/v1/accounts/self':
+            return self._send_json(200, API_TESTDATA_DIR / 'account.json')
+        if url.path == '/messenger/v2/accounts/42/chats':
+            return self._send_json(200, API_TESTDATA_DIR / 'chats.json')
+        if url.path != '/core/v1/items':
+            return self._send_json(404, None)
+        if self.headers.get('Authorization') != 'Bearer test-access-token':
+            return self._send_json(403, None)
+        page = parse_qs(url.query).get('page', ['1'])[0]
+        path = API_TESTDATA_DIR / f'items_page{page}.json'
+        self._send_json(200, path if path.exists() else API_TESTDATA_DIR / 'items_empty.json')
+
+    def log_message(self, format, *args):
+        pass
+
+
+@override_settings(CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}})
+class AvitoApiFetcherTests(TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.server = ThreadingHTTPServer(('127.0.0.1', 0), RecordedApiHandler)
+        threading.Thread(target=cls.server.serve_forever, daemon=True).start()
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.server.shutdown()
+        cls.server.server_close()
+        super().tearDownClass()
+
+    def setUp(self):
+        base_url = f'http://127.0.0.1:{self.server.server_port}'
+        for patcher in (
+            mock.patch.object(utils, 'AVITO_API_BASE_URL', base_url),
+            mock.patch.object(pacing, 'PACING_ENABLED', False),
+            mock.patch.object(token_manager, 'start_background_refresh', lambda: None),
+        ):
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def test_fetches_pages_and_returns_scraper_structure(self):
+        ads = fetch_api_listings(['Аренда офиса', 'Продажа офиса'], max_ads=10, per_page=3)
+        self.assertEqual([ad['item_id'] for ad in ads], ['3402517731', '3410022874', '3415570013'])
+        self.assertEqual(ads[0], {
+            'title': 'Аренда офиса 45 м² у метро Белорусская',
+            'price': '85 000 ₽',
+            'url': 'https://www.avito.ru/moskva/kommercheskaya_nedvizhimost/arenda_ofisa_45_m_3402517731',
+            'item_id': '3402517731',
+            'keyword': 'Аренда офиса',
+        })
+        self.assertEqual(ads[2]['price'], 'Не указано')
+
+    def test_stops_at_max_ads(self):
+        ads = fetch_api_listings(['офис'], max_ads=1, per_page=3)
+        self.assertEqual(len(ads), 1)
+
+    def test_dispatch_sends_once_per_ad(self):
+        RecordedApiHandler.sent_messages.clear()
+        keyword = Keyword.objects.create(word='офис')
+        message = Message.objects.create(content='Здравствуйте! Объявление ещё актуально?')
+        AvitoAd.objects.create(keyword=keyword, item_id='3402517731', title='Офис', description='',
+                               url='https://www.avito.ru/x_3402517731')
+        AvitoAd.objects.create(keyword=keyword, item_id='3410022874', title='Офис', description='',
+                               url='https://www.avito.ru/x_3410022874')
+
+        counts = dispatch_message(message, AvitoAd.objects.all())
+        self.assertEqual((counts[LogEntry.STATUS_SENT], counts[LogEntry.STATUS_SKIPPED]), (1, 1))
+        self.assertEqual(RecordedApiHandler.sent_messages, [(
+            '/messenger/v1/accounts/42/chats/u2i-chat-1/messages',
+            {'message': {'text': message.content}, 'type': 'text'},
+        )])
+
+        # Повторная рассылка того же сообщения ничего не отправляет
+        dispatch_message(message, AvitoAd.objects.all())
+        self.assertEqual(len(RecordedApiHandler.sent_messages), 1)
+        self.assertEqual(LogEntry.objects.count(), 2)
+
+    def test_send_without_answer_is_not_retried(self):
+        RecordedApiHandler.sent_messages.clear()
+        keyword = Keyword.objects.create(word='офис')
+        AvitoAd.objects.create(keyword=keyword, item_id='3402517731', title='Офис', description='',
+                               url='https://www.avito.ru/x_3402517731')
+
+        # 5xx: сообщение могло дойти, поэтому POST не повторяется ни клиентом, ни новой рассылкой
+        unknown = Message.objects.create(content='Здравствуйте!')
+        with mock.patch.object(RecordedApiHandler, 'message_status', 502):
+            counts = dispatch_message(unknown, AvitoAd.objects.all())
+            self.assertEqual(counts[LogEntry.STATUS_UNKNOWN], 1)
+            dispatch_message(unknown, AvitoAd.objects.all())
+        self.assertEqual(len(RecordedApiHandler.sent_messages), 1)
+
+        # 4xx: API отклонил запрос, повторная рассылка отправляет снова
+        rejected = Message.objects.create(content='Добрый день!')
+        with mock.patch.object(RecordedApiHandler, 'message_status', 400):
+            self.assertEqual(dispatch_message(rejected, AvitoAd.objects.all())[LogEntry.STATUS_FAILED], 1)
+        self.assertEqual(dispatch_message(rejected, AvitoAd.objects.all())[LogEntry.STATUS_SENT], 1)
+        self.assertEqual(len(RecordedApiHandler.sent_messages), 3)
+
+    def test_outcomes_are_recorded_per_chunk(self):
+        keyword = Keyword.objects.create(word='офис')
+        message = Message.objects.create(content='Здравствуйте!')
+        for item_id in ('1', '2', '3'):
+            AvitoAd.objects.create(keyword=keyword, item_id=item_id, title='Офис', description='',
+                                   url=f'https://www.avito.ru/x_{item_id}')
+
+        # Процесс падает на второй отправке: первая уже записана, третья не захвачена
+        chats = {item_id: f'chat-{item_id}' for item_id in ('1', '2', '3')}
+        with mock.patch.object(messenger, 'OUTCOME_CHUNK_SIZE', 1), \
+                mock.patch.object(messenger, 'resolve_chats', return_value=chats), \
+                mock.patch.object(messenger, 'send_message', side_effect=['{}', KeyboardInterrupt()]):
+            with self.assertRaises(KeyboardInterrupt):
+                dispatch_message(message, AvitoAd.objects.all())
+        self.assertEqual(sorted(LogEntry.objects.values_list('status', flat=True)),
+                         [LogEntry.STATUS_PENDING, LogEntry.STATUS_SENDING, LogEntry.STATUS_SENT])
+
+    def test_rate_limit_is_shared_between_processes(self):
+        first = messenger.RateLimiter(300, shared_key='avito_messenger_rate:test', owner='first')
+        second = messenger.RateLimiter(300, shared_key='avito_messenger_rate:test', owner='second')
+        first.sync()
+        second.sync()
+        first.synced_at = None
+        first.sync()
+        self.assertEqual((first.processes, second.processes), (2, 2))
+        self.assertAlmostEqual(first.rate + second.rate, 300 / 60.0)
+
+
+class BenchHarnessTests(TestCase):
+
+    def test_scrape_against_fake_server_walks_all_pages(self):
+        with FakeAvitoServer(pages=3) as server:
+            result = bench_scrape(server, queries=2, max_pages=5)
+        # 50 объявлений на странице, id уникальны для каждой страницы
+        self.assertEqual((result['pages'], result['ads']), (6, 300))
+
+    def test_thresholds_report_regressions(self):
+        thresholds = {'scrape': {'pages_per_sec': {'min': 20}}, 'parse': {'ms_per_page': {'max': 5}}}
+        results = {'scrape': {'pages_per_sec': 10.0}, 'parse': {'ms_per_page': 4.2}}
+        self.assertEqual(check_thresholds(results, thresholds), ['scrape.pages_per_sec = 10.0 < 20'])
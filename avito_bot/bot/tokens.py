@@ -0,0 +1,133 @@
+"""Общий для процесса и всех воркеров менеджер токена доступа Avito API.
+
+Токен хранится в кэше Django (см. settings.CACHES), поэтому им пользуются все
+процессы и все сессии пользователей. Обновление выполняется по принципу
+single-flight: запрос POST /token делает только владелец блокировки,
+остальные вызывающие ждут, пока в кэше появится свежий токен. Блокировка —
+строка в БД (bot.leases), а не cache.add: у файлового кэша add не атомарен,
+и два процесса могли бы обновить токен одновременно.
+Фоновый поток обновляет токен заранее, до наступления TOKEN_REFRESH_BUFFER,
+поэтому обработчики запросов почти никогда не ждут сети.
+"""
+import logging
+import threading
+import time
+import uuid
+
+from django.core.cache import cache
+
+from . import leases, metrics
+from .utils import get_avito_token, TOKEN_REFRESH_BUFFER
+
+logger = logging.getLogger(__name__)
+
+TOKEN_CACHE_KEY = 'avito:access_token'
+LOCK_NAME = 'avito:access_token'
+
+# Время жизни блокировки обновления: таймаут POST /token (120 с) плюс задержка перед запросом
+LOCK_TIMEOUT = 180
+# Фоновое обновление начинается ещё за столько секунд до TOKEN_REFRESH_BUFFER
+PROACTIVE_REFRESH_LEAD = TOKEN_REFRESH_BUFFER
+# Пауза перед повторной попыткой, если обновить токен не удалось
+RETRY_INTERVAL = 60
+# Период опроса кэша, пока токен обновляет другой процесс
+WAIT_POLL_INTERVAL = 0.5
+
+
+class TokenManager:
+    """Хранит токен в общем кэше и обновляет его не более чем одним вызывающим одновременно."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._thread_lock = threading.Lock()
+        self._thread = None
+
+    @staticmethod
+    def _seconds_left(entry):
+        """Сколько секунд токен ещё считается действительным (с учётом TOKEN_REFRESH_BUFFER)."""
+        if not entry or not entry.get('access_token'):
+            return 0
+        return entry['expires_at'] - TOKEN_REFRESH_BUFFER - time.time()
+
+    def _store(self, entry):
+        timeout = max(int(entry['expires_at'] - time.time()), 1)
+        cache.set(TOKEN_CACHE_KEY, entry, timeout)
+
+    def get_cached(self):
+        """Возвращает токен из кэша, если он ещё действителен, не обращаясь к сети."""
+        entry = cache.get(TOKEN_CACHE_KEY)
+        if self._seconds_left(entry) > 0:
+            return entry['access_token']
+        return None
+
+    def refresh(self, lead=0, wait_timeout=LOCK_TIMEOUT):
+        """Обновляет токен, если до истечения осталось меньше lead секунд.
+
+        Сетевой запрос выполняет только один вызывающий во всех процессах;
+        остальные ждут появления свежего токена в кэше не дольше wait_timeout.
+        Возвращает запись токена или None.
+        """
+        with self._lock:
+            deadline = time.time() + wait_timeout
+            while True:
+                entry = cache.get(TOKEN_CACHE_KEY)
+                if self._seconds_left(entry) > lead:
+                    return entry
+
+                owner = uuid.uuid4().hex
+                if leases.acquire(LOCK_NAME, owner, LOCK_TIMEOUT):
+                    try:
+                        # Другой процесс мог обновить токен и освободить блокировку после нашей проверки
+                        entry = cache.get(TOKEN_CACHE_KEY)
+                        if self._seconds_left(entry) > lead:
+                            return entry
+                        logger.info("Получение нового access_token...")
+                        new_entry = get_avito_token()
+                        if new_entry:
+                            self._store(new_entry)
+                            return new_entry
+                        return entry if self._seconds_left(entry) > 0 else None
+                    finally:
+                        leases.release(LOCK_NAME, owner)
+
+                # Токен обновляет другой процесс — ждём результата
+                if time.time() >= deadline:
+                    logger.error("Не дождались обновления access_token другим процессом")
+                    return entry if self._seconds_left(entry) > 0 else None
+                time.sleep(WAIT_POLL_INTERVAL)
+
+    def get_token(self):
+        """Возвращает действительный токен, при необходимости дожидаясь его получения."""
+        self.start_background_refresh()
+        started = time.perf_counter()
+        token = self.get_cached()
+        if token:
+            metrics.observe('bot_token_acquire_seconds', time.perf_counter() - started, {'source': 'cache'})
+            return token
+        entry = self.refresh()
+        metrics.observe('bot_token_acquire_seconds', time.perf_counter() - started, {'source': 'refresh'})
+        return entry['access_token'] if entry else None
+
+    def start_background_refresh(self):
+        """Запускает (однократно на процесс) фоновый поток упреждающего обновления токена.
+
+        Не блокирует вызывающего: если токена ещё нет, его получит фоновый поток.
+        """
+        with self._thread_lock:
+            if self._thread is not None and self._thread.is_alive():
+                return
+            self._thread = threading.Thread(target=self._run, name='avito-token-refresh', daemon=True)
+            self._thread.start()
+
+    def _run(self):
+        while True:
+            try:
+                entry = self.refresh(lead=PROACTIVE_REFRESH_LEAD)
+            except Exception as e:
+                logger.error(f"Ошибка фонового обновления access_token: {str(e)}")
+                entry = None
+            sleep_for = self._seconds_left(entry) - PROACTIVE_REFRESH_LEAD if entry else 0
+            time.sleep(sleep_for if sleep_for > 0 else RETRY_INTERVAL)
+
+
+token_manager = TokenManager()
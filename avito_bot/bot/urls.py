@@ -8,4 +8,10 @@ urlpatterns = [
     path('admin/', admin.site.urls),
     path('', views.index, name='index'),
     path('logs/', views.log_view, name='log_view'),
+    path('search/', views.search_view, name='search'),
+    path('analytics/', views.analytics_view, name='analytics'),
+    path('jobs/<int:job_id>/', views.job_detail, name='job_detail'),
+    path('jobs/<int:job_id>/status/', views.job_status, name='job_status'),
+    path('jobs/<int:job_id>/events/', views.job_events, name='job_events'),
+    path('metrics', views.metrics_view, name='metrics'),
 ]
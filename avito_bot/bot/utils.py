@@ -1,14 +1,17 @@
 import os
 import certifi
-import json
 import requests
 import logging
 import time
-import random
+import threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, CancelledError
+from urllib.parse import urlsplit
 from dotenv import load_dotenv
-from requests.adapters import HTTPAdapter
-from urllib3.util.retry import Retry
-from bs4 import BeautifulSoup
+from .extractors import extract_listings
+from .http_cache import response_cache
+from .http_client import get_client, pool_stats
+from .pacing import is_captcha, pace
 import urllib3  # Импортируем urllib3 для отключения предупреждений
 
 # Отключаем предупреждения о небезопасных SSL-соединениях
@@ -17,50 +20,42 @@ urllib3.disable_warnings(urllib3.exceptions.InsecureRequestWarning)
 # Загрузка переменных окружения из файла .env
 load_dotenv()
 
-# Настройка логирования
-logging.basicConfig(
-    filename='bot.log',
-    level=logging.DEBUG,  # Уровень DEBUG для детального логирования
-    format='%(asctime)s - %(levelname)s - %(message)s',
-    datefmt='%Y-%m-%d %H:%M:%S',
-    encoding='utf-8'
-)
+# Логирование настраивается в settings.LOGGING
+logger = logging.getLogger(__name__)
 
 # Avito API Credentials
 CLIENT_ID = os.getenv('AVITO_CLIENT_ID')
 CLIENT_SECRET = os.getenv('AVITO_CLIENT_SECRET')
+AVITO_API_BASE_URL = os.getenv('AVITO_API_BASE_URL', 'https://api.avito.ru')
+AVITO_BASE_URL = os.getenv('AVITO_BASE_URL', 'https://www.avito.ru')
 SCOPES = 'items:info messenger:read messenger:write seller:read'
 
 # Константа для обновления токена за 5 минут до истечения срока действия
 TOKEN_REFRESH_BUFFER = 5 * 60  # 5 минут в секундах
 
+# Максимальное число одновременных запросов к одному хосту
+MAX_CONCURRENCY_PER_HOST = int(os.getenv('AVITO_MAX_CONCURRENCY_PER_HOST', '4'))
+# Сколько раз повторять страницу после ответа 429 или капчи (каждый повтор ждёт очереди в сниженном темпе хоста)
+THROTTLED_RETRIES = 3
+
+# Семафоры ограничения параллелизма, по одному на хост
+_host_semaphores = {}
+_host_semaphores_lock = threading.Lock()
+
 
 def get_session_with_retries():
-    """Создаёт сессию с механизмом повторных попыток."""
-    session = requests.Session()
-    retries = Retry(
-        total=3,  # Общее количество попыток
-        backoff_factor=2,  # Интервал между попытками: 2, 4, 8 секунд
-        status_forcelist=[500, 502, 503, 504],  # Коды ошибок, при которых выполняется повторная попытка
-        allowed_methods=["HEAD", "GET", "OPTIONS", "POST"]
-    )
-    adapter = HTTPAdapter(max_retries=retries)
-    session.mount('https://', adapter)
-    session.mount('http://', adapter)
-    return session
-
-
-def random_delay(min_delay=2, max_delay=5):
-    """Вставляет случайную задержку между запросами."""
-    delay = random.uniform(min_delay, max_delay)
-    logging.info(f"Задержка между запросами: {delay:.2f} секунд")
-    time.sleep(delay)
-
-
-def get_avito_token(request):
-    """Получает токен доступа от Avito API с использованием client_credentials."""
-    logging.info("Начало выполнения функции get_avito_token")
-    url = 'https://api.avito.ru/token'
+    """Возвращает общий для процесса клиент Avito с пулом соединений и механизмом повторных попыток."""
+    return get_client('avito')
+
+
+def get_avito_token():
+    """Получает токен доступа от Avito API с использованием client_credentials.
+
+    Возвращает словарь с ключами access_token и expires_at (unix-время) или None при ошибке.
+    Токен нигде не сохраняется — хранением и обновлением занимается bot.tokens.token_manager.
+    """
+    logger.info("Начало выполнения функции get_avito_token")
+    url = f'{AVITO_API_BASE_URL}/token'
     payload = {
         'grant_type': 'client_credentials',
         'client_id': CLIENT_ID,
@@ -74,8 +69,9 @@ def get_avito_token(request):
     session = get_session_with_retries()
 
     try:
-        random_delay()
+        pace(url)
 
+        obtained_time = time.time()
         response = session.post(
             url,
             data=payload,
@@ -83,100 +79,203 @@ def get_avito_token(request):
             timeout=120,
             verify=False
         )
-        logging.info(f"Статус-код ответа: {response.status_code}")
+        logger.info(f"Статус-код ответа: {response.status_code}")
         response.raise_for_status()
         data = response.json()
         access_token = data.get('access_token')
         if not access_token:
-            logging.error("Не удалось получить access_token из ответа")
-            request.session['access_token'] = None
-            return
+            logger.error("Не удалось получить access_token из ответа")
+            return None
         expires_in = data.get('expires_in')  # В секундах (например, 86400 для 24 часов)
-        obtained_time = time.time()
-        request.session['access_token'] = access_token
-        request.session['token_expires_in'] = expires_in
-        request.session['token_obtained_time'] = obtained_time
-        logging.info("Успешно получили access_token через client_credentials")
+        logger.info("Успешно получили access_token через client_credentials")
+        return {
+            'access_token': access_token,
+            'expires_at': obtained_time + int(expires_in or 0),
+        }
     except Exception as e:
-        logging.error(f"Ошибка при получении access_token: {str(e)}")
-        request.session['access_token'] = None
-
-
-def is_token_expired(request):
-    """Проверяет, истёк ли токен доступа."""
-    token_obtained_time = request.session.get('token_obtained_time')
-    token_expires_in = request.session.get('token_expires_in')
-    if token_obtained_time and token_expires_in:
-        current_time = time.time()
-        if (token_obtained_time + token_expires_in - TOKEN_REFRESH_BUFFER) <= current_time:
-            return True
-        else:
-            return False
-    return True
-
-
-def ensure_valid_token(request):
-    """Убедиться, что токен доступа действителен. Если нет, получить новый."""
-    access_token = request.session.get('access_token')
-    if is_token_expired(request) or not access_token:
-        logging.info("Получение нового access_token...")
-        get_avito_token(request)
-    else:
-        logging.info("Текущий access_token действителен")
-
-
-def scrape_avito_listings(keyword_list, location='rossiya', category='nedvizhimost', max_pages=5, max_ads=10):
-    """Парсит объявления на Avito по заданным ключевым словам и возвращает список объявлений."""
-    base_url = 'https://www.avito.ru'
-    search_url = f"{base_url}/{location}/{category}?q={'+'.join(keyword_list)}"
+        logger.error(f"Ошибка при получении access_token: {str(e)}")
+        return None
+
+
+def get_host_semaphore(url):
+    """Возвращает общий для процесса семафор, ограничивающий число запросов к хосту."""
+    host = urlsplit(url).netloc
+    with _host_semaphores_lock:
+        semaphore = _host_semaphores.get(host)
+        if semaphore is None:
+            semaphore = threading.BoundedSemaphore(MAX_CONCURRENCY_PER_HOST)
+            _host_semaphores[host] = semaphore
+        return semaphore
+
+
+def fetch_page(session, url, headers, stop_event, cache_key=None, bypass_cache=False):
+    """Загружает одну страницу выдачи. Возвращает HTML или None, если поиск уже остановлен.
+
+    Страница из кэша ответов возвращается сразу, без сетевого запроса и задержки.
+    cache_key заменяет ключ кэша по URL (страницы объявлений кэшируются по item_id).
+    bypass_cache=True — загрузить страницу заново, не читая кэш (свежая копия в него записывается).
+    """
+    if stop_event.is_set():
+        return None
+    if not bypass_cache:
+        cached = response_cache.get(url, headers, key=cache_key)
+        if cached is not None:
+            return cached
+    with get_host_semaphore(url):
+        if stop_event.is_set():
+            return None
+        for attempt in range(THROTTLED_RETRIES + 1):
+            # Темп запросов к хосту подстраивается под ответы Avito (см. bot.pacing)
+            if not pace(url, stop_event):
+                return None
+            response = session.get(url, headers=headers, timeout=60, verify=certifi.where())
+            captcha = is_captcha(response)
+            if (response.status_code != 429 and not captcha) or attempt == THROTTLED_RETRIES:
+                break
+            logger.warning(f"Avito ответил {'капчей' if captcha else '429'} на {url}, повтор в сниженном темпе")
+        response.raise_for_status()
+        if captcha:
+            # Страница с капчей не кэшируется и не разбирается как пустая выдача
+            raise requests.exceptions.HTTPError(f"Avito ответил капчей на {url}", response=response)
+        # Поиск мог завершиться, пока шёл запрос: его загрузки не ждут, и запоздавший ответ
+        # не записывается в кэш после возврата из scrape_avito_listings
+        if stop_event.is_set():
+            return None
+        response_cache.set(url, response.text, headers, key=cache_key)
+        return response.text
+
+
+class _QueryCrawl:
+    """Обход страниц одного поискового запроса с опережающей загрузкой следующих страниц."""
+
+    def __init__(self, executor, session, search_url, headers, max_pages, window, stop_event, before_fetch=None,
+                 bypass_cache=False):
+        self.executor = executor
+        self.session = session
+        self.search_url = search_url
+        self.headers = headers
+        self.max_pages = max_pages
+        self.window = window
+        self.stop_event = stop_event
+        self.before_fetch = before_fetch
+        self.bypass_cache = bypass_cache
+        self.next_page = 1
+        self.pending = deque()
+
+    def submit_more(self):
+        """Ставит в очередь страницы, пока не заполнено окно опережения."""
+        while len(self.pending) < self.window and self.next_page <= self.max_pages:
+            url = f"{self.search_url}&p={self.next_page}"
+            if self.before_fetch is not None:
+                self.before_fetch()
+            future = self.executor.submit(fetch_page, self.session, url, self.headers, self.stop_event,
+                                          bypass_cache=self.bypass_cache)
+            self.pending.append((self.next_page, url, future))
+            self.next_page += 1
+
+    def cancel(self):
+        """Отменяет ещё не начатые загрузки этого запроса."""
+        while self.pending:
+            _, _, future = self.pending.popleft()
+            future.cancel()
+        self.next_page = self.max_pages + 1
+
+    def pages(self):
+        """Возвращает загруженные страницы строго по порядку."""
+        self.submit_more()
+        while self.pending:
+            page, url, future = self.pending.popleft()
+            logger.info(f"Парсинг страницы {page}: {url}")
+            try:
+                html = future.result()
+            except CancelledError:
+                return
+            except requests.exceptions.RequestException as e:
+                logger.error(f"Ошибка при парсинге страницы {page}: {e}")
+                self.cancel()
+                return
+            if html is None:
+                return
+            yield page, html
+            # Следующую страницу ставим в очередь, только когда потребитель попросил продолжение:
+            # после break (например, страница без новых объявлений) лишних запросов нет
+            self.submit_more()
+
+
+def scrape_avito_listings(keyword_list, location='rossiya', category='nedvizhimost', max_pages=5, max_ads=10,
+                          split_keywords=False, on_page=None, seen_index=None, before_fetch=None, bypass_cache=False):
+    """Парсит объявления на Avito по заданным ключевым словам и возвращает список объявлений.
+
+    Страницы (и, при split_keywords=True, отдельные запросы по каждому ключевому слову)
+    загружаются параллельно, не более MAX_CONCURRENCY_PER_HOST запросов к хосту одновременно.
+    Порядок результатов сохраняется: сначала запросы в порядке ключевых слов, внутри — страницы по порядку.
+    После набора max_ads оставшиеся загрузки отменяются.
+    Если передан on_page, он вызывается как on_page(query, page, ads) для каждой разобранной страницы.
+
+    Инкрементальный режим включается передачей seen_index (см. bot.seen.SeenItemIndex):
+    возвращаются только новые объявления, а обход запроса прекращается на первой странице,
+    где все объявления уже известны. Страницы в этом режиме загружаются без опережения,
+    чтобы не скачивать лишнего; отметить объявления просмотренными (mark_seen) должен
+    вызывающий после их сохранения. Кэш ответов в этом режиме не читается: закэшированная
+    страница состоит из уже просмотренных объявлений, и обход остановился бы, не увидев новых.
+    bypass_cache=True отключает чтение кэша и для обычного обхода.
+
+    before_fetch, если передан, вызывается перед постановкой каждой страницы в очередь
+    загрузки и может задержать её (например, бюджет страниц мониторинга).
+    """
+    base_url = AVITO_BASE_URL
+    queries = list(keyword_list) if split_keywords else ['+'.join(keyword_list)]
     headers = {
         'User-Agent': 'Mozilla/5.0'
     }
 
     session = get_session_with_retries()
+    stop_event = threading.Event()
     all_ads = []
+    bypass_cache = bypass_cache or seen_index is not None
 
-    for page in range(1, max_pages + 1):
-        paginated_url = f"{search_url}&p={page}"
-        logging.info(f"Парсинг страницы {page}: {paginated_url}")
-
-        random_delay()
-
-        try:
-            response = session.get(paginated_url, headers=headers, timeout=60, verify=certifi.where())
-            response.raise_for_status()
-            soup = BeautifulSoup(response.text, 'lxml')
-            listings = soup.find_all('div', {'data-marker': 'item'})
-
-            for listing in listings:
-                title_tag = listing.find('h3')
-                title = title_tag.get_text(strip=True) if title_tag else 'Без названия'
-
-                price_tag = listing.find('span', {'itemprop': 'price'})
-                price = price_tag.get_text(strip=True) if price_tag else 'Не указано'
-
-                url_tag = listing.find('a', {'itemprop': 'url'})
-                url = base_url + url_tag['href'] if url_tag else '#'
-
-                ad = {
-                    'title': title,
-                    'price': price,
-                    'url': url,
-                }
-                all_ads.append(ad)
+    executor = ThreadPoolExecutor(max_workers=MAX_CONCURRENCY_PER_HOST)
+    crawls = []
+    try:
+        for query in queries:
+            search_url = f"{base_url}/{location}/{category}?q={query}"
+            window = 1 if seen_index is not None else MAX_CONCURRENCY_PER_HOST
+            crawl = _QueryCrawl(executor, session, search_url, headers, max_pages, window, stop_event, before_fetch,
+                                bypass_cache)
+            crawl.submit_more()
+            crawls.append((query, crawl))
+
+        for query, crawl in crawls:
+            for page, html in crawl.pages():
+                ads, has_next = extract_listings(html, base_url, page)
+                for ad in ads:
+                    ad['keyword'] = query
+                if seen_index is not None:
+                    page_size = len(ads)
+                    ads = seen_index.filter_new(query, location, ads)
+                    if page_size and not ads:
+                        logger.info(f"На странице {page} нет новых объявлений, обход запроса остановлен")
+                        crawl.cancel()
+                        break
+                if on_page:
+                    on_page(query, page, ads)
+                all_ads.extend(ads)
 
                 if len(all_ads) >= max_ads:
-                    logging.info("Достигнуто максимальное количество объявлений")
-                    return all_ads
-
-            pagination = soup.find('div', {'data-marker': 'pagination'})
-            if not pagination or f"?p={page + 1}" not in pagination.get_text():
-                logging.info("Больше страниц нет.")
-                break
-
-        except requests.exceptions.RequestException as e:
-            logging.error(f"Ошибка при парсинге страницы {page}: {e}")
-            break
-
-    logging.info(f"Всего найдено объявлений: {len(all_ads)}")
+                    logger.info("Достигнуто максимальное количество объявлений")
+                    return all_ads[:max_ads]
+
+                if not has_next:
+                    logger.info("Больше страниц нет.")
+                    crawl.cancel()
+                    break
+    finally:
+        # Останавливаем загрузки, которые ещё выполняются, и отменяем ожидающие в очереди
+        stop_event.set()
+        for _, crawl in crawls:
+            crawl.cancel()
+        executor.shutdown(wait=False, cancel_futures=True)
+
+    logger.info(f"Всего найдено объявлений: {len(all_ads)}")
+    logger.info(f"Статистика пулов соединений: {pool_stats()}")
     return all_ads[:max_ads]
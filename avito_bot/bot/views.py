@@ -1,15 +1,43 @@
-from django.shortcuts import render
+import json
+import time
+from datetime import datetime, timedelta
+
+from django.conf import settings
+from django.http import HttpResponse, JsonResponse, StreamingHttpResponse
+from django.shortcuts import render, redirect, get_object_or_404
+from django.template.loader import render_to_string
+from django.utils import timezone
+from django.utils.html import escape
 from .forms import MessageForm
-from .utils import scrape_avito_listings, ensure_valid_token
+from .jobs import enqueue_search
+from .logreader import read_log_page
+from . import metrics
+from .models import Keyword, Message, PriceRollup, SearchJob
+from .search import search_ads, search_log_responses
+from .tokens import token_manager
 import logging
 
-# Настройка логирования
-logging.basicConfig(
-    filename='bot.log',
-    level=logging.INFO,
-    format='%(asctime)s - %(levelname)s - %(message)s',
-    datefmt='%Y-%m-%d %H:%M:%S'
-)
+# Логирование настраивается в settings.LOGGING
+logger = logging.getLogger(__name__)
+
+# Сколько результатов полнотекстового поиска показывать на одной странице
+SEARCH_PAGE_SIZE = 20
+
+# Сколько записей лога показывать на одной странице
+LOG_PAGE_SIZE = 200
+LOG_LEVELS = ['DEBUG', 'INFO', 'WARNING', 'ERROR', 'CRITICAL']
+
+# Период аналитики цен по умолчанию и наибольший, дни; сколько строк сводки показывать
+ANALYTICS_DEFAULT_DAYS = 30
+ANALYTICS_MAX_DAYS = 365
+ANALYTICS_MAX_ROWS = 1000
+
+# Как часто поток событий задания проверяет новые объявления (секунды)
+JOB_EVENTS_POLL_INTERVAL = 0.5
+# Сколько держать соединение SSE открытым; браузер переподключится сам с Last-Event-ID.
+# Под WSGI поток занимает воркер целиком, поэтому соединение короткое: воркеры
+# освобождаются для других запросов, а переподключение стоит одного запроса
+JOB_EVENTS_MAX_DURATION = 30
 
 KEYWORD_CHOICES = [
     ("Аренда офиса", "Аренда офиса"),
@@ -23,10 +51,11 @@ KEYWORD_CHOICES = [
 ]
 
 def index(request):
-    logging.info(f"Запрос получен, метод: {request.method}")
+    logger.info(f"Запрос получен, метод: {request.method}")
 
     if request.method == 'GET':
-        ensure_valid_token(request)
+        # Токен получается и обновляется в фоне, страница не ждёт запроса к API
+        token_manager.start_background_refresh()
         message_form = MessageForm()
         return render(request, 'index.html', {
             'message_form': message_form,
@@ -38,37 +67,216 @@ def index(request):
         selected_keywords = request.POST.getlist('keywords')
 
         if not selected_keywords:
-            logging.error("Ключевые слова не выбраны")
+            logger.error("Ключевые слова не выбраны")
             return render(request, 'index.html', {
                 'error': 'Вы должны выбрать хотя бы одно ключевое слово!',
                 'message_form': message_form,
                 'keywords': KEYWORD_CHOICES
             })
 
-        logging.info(f"Выбраны ключевые слова: {selected_keywords}")
+        logger.info(f"Выбраны ключевые слова: {selected_keywords}")
 
-        ads = scrape_avito_listings(selected_keywords, max_ads=10)
+        parse_method = 'scrape'
+        message = None
+        if message_form.is_valid():
+            parse_method = message_form.cleaned_data['parse_method']
+            if message_form.cleaned_data['content']:
+                message = Message.objects.create(content=message_form.cleaned_data['content'])
 
-        if ads:
-            return render(request, 'results.html', {
-                'ads': ads,
-                'keywords': selected_keywords
-            })
-        else:
-            logging.error(f"По ключевым словам {selected_keywords} ничего не найдено")
+        # Поиск (и рассылка, если указано сообщение) выполняется воркером в фоне,
+        # пользователь сразу получает страницу задания
+        job = enqueue_search(selected_keywords, parse_method=parse_method, max_ads=10, message=message)
+        return redirect('job_detail', job_id=job.pk)
+
+
+def job_detail(request, job_id):
+    """Страница задания: прогресс, пока поиск выполняется, и результаты после завершения."""
+    job = get_object_or_404(SearchJob, pk=job_id)
+
+    if job.status == SearchJob.STATUS_DONE:
+        ads = list(job.ads.order_by('id'))
+        if not ads:
+            logger.error(f"По ключевым словам {job.keywords} ничего не найдено")
             return render(request, 'results.html', {
                 'ads': [],
-                'keywords': selected_keywords,
+                'keywords': job.keywords,
                 'error': 'По вашему запросу ничего не найдено.'
             })
+        return render(request, 'results.html', {
+            'ads': ads,
+            'keywords': job.keywords
+        })
+
+    return render(request, 'job_status.html', {'job': job})
+
+
+def job_status(request, job_id):
+    """JSON с состоянием задания для опроса со страницы прогресса."""
+    job = get_object_or_404(SearchJob, pk=job_id)
+    return JsonResponse({
+        'id': job.pk,
+        'status': job.status,
+        'pages_done': job.pages_done,
+        'ads_found': job.ads_found,
+        'error': job.error,
+    })
+
+def _sse(event, data, event_id=None):
+    """Одно событие в формате text/event-stream."""
+    lines = []
+    if event_id is not None:
+        lines.append(f"id: {event_id}")
+    lines.append(f"event: {event}")
+    lines.append(f"data: {json.dumps(data, ensure_ascii=False)}")
+    return '\n'.join(lines) + '\n\n'
+
+
+def job_events(request, job_id):
+    """Поток событий (SSE) задания: новые объявления по мере разбора страниц и прогресс.
+
+    Событие ads несёт пакет объявлений, связанных с заданием после предыдущего события.
+    Поток идёт по связям JobAd, а не по id объявлений: объявление, сохранённое раньше
+    другим заданием, получает новую связь и тоже попадает в поток. id события — последний
+    id связи, поэтому при переподключении браузер продолжает с места обрыва
+    (заголовок Last-Event-ID). Событие progress повторяет ответ job_status.
+    Поток закрывается событием end, когда задание завершено и все объявления отправлены.
+    """
+    job = get_object_or_404(SearchJob, pk=job_id)
+    last_id = request.headers.get('Last-Event-ID', '')
+    last_id = int(last_id) if last_id.isdigit() else 0
+
+    def stream():
+        nonlocal last_id
+        deadline = time.monotonic() + JOB_EVENTS_MAX_DURATION
+        progress = None
+        while time.monotonic() < deadline:
+            # Состояние читаем до объявлений: если задание уже завершено, эта выборка последняя
+            state = SearchJob.objects.values('status', 'pages_done', 'ads_found', 'error').get(pk=job.pk)
+            links = list(
+                job.ad_links.filter(pk__gt=last_id).order_by('pk')
+                .values('pk', 'ad_id', 'ad__title', 'ad__url', 'ad__price')
+            )
+            if links:
+                last_id = links[-1]['pk']
+                yield _sse('ads', [
+                    {'id': link['ad_id'], 'title': link['ad__title'], 'url': link['ad__url'],
+                     'price': str(link['ad__price']) if link['ad__price'] is not None else None}
+                    for link in links
+                ], event_id=last_id)
+            if state != progress:
+                progress = state
+                yield _sse('progress', state)
+            if state['status'] in (SearchJob.STATUS_DONE, SearchJob.STATUS_FAILED):
+                yield _sse('end', state)
+                return
+            time.sleep(JOB_EVENTS_POLL_INTERVAL)
+
+    response = StreamingHttpResponse(stream(), content_type='text/event-stream')
+    response['Cache-Control'] = 'no-cache'
+    # Отключаем буферизацию ответа в nginx, иначе события придут пачкой в конце
+    response['X-Accel-Buffering'] = 'no'
+    return response
+
+
+def _parse_log_time(value):
+    """Разбирает время из поля datetime-local ('2024-09-18T09:00'); пустое или неверное значение — None."""
+    try:
+        return datetime.strptime(value, '%Y-%m-%dT%H:%M') if value else None
+    except ValueError:
+        return None
+
 
 def log_view(request):
-    """Функция для отображения логов приложения."""
-    logs = []
+    """Функция для отображения логов приложения.
+
+    Показывает последние записи bot.log и его ротированных копий постранично, читая с конца,
+    и отдаёт страницу потоком, не собирая её целиком в памяти.
+    """
+    # Курсор 'inode:смещение' (см. bot.logreader); некорректный курсор читает с конца лога
+    before = request.GET.get('before') or None
+    levels = set(request.GET.getlist('level'))
+    since = _parse_log_time(request.GET.get('since'))
+    until = _parse_log_time(request.GET.get('until'))
+
     try:
-        with open('bot.log', 'r', encoding='utf-8') as f:
-            logs = f.readlines()
+        records, next_before = read_log_page(settings.BOT_LOG_FILE, before=before, limit=LOG_PAGE_SIZE,
+                                             levels=levels, since=since, until=until)
     except FileNotFoundError:
-        logging.error("Лог-файл не найден.")
+        logger.error("Лог-файл не найден.")
+        records, next_before = [], None
+
+    older_url = None
+    if next_before is not None:
+        params = request.GET.copy()
+        params['before'] = next_before
+        older_url = f"?{params.urlencode()}"
+
+    def stream():
+        yield render_to_string('log_view_header.html', {
+            'levels': LOG_LEVELS,
+            'selected_levels': levels,
+            'since': request.GET.get('since', ''),
+            'until': request.GET.get('until', ''),
+            'has_logs': bool(records),
+        }, request=request)
+        for _, _, text in records:
+            yield escape(text) + '\n'
+        yield render_to_string('log_view_footer.html', {
+            'has_logs': bool(records),
+            'older_url': older_url,
+        }, request=request)
+
+    return StreamingHttpResponse(stream(), content_type='text/html; charset=utf-8')
+
+
+def search_view(request):
+    """Полнотекстовый поиск по сохранённым объявлениям или ответам из лога рассылки."""
+    query = request.GET.get('q', '').strip()
+    scope = request.GET.get('scope', 'ads')
+    try:
+        page = max(int(request.GET.get('page', 1)), 1)
+    except ValueError:
+        page = 1
+
+    results = []
+    if query:
+        search = search_log_responses if scope == 'logs' else search_ads
+        results = search(query, limit=SEARCH_PAGE_SIZE, offset=(page - 1) * SEARCH_PAGE_SIZE)
+
+    return render(request, 'search.html', {
+        'query': query,
+        'scope': scope,
+        'results': results,
+        'page': page,
+        'has_next': len(results) == SEARCH_PAGE_SIZE,
+    })
+
+
+def analytics_view(request):
+    """Сводка цен по ключевым словам, дням и регионам. Читает только PriceRollup, не AvitoAd."""
+    try:
+        days = min(max(int(request.GET.get('days', ANALYTICS_DEFAULT_DAYS)), 1), ANALYTICS_MAX_DAYS)
+    except ValueError:
+        days = ANALYTICS_DEFAULT_DAYS
+    keyword_id = request.GET.get('keyword', '')
+    region = request.GET.get('region', '')
+
+    rollups = PriceRollup.objects.filter(day__gte=timezone.now().date() - timedelta(days=days - 1))
+    if keyword_id.isdigit():
+        rollups = rollups.filter(keyword_id=int(keyword_id))
+    if region:
+        rollups = rollups.filter(region=region)
+
+    return render(request, 'analytics.html', {
+        'rollups': rollups.select_related('keyword').order_by('-day', 'keyword__word', 'region')[:ANALYTICS_MAX_ROWS],
+        'keywords': Keyword.objects.filter(pk__in=PriceRollup.objects.values('keyword_id')).order_by('word'),
+        'regions': PriceRollup.objects.values_list('region', flat=True).distinct().order_by('region'),
+        'days': days,
+        'keyword_id': keyword_id,
+        'region': region,
+    })
+
 
-    return render(request, 'log_view.html', {'logs': logs})
+def metrics_view(request):
+    """Метрики всех процессов бота в текстовом формате Prometheus."""
+    return HttpResponse(metrics.render_prometheus(), content_type='text/plain; version=0.0.4; charset=utf-8')
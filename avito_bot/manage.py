@@ -6,7 +6,9 @@ import sys
 
 def main():
     """Run administrative tasks."""
-    os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'avito_bot.settings')
+    # Тесты пишут лог, кэш и метрики во временные файлы (avito_bot.test_settings)
+    settings_module = 'avito_bot.test_settings' if sys.argv[1:2] == ['test'] else 'avito_bot.settings'
+    os.environ.setdefault('DJANGO_SETTINGS_MODULE', settings_module)
     try:
         from django.core.management import execute_from_command_line
     except ImportError as exc: